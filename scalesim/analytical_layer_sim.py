@@ -0,0 +1,371 @@
+import math
+
+from scalesim.scale_config import scale_config as cfg
+from scalesim.topology_utils import topologies as topo
+from scalesim.compute.operand_matrix import calc_layer_groups_per_pack
+from scalesim.utilities.profiler import stage_profiler
+
+
+# Closed form model of a layer, used in place of single_layer_sim when SimulationMode is analytical
+# The compute and SRAM figures follow the fold structure of the demand matrices of each dataflow,
+# assuming that the memory never stalls (as in the CALC bandwidth mode).
+# No traces are generated, the DRAM figures are estimated from the operand footprints.
+class analytical_layer_sim:
+    def __init__(self):
+        self.layer_id = 0
+        self.topo = topo()
+        self.config = cfg()
+
+        self.verbose = True
+        self.dataflow = 'ws'
+        self.profiler = stage_profiler()
+
+        # Operand dimensions as seen by the array
+        self.Sr, self.Sc, self.T = 1, 1, 1
+        self.arr_row, self.arr_col = 1, 1
+        self.row_fold, self.col_fold = 1, 1
+
+        # Report items : Compute report
+        self.total_cycles = 0
+        self.stall_cycles = 0
+        self.num_compute = 0
+        self.num_mac_unit = 0
+        self.overall_util = 0
+        self.mapping_eff = 0
+        self.compute_util = 0
+
+        # Report items : BW report
+        self.avg_ifmap_sram_bw = 0
+        self.avg_filter_sram_bw = 0
+        self.avg_ofmap_sram_bw = 0
+        self.avg_ifmap_dram_bw = 0
+        self.avg_filter_dram_bw = 0
+        self.avg_ofmap_dram_bw = 0
+
+        # Report items : Access counts
+        self.ifmap_sram_reads = 0
+        self.filter_sram_reads = 0
+        self.ofmap_sram_writes = 0
+        self.ifmap_dram_reads = 0
+        self.filter_dram_reads = 0
+        self.ofmap_dram_writes = 0
+
+        # Report items : DRAM access windows, see calc_dram_windows()
+        self.ifmap_dram_start_cycle, self.ifmap_dram_stop_cycle = 0, 0
+        self.filter_dram_start_cycle, self.filter_dram_stop_cycle = 0, 0
+        self.ofmap_dram_start_cycle, self.ofmap_dram_stop_cycle = 0, 0
+
+        self.params_set_flag = False
+        self.runs_ready = False
+        self.report_items_ready = False
+
+    #
+    def set_params(self,
+                   layer_id=0,
+                   config_obj=cfg(), topology_obj=topo(),
+                   verbose=True):
+
+        self.layer_id = layer_id
+        self.config = config_obj
+        self.topo = topology_obj
+
+        self.dataflow = self.config.get_dataflow()
+        self.arr_row, self.arr_col = self.config.get_array_dims()
+        self.num_mac_unit = self.arr_row * self.arr_col
+        self.verbose = verbose
+
+        self.profiler = stage_profiler()
+        if self.config.get_profile_mode() == 'cprofile':
+            self.profiler.enable_cprofile()
+
+        self.params_set_flag = True
+
+    # No traces are generated in this mode
+    def set_trace_path(self, top_path=''):
+        return
+
+    #
+    def run(self):
+        assert self.params_set_flag, 'Parameters are not set. Run set_params()'
+
+        self.profiler.start('analytical_model')
+        self.run_model()
+        self.profiler.stop()
+
+        self.runs_ready = True
+
+    #
+    def run_model(self):
+        ofmap_rows, ofmap_cols = self.topo.get_layer_ofmap_dims(self.layer_id)
+        ofmap_px_per_filt = int(ofmap_rows * ofmap_cols)
+        window_size = int(self.topo.get_layer_window_size(self.layer_id))
+        num_filters = int(self.topo.get_layer_num_filters(self.layer_id))
+
+        self.num_compute = self.topo.get_layer_num_ofmap_px(self.layer_id) \
+                           * self.topo.get_layer_window_size(self.layer_id)
+
+        num_groups = self.topo.get_layer_num_groups(self.layer_id)
+        if num_groups > 1:
+            self.calc_grouped_compute_items(ofmap_px_per_filt, window_size, num_filters, num_groups)
+            self.calc_dram_estimates(ofmap_px_per_filt, window_size, num_filters, num_groups)
+            return
+
+        # Same mapping of the operand matrices on the array as in the systolic_compute_* classes
+        if self.dataflow == 'os':
+            self.Sr, self.Sc, self.T = ofmap_px_per_filt, num_filters, window_size
+        elif self.dataflow == 'ws':
+            self.Sr, self.Sc, self.T = window_size, num_filters, ofmap_px_per_filt
+        else:
+            self.Sr, self.Sc, self.T = window_size, ofmap_px_per_filt, num_filters
+
+        self.row_fold = math.ceil(self.Sr / self.arr_row)
+        self.col_fold = math.ceil(self.Sc / self.arr_col)
+
+        self.calc_compute_items()
+        self.calc_dram_estimates(ofmap_px_per_filt, window_size, num_filters)
+
+    # Demand rows, utilization cycles and SRAM accesses of the folds, see the create_*_demand_fold() methods
+    def calc_fold_items(self, Sr, Sc, T):
+        R, C = self.arr_row, self.arr_col
+        row_fold = math.ceil(Sr / R)
+        col_fold = math.ceil(Sc / C)
+        num_folds = row_fold * col_fold
+
+        if self.dataflow == 'os':
+            demand_rows_per_fold = T + R + C - 2
+            util_cycles_per_fold = T + R + C - 2
+            ifmap_sram_reads = col_fold * T * Sr
+            filter_sram_reads = row_fold * T * Sc
+            # The OFMAP writes also count the drain of each fold
+            ofmap_sram_writes = Sr * Sc + num_folds * (R + C)
+        elif self.dataflow == 'ws':
+            demand_rows_per_fold = 2 * R + C + T - 2
+            util_cycles_per_fold = 2 * R + 2 * C + T - 3
+            ifmap_sram_reads = col_fold * T * Sr
+            filter_sram_reads = Sr * Sc
+            ofmap_sram_writes = row_fold * T * Sc
+        else:
+            demand_rows_per_fold = 2 * R + C + T - 2
+            util_cycles_per_fold = 2 * R + 2 * C + T - 3
+            ifmap_sram_reads = Sr * Sc
+            filter_sram_reads = col_fold * T * Sr
+            ofmap_sram_writes = row_fold * T * Sc
+
+        return num_folds, demand_rows_per_fold, util_cycles_per_fold, \
+            ifmap_sram_reads, filter_sram_reads, ofmap_sram_writes
+
+    #
+    def calc_compute_items(self):
+        R, C, T = self.arr_row, self.arr_col, self.T
+
+        num_folds, demand_rows_per_fold, util_cycles_per_fold, \
+            self.ifmap_sram_reads, self.filter_sram_reads, self.ofmap_sram_writes \
+            = self.calc_fold_items(self.Sr, self.Sc, self.T)
+
+        # The last demand row is serviced at cycle (num rows - 1) when there are no stalls
+        self.total_cycles = num_folds * demand_rows_per_fold - 1
+        self.stall_cycles = 0
+
+        # The MACs used summed over the folds is Sr * Sc
+        self.mapping_eff = (self.Sr * self.Sc) / (R * C * num_folds) * 100
+        self.compute_util = (self.Sr * self.Sc * T) / (R * C * util_cycles_per_fold * num_folds) * 100
+        self.overall_util = (self.num_compute * 100) / (self.total_cycles * self.num_mac_unit)
+
+    # The packs of groups are run one after the other, see systolic_compute_grouped
+    # All the packs hold the same number of groups but the last one
+    def calc_grouped_compute_items(self, ofmap_px_per_filt, window_size, num_filters, num_groups):
+        R, C = self.arr_row, self.arr_col
+        filters_per_group = num_filters // num_groups
+        groups_per_pack = calc_layer_groups_per_pack(self.config, self.topo, layer_id=self.layer_id)
+        pack_list = [(num_groups // groups_per_pack, groups_per_pack), (1, num_groups % groups_per_pack)]
+
+        total_folds, total_demand_rows = 0, 0
+        mac_used, compute_util_sum = 0, 0
+        self.ifmap_sram_reads, self.filter_sram_reads, self.ofmap_sram_writes = 0, 0, 0
+        for num_packs, pack_groups in pack_list:
+            if num_packs == 0 or pack_groups == 0:
+                continue
+
+            pack_window_size = pack_groups * window_size
+            pack_num_filters = pack_groups * filters_per_group
+            if self.dataflow == 'os':
+                Sr, Sc, T = ofmap_px_per_filt, pack_num_filters, pack_window_size
+            elif self.dataflow == 'ws':
+                Sr, Sc, T = pack_window_size, pack_num_filters, ofmap_px_per_filt
+            else:
+                Sr, Sc, T = pack_window_size, ofmap_px_per_filt, pack_num_filters
+
+            num_folds, demand_rows_per_fold, util_cycles_per_fold, \
+                ifmap_sram_reads, filter_sram_reads, ofmap_sram_writes = self.calc_fold_items(Sr, Sc, T)
+
+            total_folds += num_packs * num_folds
+            total_demand_rows += num_packs * num_folds * demand_rows_per_fold
+            self.ifmap_sram_reads += num_packs * ifmap_sram_reads
+            # Only the diagonal blocks of the filter matrix of a pack are read
+            self.filter_sram_reads += num_packs * (filter_sram_reads // pack_groups)
+            self.ofmap_sram_writes += num_packs * ofmap_sram_writes
+
+            # The filter matrix is mapped on the array in the WS dataflow
+            if self.dataflow == 'ws':
+                mac_used += num_packs * Sr * Sc / pack_groups
+            else:
+                mac_used += num_packs * Sr * Sc
+            compute_util_sum += num_packs * Sr * Sc * T / (pack_groups * util_cycles_per_fold)
+
+        self.total_cycles = total_demand_rows - 1
+        self.stall_cycles = 0
+
+        self.mapping_eff = mac_used / (R * C * total_folds) * 100
+        self.compute_util = compute_util_sum / (R * C * total_folds) * 100
+        self.overall_util = (self.num_compute * 100) / (self.total_cycles * self.num_mac_unit)
+
+    # Each input operand element is assumed to be read from the DRAM once, which holds when it fits in the
+    # active half of its buffer, otherwise the reads are a lower bound
+    # The window of a grouped convolution only covers the channels of a group
+    def calc_dram_estimates(self, ofmap_px_per_filt, window_size, num_filters, num_groups=1):
+        ifmap_rows, ifmap_cols = self.topo.get_layer_ifmap_dims(self.layer_id)
+        num_channels = self.topo.get_layer_num_channels(self.layer_id)
+
+        # With strides larger than the filter not all the IFMAP is read
+        self.ifmap_dram_reads = min(int(ifmap_rows * ifmap_cols * num_channels),
+                                    ofmap_px_per_filt * window_size * num_groups)
+        self.filter_dram_reads = window_size * num_filters
+        # The partial sums of each row fold are written back in the WS and IS dataflows
+        if self.dataflow == 'os':
+            self.ofmap_dram_writes = ofmap_px_per_filt * num_filters
+        else:
+            self.ofmap_dram_writes = self.ofmap_sram_writes
+
+        self.calc_dram_windows()
+
+    # Cycles of the DRAM accesses as placed by the memory system in the CALC bandwidth mode
+    # The word size and the active fraction of the buffers are those of single_layer_sim.run_memory()
+    def calc_dram_windows(self):
+        ifmap_sram_kb, filter_sram_kb, ofmap_sram_kb = self.config.get_mem_sizes()
+
+        self.ifmap_dram_start_cycle, self.ifmap_dram_stop_cycle \
+            = self.calc_read_window(self.ifmap_dram_reads, int(1024 * ifmap_sram_kb))
+        self.filter_dram_start_cycle, self.filter_dram_stop_cycle \
+            = self.calc_read_window(self.filter_dram_reads, int(1024 * filter_sram_kb))
+        self.ofmap_dram_start_cycle, self.ofmap_dram_stop_cycle \
+            = self.calc_write_window(self.ofmap_dram_writes, int(1024 * ofmap_sram_kb))
+
+    # See ReadBufferEstimateBw: the buffer is prefetched in sets of 1/100 of its size at 10 words per cycle,
+    # ending the cycle before the first request. When the operand does not fit in the active half, the
+    # prefetch of each following half is issued when its first set is requested, the last one ends with
+    # the last prefetch. The requests are assumed to be spread evenly over the layer.
+    def calc_read_window(self, num_reads, buf_size_elems, bandwidth=10, latency=1):
+        items_per_set = max(1, buf_size_elems // 100)
+        num_sets_active = 50
+        num_sets_prefetch = 100 - num_sets_active
+
+        num_full_sets = num_reads // items_per_set
+        if num_full_sets < num_sets_active:
+            num_sets = math.ceil(num_reads / items_per_set)
+            cycles_needed = math.ceil(num_sets * items_per_set / bandwidth)
+            return -cycles_needed, -1
+
+        cycles_needed = math.ceil(num_sets_prefetch * items_per_set / bandwidth)
+        num_prefetches = (num_full_sets - num_sets_active) // num_sets_prefetch
+        last_prefetch_reads = (num_sets_active + num_prefetches * num_sets_prefetch) * items_per_set
+        last_prefetch_cycle = math.floor(self.total_cycles * last_prefetch_reads / num_reads)
+
+        return -cycles_needed, last_prefetch_cycle + latency
+
+    # See write_buffer: the drain half is written back once it is full, at one line of ArrayWidth words
+    # per cycle, and the rest is drained after the last OFMAP write, at cycle total_cycles
+    # The writes are assumed to be spread evenly over the layer.
+    def calc_write_window(self, num_writes, buf_size_elems):
+        drain_buf_size = buf_size_elems - int(math.ceil(buf_size_elems * 0.5))
+        bandwidth = self.arr_col
+
+        if num_writes <= drain_buf_size:
+            return self.total_cycles, self.total_cycles + math.ceil(num_writes / bandwidth) - 1
+
+        num_drains = (num_writes - 1) // drain_buf_size
+        first_drain_cycle = math.floor(self.total_cycles * (drain_buf_size + 1) / num_writes)
+        last_drain_writes = num_writes - num_drains * drain_buf_size
+
+        return first_drain_cycle, self.total_cycles + math.ceil(last_drain_writes / bandwidth) - 1
+
+    #
+    def calc_report_data(self):
+        assert self.runs_ready, 'Runs are not done yet'
+
+        self.avg_ifmap_sram_bw = self.ifmap_sram_reads / self.total_cycles
+        self.avg_filter_sram_bw = self.filter_sram_reads / self.total_cycles
+        self.avg_ofmap_sram_bw = self.ofmap_sram_writes / self.total_cycles
+
+        # Same as the simulation, the DRAM accesses are averaged over their window
+        self.avg_ifmap_dram_bw = self.ifmap_dram_reads \
+                                 / (self.ifmap_dram_stop_cycle - self.ifmap_dram_start_cycle + 1)
+        self.avg_filter_dram_bw = self.filter_dram_reads \
+                                  / (self.filter_dram_stop_cycle - self.filter_dram_start_cycle + 1)
+        self.avg_ofmap_dram_bw = self.ofmap_dram_writes \
+                                 / (self.ofmap_dram_stop_cycle - self.ofmap_dram_start_cycle + 1)
+
+        self.report_items_ready = True
+
+    #
+    def get_layer_id(self):
+        assert self.params_set_flag, 'Parameters are not set yet'
+        return self.layer_id
+
+    #
+    def get_compute_report_items(self):
+        if not self.report_items_ready:
+            self.calc_report_data()
+
+        items = [self.total_cycles, self.stall_cycles, self.overall_util, self.mapping_eff, self.compute_util]
+        return items
+
+    #
+    def get_bandwidth_report_items(self):
+        if not self.report_items_ready:
+            self.calc_report_data()
+
+        items = [self.avg_ifmap_sram_bw, self.avg_filter_sram_bw, self.avg_ofmap_sram_bw]
+        items += [self.avg_ifmap_dram_bw, self.avg_filter_dram_bw, self.avg_ofmap_dram_bw]
+
+        return items
+
+    # The SRAM accesses are spread over the whole layer, the start and stop cycles are those of the layer
+    def get_detail_report_items(self):
+        if not self.report_items_ready:
+            self.calc_report_data()
+
+        start_cycle, stop_cycle = 0.0, float(self.total_cycles - 1)
+
+        items = [start_cycle, stop_cycle, self.ifmap_sram_reads]
+        items += [start_cycle, stop_cycle, self.filter_sram_reads]
+        items += [start_cycle, stop_cycle, self.ofmap_sram_writes]
+        items += [float(self.ifmap_dram_start_cycle), float(self.ifmap_dram_stop_cycle), self.ifmap_dram_reads]
+        items += [float(self.filter_dram_start_cycle), float(self.filter_dram_stop_cycle), self.filter_dram_reads]
+        items += [float(self.ofmap_dram_start_cycle), float(self.ofmap_dram_stop_cycle), self.ofmap_dram_writes]
+
+        return items
+
+    #
+    def get_report_items(self):
+        return self.get_compute_report_items(), self.get_bandwidth_report_items(), self.get_detail_report_items()
+
+    #
+    def save_traces(self, top_path):
+        print('WARNING: No traces are generated in the analytical simulation mode')
+
+    # List of [stage, time in s, peak memory in MB]
+    def get_profile_items(self):
+        return self.profiler.get_profile_items()
+
+    # There are no demand matrices to analyze
+    def get_reuse_profile_items(self):
+        return []
+
+    #
+    def dump_cprofile(self, filename):
+        self.profiler.dump_cprofile(filename)
+
+    # The analytical model keeps no matrices, only the report items are computed
+    def release_state(self):
+        if not self.report_items_ready:
+            self.calc_report_data()
@@ -0,0 +1,285 @@
+import argparse
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from scalesim.scale_config import scale_config
+from scalesim.topology_utils import topologies
+from scalesim.single_layer_sim import single_layer_sim
+from scalesim.sweep import get_layer_source_ids
+
+
+# Minimum user DRAM bandwidth (Bandwidth, words per cycle) which keeps the stalls of each layer within a budget
+# The stall cycles do not increase with the bandwidth, so the minimum is bisected: the bandwidth is doubled
+# until the budget is met, then bisected between the last two values.
+# The demand and prefetch matrices of a layer are computed once and replayed through the memory system
+# of each bandwidth tried. The Bandwidth entry is shared by all the layers, so the bandwidth of the network
+# is the largest minimum of its layers.
+class bandwidth_solver:
+    def __init__(self):
+        self.config = scale_config()
+        self.topo = topologies()
+
+        self.stall_budget = 5.0
+        self.max_bandwidth = 1024
+        self.num_workers = 1
+        self.verbose = True
+
+        # Layer id -> (min bandwidth, stall cycles, total cycles, replays), the min bandwidth is -1 when
+        # the budget is not met with the max bandwidth
+        self.layer_results = {}
+        self.layer_errors = {}
+
+        self.params_set_flag = False
+        self.solve_done_flag = False
+
+    #
+    def set_params(self,
+                   config_obj=scale_config(),
+                   topology_obj=topologies(),
+                   stall_budget=5.0,
+                   max_bandwidth=1024,
+                   num_workers=1,
+                   verbose=True):
+
+        assert stall_budget >= 0, 'The stall budget should not be negative'
+        assert max_bandwidth >= 1, 'The max bandwidth should be at least 1 word per cycle'
+
+        # The matrices are replayed in the layer demand mode, which does not change the results
+        self.config = copy.deepcopy(config_obj)
+        assert self.config.get_simulation_mode() == 'cycle', \
+            'The analytical simulation mode does not model the stalls'
+        if not self.config.get_demand_mode() == 'layer':
+            print('WARNING: bandwidth_solver: The demand matrices are kept in the layer demand mode, using it')
+        # The bandwidth of the base config is replaced by each one tried
+        self.config.update_from_dict({'InterfaceBandwidth': 'USER', 'Bandwidth': 1, 'DemandMode': 'layer'})
+
+        self.topo = topology_obj
+        self.stall_budget = stall_budget
+        self.max_bandwidth = int(max_bandwidth)
+        self.num_workers = max(1, int(num_workers))
+        self.verbose = verbose
+
+        self.params_set_flag = True
+
+    #
+    def run(self):
+        assert self.params_set_flag, 'Solver parameters are not set'
+
+        self.layer_results = {}
+        self.layer_errors = {}
+
+        layer_source_ids = get_layer_source_ids(self.config, self.topo)
+        unique_layer_ids = sorted(set(layer_source_ids))
+
+        source_results = {}
+        if self.num_workers > 1:
+            with ProcessPoolExecutor(max_workers=self.num_workers,
+                                     initializer=init_solver_worker,
+                                     initargs=(self.config, self.topo)) as executor:
+                futures = {executor.submit(solve_layer_bandwidth, layer_id,
+                                           self.stall_budget, self.max_bandwidth): layer_id
+                           for layer_id in unique_layer_ids}
+
+                for future in as_completed(futures):
+                    layer_id = futures[future]
+                    try:
+                        source_results[layer_id] = future.result()
+                    except Exception as e:
+                        # The worker itself died, eg. out of memory
+                        source_results[layer_id] = (None, type(e).__name__ + ': ' + str(e))
+                    self.print_layer_result(layer_id, *source_results[layer_id])
+        else:
+            init_solver_worker(self.config, self.topo)
+            for layer_id in unique_layer_ids:
+                source_results[layer_id] = solve_layer_bandwidth(layer_id, self.stall_budget, self.max_bandwidth)
+                self.print_layer_result(layer_id, *source_results[layer_id])
+
+        # The duplicate layers take the result of the first one
+        for layer_id, source_id in enumerate(layer_source_ids):
+            result, error = source_results[source_id]
+            if result is None:
+                self.layer_errors[layer_id] = error
+            else:
+                self.layer_results[layer_id] = result
+
+        self.solve_done_flag = True
+
+    #
+    def print_layer_result(self, layer_id, result, error):
+        if not self.verbose:
+            return
+
+        layer_name = self.topo.get_layer_name(layer_id)
+        if result is None:
+            print('WARNING: Layer ' + str(layer_id) + ' (' + layer_name + ') failed: ' + error)
+        elif result[0] < 0:
+            print('WARNING: Layer ' + str(layer_id) + ' (' + layer_name + ') is over the stall budget with '
+                  + str(self.max_bandwidth) + ' words/cycle')
+        else:
+            print('Layer ' + str(layer_id) + ' (' + layer_name + '): ' + str(result[0]) + ' words/cycle, '
+                  + str(result[3]) + ' replays')
+
+    # Largest minimum of the layers, -1 if a layer does not meet the budget or failed
+    def get_network_bandwidth(self):
+        assert self.solve_done_flag, 'Solver is not run yet'
+
+        if len(self.layer_errors) > 0:
+            return -1
+
+        min_bandwidths = [x[0] for x in self.layer_results.values()]
+        if len(min_bandwidths) == 0 or min(min_bandwidths) < 0:
+            return -1
+
+        return max(min_bandwidths)
+
+    #
+    def get_layer_results(self):
+        assert self.solve_done_flag, 'Solver is not run yet'
+        return self.layer_results
+
+    #
+    def write_report(self, top_path):
+        assert self.solve_done_flag, 'Solver is not run yet'
+
+        if not os.path.isdir(top_path):
+            os.makedirs(top_path)
+
+        report_name = os.path.join(top_path, 'BANDWIDTH_SOLVER_REPORT.csv')
+        with open(report_name, 'w') as report:
+            header = ['LayerID', 'Layer Name', 'Min Bandwidth', 'Total Cycles', 'Stall Cycles', 'Stall %', 'Replays',
+                      'Error']
+            report.write(', '.join(header) + ',\n')
+
+            # A failed layer has -1 in all the columns but the error
+            for layer_id in range(self.topo.get_num_layers()):
+                row = [str(layer_id), self.topo.get_layer_name(layer_id)]
+                if layer_id in self.layer_errors:
+                    error = self.layer_errors[layer_id].replace(',', ';').replace('\n', ' ')
+                    row += ['-1', '-1', '-1', '-1', '-1', error]
+                else:
+                    min_bandwidth, stall_cycles, total_cycles, replays = self.layer_results[layer_id]
+                    row += [str(min_bandwidth), str(total_cycles), str(stall_cycles),
+                            str(get_stall_percent(stall_cycles, total_cycles)), str(replays), '']
+                report.write(', '.join(row) + ',\n')
+
+            report.write(', '.join(['Network', '', str(self.get_network_bandwidth())]) + ',\n')
+
+        return report_name
+
+
+#
+def get_stall_percent(stall_cycles, total_cycles):
+    if total_cycles == 0:
+        return 0.0
+
+    return stall_cycles * 100 / total_cycles
+
+
+# State shared by all the layers solved in a worker
+solver_base_config = scale_config()
+solver_topology = topologies()
+
+
+#
+def init_solver_worker(config_obj, topology_obj):
+    global solver_base_config, solver_topology
+    solver_base_config = config_obj
+    solver_topology = topology_obj
+
+
+# Entry point for the worker processes, returns ((min bandwidth, stall cycles, total cycles, replays), error)
+def solve_layer_bandwidth(layer_id, stall_budget, max_bandwidth):
+    try:
+        layer_sim = single_layer_sim()
+        layer_sim.set_params(layer_id=layer_id,
+                             config_obj=solver_base_config,
+                             topology_obj=solver_topology,
+                             verbose=False)
+        layer_sim.run_compute()
+
+        # Bandwidth -> (stall cycles, total cycles)
+        replays = {}
+
+        def replay(bandwidth):
+            if bandwidth not in replays:
+                config_obj = copy.deepcopy(solver_base_config)
+                config_obj.update_from_dict({'Bandwidth': bandwidth})
+                compute_items, _, _ = layer_sim.replay_memory(config_obj)
+                replays[bandwidth] = (int(compute_items[1]), int(compute_items[0]))
+            stall_cycles, total_cycles = replays[bandwidth]
+
+            return get_stall_percent(stall_cycles, total_cycles) <= stall_budget
+
+        # Doubling until the budget is met, low is then over the budget and high within it
+        low = 0
+        high = 1
+        while not replay(high):
+            if high >= max_bandwidth:
+                layer_sim.release_state()
+                return (-1, replays[high][0], replays[high][1], len(replays)), ''
+            low = high
+            high = min(2 * high, max_bandwidth)
+
+        while high - low > 1:
+            mid = (low + high) // 2
+            if replay(mid):
+                high = mid
+            else:
+                low = mid
+
+        layer_sim.release_state()
+        return (high, replays[high][0], replays[high][1], len(replays)), ''
+    except Exception as e:
+        return None, type(e).__name__ + ': ' + str(e)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the minimum DRAM bandwidth for a stall budget')
+    parser.add_argument('-t', metavar='Topology file', type=str,
+                        default="./topologies/conv_nets/test.csv",
+                        help="Path to the topology file"
+                        )
+    parser.add_argument('-c', metavar='Config file', type=str,
+                        default="./configs/scale.cfg",
+                        help="Path to the config file"
+                        )
+    parser.add_argument('-p', metavar='log dir', type=str,
+                        default="./test_runs",
+                        help="Directory for the solver report"
+                        )
+    parser.add_argument('-i', metavar='input type', type=str,
+                        default="conv",
+                        help="Type of input topology, gemm: MNK, conv: conv"
+                        )
+    parser.add_argument('-b', metavar='stall budget', type=float,
+                        default=5.0,
+                        help="Max stall cycles, in percent of the total cycles of each layer"
+                        )
+    parser.add_argument('-m', metavar='max bandwidth', type=int,
+                        default=1024,
+                        help="Largest bandwidth tried, in words per cycle"
+                        )
+    parser.add_argument('-j', metavar='num workers', type=int,
+                        default=1,
+                        help="Number of worker processes to solve the layers in parallel"
+                        )
+    args = parser.parse_args()
+
+    config = scale_config()
+    config.read_conf_file(args.c)
+
+    topology = topologies()
+    topology.load_arrays(topofile=args.t, mnk_inputs=args.i == 'gemm')
+
+    solver = bandwidth_solver()
+    solver.set_params(config_obj=config, topology_obj=topology,
+                      stall_budget=args.b, max_bandwidth=args.m, num_workers=args.j)
+    solver.run()
+
+    network_bandwidth = solver.get_network_bandwidth()
+    if network_bandwidth < 0:
+        print('WARNING: The stall budget is not met for all the layers')
+    else:
+        print('Network: ' + str(network_bandwidth) + ' words/cycle')
+    print('Solver report: ' + solver.write_report(args.p))
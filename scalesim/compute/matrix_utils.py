@@ -0,0 +1,74 @@
+import functools
+import numpy as np
+
+
+# Fixing ISSUE #15, #16
+# The prefetch matrices are rolled out along the anti-diagonals to account for the temporal locality
+# when there is a skew in demand. The diagonals are walked in increasing order and the elements
+# in each diagonal are picked from the bottom row to the top row.
+# The permutation only depends on the shape of the matrix, hence it is computed once and cached
+@functools.lru_cache(maxsize=16)
+def get_diagonal_rollout_indices(rows, cols):
+    num_diags = rows + cols - 1
+    diag_ids = np.arange(num_diags)
+
+    max_row_ids = np.minimum(diag_ids, rows - 1)
+    min_row_ids = np.maximum(0, diag_ids - cols + 1)
+    diag_lengths = max_row_ids - min_row_ids + 1
+
+    # Position of each element within its diagonal
+    diag_starts = np.cumsum(diag_lengths) - diag_lengths
+    offsets = np.arange(rows * cols) - np.repeat(diag_starts, diag_lengths)
+
+    row_ids = np.repeat(max_row_ids, diag_lengths) - offsets
+    col_ids = np.repeat(diag_ids, diag_lengths) - row_ids
+
+    indices = row_ids * cols + col_ids
+    indices.setflags(write=False)
+
+    return indices
+
+
+#
+def diagonal_rollout(input_matrix_np):
+    rows, cols = input_matrix_np.shape
+    indices = get_diagonal_rollout_indices(rows, cols)
+
+    out_matrix_np = input_matrix_np.reshape(-1)[indices]
+    out_matrix_np = out_matrix_np.reshape((1, rows * cols))
+
+    return out_matrix_np
+
+
+# View of out_matrix_np where element (r, c) is out_matrix_np[row_offset + r + c, c]
+# Writing to the view skews a matrix by one row per column, as the operands are fed to the systolic array
+def get_skewed_view(out_matrix_np, num_rows, num_cols, row_offset=0):
+    assert row_offset + num_rows + num_cols - 1 <= out_matrix_np.shape[0], 'Skewed view exceeds the rows'
+    assert num_cols <= out_matrix_np.shape[1], 'Skewed view exceeds the cols'
+
+    row_stride, col_stride = out_matrix_np.strides
+    start_view = out_matrix_np[row_offset:, :]
+
+    return np.lib.stride_tricks.as_strided(start_view, shape=(num_rows, num_cols),
+                                           strides=(row_stride, row_stride + col_stride),
+                                           writeable=True)
+
+
+# Write input_matrix_np skewed into out_matrix_np, starting at row_offset
+def skew_into(out_matrix_np, input_matrix_np, row_offset=0):
+    rows, cols = input_matrix_np.shape
+    if rows == 0 or cols == 0:
+        return
+
+    skewed_view = get_skewed_view(out_matrix_np, rows, cols, row_offset)
+    skewed_view[:, :] = input_matrix_np
+
+
+#
+def skew_matrix(input_matrix_np):
+    rows, cols = input_matrix_np.shape
+
+    out_matrix_np = np.full((rows + cols - 1, cols), -1, dtype=input_matrix_np.dtype)
+    skew_into(out_matrix_np, input_matrix_np)
+
+    return out_matrix_np
@@ -7,6 +7,61 @@ from scalesim.scale_config import scale_config as cfg
 
 
 # This class defines data types for operand matrices
+# The groups of a grouped convolution are packed along the diagonal of the array, as many as fit in one fold
+# OS maps the filters on the cols, WS the window on the rows and the filters on the cols, IS the window on the rows
+# max_groups limits the pack further when it is not 0, see calc_groups_per_buffer()
+def calc_groups_per_pack(dataflow='os', arr_row=1, arr_col=1, window_size=1, filters_per_group=1, num_groups=1,
+                         max_groups=0):
+    if num_groups == 1:
+        return 1
+
+    if dataflow == 'os':
+        groups_per_pack = arr_col // filters_per_group
+    elif dataflow == 'ws':
+        groups_per_pack = min(arr_row // window_size, arr_col // filters_per_group)
+    else:
+        groups_per_pack = arr_row // window_size
+
+    if max_groups > 0:
+        groups_per_pack = min(groups_per_pack, max_groups)
+
+    return min(max(groups_per_pack, 1), num_groups)
+
+
+# In the USER bandwidth mode, the read buffers fetch a pack once when its operands fit in their active half
+# (see read_buffer.set_fetch_phases()), so the packs only hold as many groups as fit. 0 when there is no limit
+# The word size and the active fraction are those of single_layer_sim.run_memory()
+def calc_groups_per_buffer(config, ifmap_group_elems=1, filter_group_elems=1):
+    if not config.use_user_dram_bandwidth():
+        return 0
+
+    ifmap_sram_kb, filter_sram_kb, _ = config.get_mem_sizes()
+    ifmap_active_elems = int(math.ceil(math.floor(1024 * ifmap_sram_kb) * 0.5))
+    filter_active_elems = int(math.ceil(math.floor(1024 * filter_sram_kb) * 0.5))
+
+    return max(min(ifmap_active_elems // ifmap_group_elems, filter_active_elems // filter_group_elems), 1)
+
+
+# Groups per pack of a layer of the topology, 1 for the dense layers
+def calc_layer_groups_per_pack(config, topology, layer_id=0):
+    num_groups = topology.get_layer_num_groups(layer_id)
+    if num_groups == 1:
+        return 1
+
+    arr_row, arr_col = config.get_array_dims()
+    ifmap_rows, ifmap_cols = topology.get_layer_ifmap_dims(layer_id)
+    window_size = int(topology.get_layer_window_size(layer_id))
+    channels_per_group = topology.get_layer_num_channels(layer_id) // num_groups
+    filters_per_group = topology.get_layer_num_filters(layer_id) // num_groups
+
+    max_groups = calc_groups_per_buffer(config,
+                                        ifmap_group_elems=int(ifmap_rows * ifmap_cols * channels_per_group),
+                                        filter_group_elems=window_size * filters_per_group)
+    return calc_groups_per_pack(dataflow=config.get_dataflow(), arr_row=arr_row, arr_col=arr_col,
+                                window_size=window_size, filters_per_group=filters_per_group,
+                                num_groups=num_groups, max_groups=max_groups)
+
+
 class operand_matrix(object):
     def __init__(self):
         # Objects from outer container classes
@@ -25,10 +80,20 @@ class operand_matrix(object):
         self.ofmap_px_per_filt, self.conv_window_size = 1, 1
         self.ofmap_rows, self.ofmap_cols = 1, 1
 
+        # Grouped convolutions: the matrices hold one pack of groups at a time, see set_group_pack()
+        self.num_groups = 1
+        self.channels_per_group, self.filters_per_group = 1, 1
+        self.groups_per_pack = 1
+        self.group_start, self.num_pack_groups = 0, 1
+        self.matrix_window_size, self.matrix_num_filters = 1, 1
+
         # Offsets
         self.ifmap_offset, self.filter_offset, self.ofmap_offset = 0, 10000000, 20000000
         self.matrix_offset_arr = [0, 10000000, 20000000]
 
+        # Integer type of the address matrices
+        self.matrix_dtype = np.dtype(np.int32)
+
         # Address matrices
         self.ifmap_addr_matrix = np.ones((self.ofmap_px_per_filt, self.conv_window_size), dtype=int)
         self.filter_addr_matrix = np.ones((self.conv_window_size, self.num_filters), dtype=int)
@@ -67,10 +132,14 @@ class operand_matrix(object):
         self.ofmap_cols = int(self.ofmap_cols)
         self.ofmap_px_per_filt = int(self.ofmap_rows * self.ofmap_cols)
         self.conv_window_size = int(self.topoutil.get_layer_window_size(self.layer_id))
+        assert self.topoutil.get_layer_num_groups(self.layer_id) == 1, \
+            'Grouped convolutions are not supported in the depth first mode, see topologies.load_arrays(expand_groups)'
+        self.set_group_params()
 
         # Assign the offsets
         self.ifmap_offset, self.filter_offset, self.ofmap_offset \
             = self.config.get_offsets()
+        self.matrix_dtype = self.calc_matrix_dtype()
 
         # Address matrices: This is needed to take into account the updated dimensions
         self.ifmap_addr_matrix = np.ones((self.ofmap_px_per_filt * self.batch_size, self.conv_window_size), dtype='>i4')
@@ -110,10 +179,12 @@ class operand_matrix(object):
         self.ofmap_cols = int(self.ofmap_cols)
         self.ofmap_px_per_filt = int(self.ofmap_rows * self.ofmap_cols)
         self.conv_window_size = int(self.topoutil.get_layer_window_size(self.layer_id))
+        self.set_group_params()
 
         # Assign the offsets
         self.ifmap_offset, self.filter_offset, self.ofmap_offset \
             = self.config.get_offsets()
+        self.matrix_dtype = self.calc_matrix_dtype()
 
         # Address matrices: This is needed to take into account the updated dimensions
         self.ifmap_addr_matrix = np.ones((self.ofmap_px_per_filt * self.batch_size, self.conv_window_size), dtype='>i4')
@@ -133,6 +204,53 @@ class operand_matrix(object):
         #    print(message)
         #    return False, None, None, None
 
+    # The conv window size is the one of a group, the matrices start with the first pack of groups
+    def set_group_params(self):
+        self.num_groups = self.topoutil.get_layer_num_groups(self.layer_id)
+        self.channels_per_group = self.num_input_channels // self.num_groups
+        self.filters_per_group = self.num_filters // self.num_groups
+        self.groups_per_pack = calc_layer_groups_per_pack(self.config, self.topoutil, layer_id=self.layer_id)
+        self.set_group_pack(pack_id=0)
+
+    # Select the pack of groups held by the matrices
+    # The filter matrix of a pack is block diagonal, the filters of a group only see the window of the group
+    def set_group_pack(self, pack_id=0):
+        assert pack_id < self.get_num_group_packs(), 'Invalid group pack'
+
+        self.group_start = pack_id * self.groups_per_pack
+        self.num_pack_groups = min(self.groups_per_pack, self.num_groups - self.group_start)
+        self.matrix_window_size = self.num_pack_groups * self.conv_window_size
+        self.matrix_num_filters = self.num_pack_groups * self.filters_per_group
+        self.matrices_ready_flag = False
+
+    #
+    def get_num_groups(self):
+        return self.num_groups
+
+    #
+    def get_num_group_packs(self):
+        return math.ceil(self.num_groups / self.groups_per_pack)
+
+    #
+    def get_num_pack_groups(self):
+        return self.num_pack_groups
+
+    # The addresses use the configured dtype, unless the largest address does not fit in it
+    def calc_matrix_dtype(self):
+        matrix_dtype = np.dtype(self.config.get_matrix_dtype())
+
+        max_ifmap_addr = self.ifmap_offset + self.ifmap_rows * self.ifmap_cols * self.num_input_channels
+        max_filter_addr = self.filter_offset + self.conv_window_size * self.num_filters
+        max_ofmap_addr = self.ofmap_offset + self.ofmap_px_per_filt * self.num_filters
+        max_addr = max(max_ifmap_addr, max_filter_addr, max_ofmap_addr)
+
+        if max_addr > np.iinfo(matrix_dtype).max:
+            print('WARNING: Addresses of layer ' + str(self.layer_id) + ' do not fit in '
+                  + str(matrix_dtype) + ', using int64')
+            matrix_dtype = np.dtype(np.int64)
+
+        return matrix_dtype
+
     # top level function to create the operand matrices
     def create_operand_matrices(self):
         my_name = 'operand_matrix.create_operand_matrices(): '
@@ -163,16 +281,13 @@ class operand_matrix(object):
             print(message)
             return -1
 
-        row_indices = np.arange(self.batch_size * self.ofmap_px_per_filt)
-        col_indices = np.arange(self.conv_window_size)
-        # Create 2D index arrays using meshgrid
-        i, j = np.meshgrid(row_indices, col_indices, indexing='ij')
-
-        # Call calc_ifmap_elem_addr_numpy with 2D index arrays
-        self.ifmap_addr_matrix = self.calc_ifmap_elem_addr(i, j)
+        row_indices = np.expand_dims(np.arange(self.batch_size * self.ofmap_px_per_filt), axis=1)
+        col_indices = np.arange(self.matrix_window_size)
+        self.ifmap_addr_matrix = self.calc_ifmap_elem_addr(row_indices, col_indices)
         return 0
 
     # logic to translate ifmap into matrix fed into systolic array MACs
+    # The row and col indices are broadcast against each other, only the addresses have the size of the matrix
     def calc_ifmap_elem_addr(self, i, j):
         offset = self.ifmap_offset
         ifmap_rows = self.ifmap_rows
@@ -187,16 +302,23 @@ class operand_matrix(object):
         i_row, i_col = ofmap_row * r_stride, ofmap_col * c_stride
         window_addr = (i_row * ifmap_cols + i_col) * channel
 
-        c_row, k = np.divmod(j, filter_col * channel)
-        c_col, c_ch = np.divmod(k, channel)
+        if self.num_groups > 1:
+            # The cols hold the windows of the groups of the pack one after the other
+            pack_group, j = np.divmod(j, self.conv_window_size)
+            c_row, k = np.divmod(j, filter_col * self.channels_per_group)
+            c_col, c_ch = np.divmod(k, self.channels_per_group)
+            c_ch = c_ch + (self.group_start + pack_group) * self.channels_per_group
+        else:
+            c_row, k = np.divmod(j, filter_col * channel)
+            c_col, c_ch = np.divmod(k, channel)
 
         valid_indices = np.logical_and(c_row + i_row < ifmap_rows, c_col + i_col < ifmap_cols)
-        ifmap_px_addr = np.full(i.shape, -1)
-        if valid_indices.any():
-            internal_address = (c_row[valid_indices] * ifmap_cols + c_col[valid_indices]) * channel + c_ch[valid_indices]
-            ifmap_px_addr[valid_indices] = internal_address + window_addr[valid_indices] + offset
+        internal_address = (c_row * ifmap_cols + c_col) * channel + c_ch
+        ifmap_px_addr = window_addr + internal_address
+        ifmap_px_addr += offset
+        ifmap_px_addr[np.logical_not(valid_indices)] = -1
 
-        return ifmap_px_addr
+        return ifmap_px_addr.astype(self.matrix_dtype, copy=False)
 
     # creates the ofmap operand
     def create_ofmap_matrix(self):
@@ -208,7 +330,7 @@ class operand_matrix(object):
             return -1
 
         row_indices = np.expand_dims(np.arange(self.ofmap_px_per_filt), axis=1)
-        col_indices = np.arange(self.num_filters)
+        col_indices = np.arange(self.matrix_num_filters)
         self.ofmap_addr_matrix = self.calc_ofmap_elem_addr(row_indices, col_indices)
 
         return 0
@@ -217,8 +339,9 @@ class operand_matrix(object):
     def calc_ofmap_elem_addr(self, i, j):
         offset = self.ofmap_offset
         num_filt = self.num_filters
-        internal_address = num_filt * i + j
-        ofmap_px_addr = internal_address + offset
+        filt = self.group_start * self.filters_per_group + j
+        internal_address = num_filt * i + filt
+        ofmap_px_addr = (internal_address + offset).astype(self.matrix_dtype)
         return ofmap_px_addr
 
     # creates the filter operand
@@ -230,8 +353,8 @@ class operand_matrix(object):
             print(message)
             return -1
 
-        row_indices = np.expand_dims(np.arange(self.conv_window_size), axis=1)
-        col_indices = np.arange(self.num_filters)
+        row_indices = np.expand_dims(np.arange(self.matrix_window_size), axis=1)
+        col_indices = np.arange(self.matrix_num_filters)
         self.filter_addr_matrix = self.calc_filter_elem_addr(row_indices, col_indices)
 
         return 0
@@ -242,8 +365,16 @@ class operand_matrix(object):
         filter_row = self.filter_rows
         filter_col = self.filter_cols
         channel = self.num_input_channels
+        if self.num_groups > 1:
+            row_group, i = np.divmod(i, self.conv_window_size)
+            col_group, j = np.divmod(j, self.filters_per_group)
+            filt = (self.group_start + col_group) * self.filters_per_group + j
+            internal_address = filt * self.conv_window_size + i
+            filter_px_addr = np.where(row_group == col_group, internal_address + offset, -1)
+            return filter_px_addr.astype(self.matrix_dtype)
+
         internal_address = j * filter_row * filter_col * channel + i
-        filter_px_addr = internal_address + offset
+        filter_px_addr = (internal_address + offset).astype(self.matrix_dtype)
         return filter_px_addr
 
     # function to get a part or the full ifmap operand
@@ -252,7 +383,7 @@ class operand_matrix(object):
         if num_rows == -1:
             num_rows = self.ofmap_px_per_filt
         if num_cols == -1:
-            num_cols = self.conv_window_size
+            num_cols = self.matrix_window_size
         my_name = 'operand_matrix.get_ifmap_matrix_part(): '
         err_prefix = 'Error: ' + my_name
         if not self.matrices_ready_flag:
@@ -262,7 +393,7 @@ class operand_matrix(object):
                 message = err_prefix + ": Parameters not set yet. Run set_params(). Exiting!"
                 print(message)
                 return -1, np.zeros((1, 1))
-        if (start_row + num_rows) > self.ofmap_px_per_filt or (start_col + num_cols) > self.conv_window_size:
+        if (start_row + num_rows) > self.ofmap_px_per_filt or (start_col + num_cols) > self.matrix_window_size:
             message = err_prefix + ": Illegal arguments. Exiting!"
             print(message)
             return -2, np.zeros((1, 1))
@@ -284,9 +415,9 @@ class operand_matrix(object):
                                num_cols=-1):
 
         if num_rows == -1:
-            num_rows = self.conv_window_size
+            num_rows = self.matrix_window_size
         if num_cols == -1:
-            num_cols = self.num_filters
+            num_cols = self.matrix_num_filters
         my_name = 'operand_matrix.get_filter_matrix_part(): '
         err_prefix = 'Error: ' + my_name
         if not self.matrices_ready_flag:
@@ -296,7 +427,7 @@ class operand_matrix(object):
                 message = err_prefix + ": Parameters not set yet. Run set_params(). Exiting!"
                 print(message)
                 return -1, np.zeros((1, 1))
-        if (start_row + num_rows) > self.conv_window_size or (start_col + num_cols) > self.num_filters:
+        if (start_row + num_rows) > self.matrix_window_size or (start_col + num_cols) > self.matrix_num_filters:
             message = err_prefix + ": Illegal arguments. Exiting!"
             print(message)
             return -2, np.zeros((1, 1))
@@ -324,7 +455,7 @@ class operand_matrix(object):
         if num_rows == -1:
             num_rows = self.ofmap_px_per_filt
         if num_cols == -1:
-            num_cols = self.num_filters
+            num_cols = self.matrix_num_filters
         my_name = 'operand_matrix.get_ofmap_matrix_part(): '
         err_prefix = 'Error: ' + my_name
         if not self.matrices_ready_flag:
@@ -334,7 +465,7 @@ class operand_matrix(object):
                 message = err_prefix + ": Parameters not set yet. Run set_params(). Exiting!"
                 print(message)
                 return -1, np.zeros((1, 1))
-        if (start_row + num_rows) > self.ofmap_px_per_filt or (start_col + num_cols) > self.num_filters:
+        if (start_row + num_rows) > self.ofmap_px_per_filt or (start_col + num_cols) > self.matrix_num_filters:
             message = err_prefix + ": Illegal arguments. Exiting!"
             print(message)
             return -2, np.zeros((1, 1))
@@ -354,6 +485,20 @@ class operand_matrix(object):
     def get_ofmap_matrix(self):
         return self.get_ofmap_matrix_part()
 
+    # The matrices as virtual_operand_matrix objects, the addresses of a block are computed when it is sliced
+    # The group packs are selected on the matrices themselves, so this is only for the layers without groups
+    def get_virtual_matrices(self):
+        assert self.params_set_flag, 'Parameters not set yet. Run set_params()'
+        assert self.num_groups == 1, 'The virtual matrices do not support the grouped convolutions'
+
+        ifmap_shape = (self.batch_size * self.ofmap_px_per_filt, self.matrix_window_size)
+        filter_shape = (self.matrix_window_size, self.matrix_num_filters)
+        ofmap_shape = (self.ofmap_px_per_filt, self.matrix_num_filters)
+
+        return virtual_operand_matrix(self.calc_ifmap_elem_addr, ifmap_shape, self.matrix_dtype), \
+               virtual_operand_matrix(self.calc_filter_elem_addr, filter_shape, self.matrix_dtype), \
+               virtual_operand_matrix(self.calc_ofmap_elem_addr, ofmap_shape, self.matrix_dtype)
+
     def get_all_operand_matrix(self):
         if not self.matrices_ready_flag:
             me = 'operand_matrix.' + 'get_all_operand_matrix()'
@@ -366,6 +511,67 @@ class operand_matrix(object):
                self.ofmap_addr_matrix
 
 
+
+# Operand matrix whose addresses are only computed for the blocks sliced out of it, as [row_slice, col_slice]
+# The compute systems slice the operands fold by fold, so the whole matrix is never resident.
+# calc_elem_addr(i, j) takes a column of row indices and a row of col indices, as the calc_*_elem_addr functions
+# of operand_matrix. The transpose is virtual as well, it swaps the indices of the slices.
+class virtual_operand_matrix(object):
+    def __init__(self, calc_elem_addr, shape, dtype=np.int32, transposed=False):
+        self.calc_elem_addr = calc_elem_addr
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.dtype = np.dtype(dtype)
+        self.ndim = 2
+        self.transposed = transposed
+
+    #
+    def __getitem__(self, key):
+        assert isinstance(key, tuple) and len(key) == 2, 'Only [rows, cols] indexing is supported'
+
+        indices = []
+        squeeze_axes = []
+        for axis, axis_key in enumerate(key):
+            if isinstance(axis_key, slice):
+                indices.append(np.arange(*axis_key.indices(self.shape[axis])))
+            else:
+                # An integer drops the axis, as with numpy arrays
+                index = int(axis_key)
+                if index < 0:
+                    index += self.shape[axis]
+                assert 0 <= index < self.shape[axis], 'Index out of range'
+                indices.append(np.arange(index, index + 1))
+                squeeze_axes.append(axis)
+        row_indices, col_indices = indices
+
+        if self.transposed:
+            block = np.transpose(self.calc_elem_addr(np.expand_dims(col_indices, axis=1), row_indices))
+        else:
+            block = self.calc_elem_addr(np.expand_dims(row_indices, axis=1), col_indices)
+        block_shape = (row_indices.shape[0], col_indices.shape[0])
+        if not block.shape == block_shape:
+            block = np.broadcast_to(block, block_shape)
+        block = block.astype(self.dtype, copy=False)
+
+        if len(squeeze_axes) > 0:
+            block = np.squeeze(block, axis=tuple(squeeze_axes))
+
+        return block
+
+    #
+    def transpose(self, axes=None):
+        assert axes is None or tuple(axes) == (1, 0), 'Only the 2D transpose is supported'
+        return virtual_operand_matrix(self.calc_elem_addr, (self.shape[1], self.shape[0]),
+                                      dtype=self.dtype, transposed=not self.transposed)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    # The full matrix, only for the small operands or for checks
+    def materialize(self):
+        return self[:, :]
+
+
 if __name__ == '__main__':
     opmat = operand_matrix()
     tutil = topoutil()
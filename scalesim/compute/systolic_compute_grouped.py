@@ -0,0 +1,168 @@
+import numpy as np
+from scalesim.scale_config import scale_config as cfg
+from scalesim.compute.operand_matrix import operand_matrix as opmat
+from scalesim.compute.systolic_compute_os import systolic_compute_os
+from scalesim.compute.systolic_compute_ws import systolic_compute_ws
+from scalesim.compute.systolic_compute_is import systolic_compute_is
+
+
+# Compute system for the grouped convolutions
+# The groups are packed along the diagonal of the array (see operand_matrix.set_group_pack())
+# and each pack is run as a dense layer on the compute system of the dataflow, one pack after the other.
+# The packs only use the diagonal blocks of their filter matrix, the metrics count the useful MACs and reads.
+class systolic_compute_grouped:
+    def __init__(self):
+        # Params set by user
+        self.config = cfg()
+        self.dataflow = 'os'
+
+        # One compute system per pack of groups, with the number of groups in the pack
+        self.pack_compute_systems = []
+        self.pack_num_groups = []
+
+        # Generated matrices
+        self.ifmap_prefetch_matrix = []
+        self.filter_prefetch_matrix = []
+
+        self.ifmap_demand_matrix = np.zeros((1,1))
+        self.ofmap_demand_matrix = np.zeros((1,1))
+        self.filter_demand_matrix = np.zeros((1,1))
+
+        # Flags
+        self.params_set_flag = False
+        self.prefetch_mat_ready_flag = False
+        self.demand_mat_ready_flag = False
+        self.demand_folds_ready_flag = False
+
+    #
+    def set_params(self,
+                   config_obj=cfg(),
+                   op_mat_obj=opmat()
+                   ):
+
+        self.config = config_obj
+        self.dataflow = self.config.get_dataflow()
+
+        self.pack_compute_systems = []
+        self.pack_num_groups = []
+        for pack_id in range(op_mat_obj.get_num_group_packs()):
+            op_mat_obj.set_group_pack(pack_id)
+            _, ifmap_op_mat = op_mat_obj.get_ifmap_matrix()
+            _, filter_op_mat = op_mat_obj.get_filter_matrix()
+            _, ofmap_op_mat = op_mat_obj.get_ofmap_matrix()
+
+            if self.dataflow == 'os':
+                compute_system = systolic_compute_os()
+            elif self.dataflow == 'ws':
+                compute_system = systolic_compute_ws()
+            else:
+                compute_system = systolic_compute_is()
+
+            compute_system.set_params(config_obj=self.config,
+                                      ifmap_op_mat=ifmap_op_mat,
+                                      filter_op_mat=filter_op_mat,
+                                      ofmap_op_mat=ofmap_op_mat)
+
+            self.pack_compute_systems.append(compute_system)
+            self.pack_num_groups.append(op_mat_obj.get_num_pack_groups())
+
+        self.params_set_flag = True
+
+    # The prefetch matrices are lists with the ones of each pack, the read buffers fetch them as separate phases
+    def create_prefetch_matrices(self):
+        assert self.params_set_flag, 'Parameters are not set'
+
+        self.ifmap_prefetch_matrix, self.filter_prefetch_matrix = [], []
+        for compute_system in self.pack_compute_systems:
+            ifmap_prefetch_mat, filter_prefetch_mat = compute_system.get_prefetch_matrices()
+            self.ifmap_prefetch_matrix.append(ifmap_prefetch_mat)
+            self.filter_prefetch_matrix.append(filter_prefetch_mat)
+
+        self.prefetch_mat_ready_flag = True
+
+    #
+    def create_demand_matrices(self):
+        assert self.params_set_flag, 'Parameters are not set'
+
+        ifmap_demand_list, filter_demand_list, ofmap_demand_list = [], [], []
+        for compute_system in self.pack_compute_systems:
+            ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat = compute_system.get_demand_matrices()
+            ifmap_demand_list.append(ifmap_demand_mat)
+            filter_demand_list.append(filter_demand_mat)
+            ofmap_demand_list.append(ofmap_demand_mat)
+
+        self.ifmap_demand_matrix = np.concatenate(ifmap_demand_list, axis=0)
+        self.filter_demand_matrix = np.concatenate(filter_demand_list, axis=0)
+        self.ofmap_demand_matrix = np.concatenate(ofmap_demand_list, axis=0)
+
+        self.demand_mat_ready_flag = True
+
+    # Generator version of create_demand_matrices(), the folds of the packs are yielded in order
+    def get_demand_matrices_by_fold(self):
+        assert self.params_set_flag, 'Parameters are not set'
+
+        for compute_system in self.pack_compute_systems:
+            for demand_fold in compute_system.get_demand_matrices_by_fold():
+                yield demand_fold
+
+        self.demand_folds_ready_flag = True
+
+    #
+    def get_prefetch_matrices(self):
+        if not self.prefetch_mat_ready_flag:
+            self.create_prefetch_matrices()
+
+        return self.ifmap_prefetch_matrix, self.filter_prefetch_matrix
+
+    #
+    def get_demand_matrices(self):
+        if not self.demand_mat_ready_flag:
+            self.create_demand_matrices()
+
+        return self.ifmap_demand_matrix, self.filter_demand_matrix, self.ofmap_demand_matrix
+
+    # Only the diagonal blocks of the filter matrix are mapped in the WS dataflow
+    def get_avg_mapping_efficiency(self):
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
+
+        agg, num = 0, 0
+        for compute_system, num_groups in zip(self.pack_compute_systems, self.pack_num_groups):
+            mapping_efficiency_per_fold = compute_system.mapping_efficiency_per_fold
+            if self.dataflow == 'ws':
+                agg += sum(mapping_efficiency_per_fold) / num_groups
+            else:
+                agg += sum(mapping_efficiency_per_fold)
+            num += len(mapping_efficiency_per_fold)
+
+        avg_mapping_eff = agg / num
+
+        return avg_mapping_eff
+
+    # Each PE only does the MACs of one group out of the ones in the pack
+    def get_avg_compute_utilization(self):
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
+
+        agg, num = 0, 0
+        for compute_system, num_groups in zip(self.pack_compute_systems, self.pack_num_groups):
+            agg += sum(compute_system.compute_utility_per_fold) / num_groups
+            num += len(compute_system.compute_utility_per_fold)
+
+        avg_compute_util = agg / num
+
+        return avg_compute_util
+
+    #
+    def get_ifmap_requests(self):
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
+        return sum(x.ifmap_reads for x in self.pack_compute_systems)
+
+    # The filter reads are counted on the whole filter matrix of the pack, which is block diagonal
+    def get_filter_requests(self):
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
+        return sum(x.filter_reads // num_groups
+                   for x, num_groups in zip(self.pack_compute_systems, self.pack_num_groups))
+
+    #
+    def get_ofmap_requests(self):
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
+        return sum(x.ofmap_writes for x in self.pack_compute_systems)
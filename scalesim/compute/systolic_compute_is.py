@@ -1,7 +1,7 @@
 import math
 import numpy as np
-from tqdm import tqdm
 from scalesim.scale_config import scale_config as cfg
+from scalesim.compute.matrix_utils import diagonal_rollout, skew_into
 
 
 class systolic_compute_is:
@@ -12,6 +12,7 @@ class systolic_compute_is:
         self.ifmap_op_mat = np.zeros((1, 1))
         self.ofmap_op_mat = np.zeros((1, 1))
         self.filter_op_mat = np.zeros((1, 1))
+        self.matrix_dtype = np.dtype(np.int32)
 
         # Derived parameters
         self.Sr = 0
@@ -45,6 +46,7 @@ class systolic_compute_is:
         self.params_set_flag = False
         self.prefetch_mat_ready_flag = False
         self.demand_mat_ready_flag = False
+        self.demand_folds_ready_flag = False
 
     #
     def set_params(self,
@@ -59,6 +61,9 @@ class systolic_compute_is:
         self.filter_op_mat = filter_op_mat
         self.ofmap_op_mat = ofmap_op_mat
 
+        # The null requests are padded in the dtype of the operands
+        self.matrix_dtype = np.result_type(self.ifmap_op_mat, self.filter_op_mat, self.ofmap_op_mat)
+
         self.ifmap_op_mat_trans = np.transpose(self.ifmap_op_mat)
 
         ifmap_col = self.ifmap_op_mat.shape[1]
@@ -100,7 +105,7 @@ class systolic_compute_is:
 
             #If there is under utilization, fill them with null requests
             if delta > 0:
-                null_req_mat = np.ones((self.Sr, delta)) * -1
+                null_req_mat = np.full((self.Sr, delta), -1, dtype=self.matrix_dtype)
                 this_fold_prefetch = np.concatenate((this_fold_prefetch, null_req_mat), axis=1)
 
             if fc == 0:
@@ -124,7 +129,7 @@ class systolic_compute_is:
             this_fold_prefetch = np.transpose(this_fold_prefetch)
 
             if delta > 0:
-                null_req_mat = np.ones((self.T, delta)) * -1
+                null_req_mat = np.full((self.T, delta), -1, dtype=self.matrix_dtype)
                 this_fold_prefetch = np.concatenate((this_fold_prefetch, null_req_mat), axis=1)
 
             if fr == 0:
@@ -134,32 +139,7 @@ class systolic_compute_is:
 
         # Fixing ISSUE #15, #16
         # Roll out the matrices along the diagonal to account for temporal locality when there is a skew in demand
-
-        M, N = self.filter_prefetch_matrix.shape
-        num_elems = M * N
-        num_diags = M + N
-        prefetches = np.zeros((1, num_elems))
-        idx = 0
-
-        pbar = tqdm(total=M * N, disable=True)
-        # print('DEBUG: Total = ' + str(num_elems) + ' Diags = ' + str(num_diags))
-
-        for diag_id in range(num_diags):
-            max_row_id = min(diag_id, M - 1)
-            min_row_id = max(0, diag_id - N + 1)
-            valid_rows = max_row_id - min_row_id + 1
-
-            for offset in range(valid_rows):
-                row_id = max_row_id - offset
-                col_id = diag_id - row_id
-
-                elem = self.filter_prefetch_matrix[row_id][col_id]
-                prefetches[0, idx] = elem
-                idx += 1
-                pbar.update(1)
-
-        pbar.close()
-        self.filter_prefetch_matrix = prefetches
+        self.filter_prefetch_matrix = diagonal_rollout(self.filter_prefetch_matrix)
 
     #
     def create_demand_matrices(self):
@@ -177,142 +157,169 @@ class systolic_compute_is:
 
         self.demand_mat_ready_flag = True
 
+    # Generator version of create_demand_matrices()
+    # Yields the demand matrices one fold at a time, in the same order as they are stacked in the full matrices
+    # Use either this or create_demand_matrices() on a given object, the access counts are accumulated by both
+    def get_demand_matrices_by_fold(self):
+        assert self.params_set_flag, 'Parameters are not set'
+
+        for fc in range(self.col_fold):
+            for fr in range(self.row_fold):
+                ifmap_demand_fold = self.create_ifmap_demand_fold(fc, fr)
+                filter_demand_fold = self.create_filter_demand_fold(fc, fr)
+                ofmap_demand_fold = self.create_ofmap_demand_fold(fc, fr)
+
+                assert ifmap_demand_fold.shape[0] == filter_demand_fold.shape[0], 'IFMAP and Filter demands out of sync'
+                assert ofmap_demand_fold.shape[0] == filter_demand_fold.shape[0], 'OFMAP and Filter demands out of sync'
+                assert ifmap_demand_fold.shape[1] == self.arr_col, 'IFMAP demands exceed the rows'
+                assert filter_demand_fold.shape[1] == self.arr_row, 'Filter demands exceed the cols'
+                assert ofmap_demand_fold.shape[1] == self.arr_col, 'OFMAP demands exceed the cols'
+
+                yield ifmap_demand_fold, filter_demand_fold, ofmap_demand_fold
+
+        self.demand_folds_ready_flag = True
+
     #
     def create_ifmap_demand_mat(self):
         assert self.params_set_flag, 'Parameters are not set'
 
-        inter_fold_gap_suffix = self.arr_row + self.arr_col + self.T - 2
-        inter_fold_gap_suffix_mat = np.ones((inter_fold_gap_suffix, self.arr_col)) * -1
+        # All the folds have the same number of rows, the matrix is allocated once and each fold is written in place
+        fold_rows = self.get_ifmap_demand_fold_rows()
+        self.ifmap_demand_matrix = np.full((self.row_fold * self.col_fold * fold_rows, self.arr_col), -1,
+                                           dtype=self.matrix_dtype)
 
         for fc in range(self.col_fold):
             for fr in range(self.row_fold):
-                row_start_id = fr * self.arr_row
-                row_end_idx = min(row_start_id + self.arr_row, self.Sr)
-                row_delta = self.arr_row - (row_end_idx - row_start_id)
+                start_row = (fc * self.row_fold + fr) * fold_rows
+                self.write_ifmap_demand_fold(self.ifmap_demand_matrix[start_row: start_row + fold_rows, :], fc, fr)
 
-                col_start_id = fc * self.arr_col
-                col_end_idx = min(col_start_id + self.arr_col, self.Sc)
-                col_delta = self.arr_col - (col_end_idx - col_start_id)
+        # Skew is not needed in IFMAP for IS
 
-                # Indexing the cols with row start and row end idx are correct
-                # See the comment on ifmap_prefetch generation
-                this_fold_demand = self.ifmap_op_mat_trans[row_start_id:row_end_idx, col_start_id: col_end_idx]
-                self.ifmap_reads += this_fold_demand.shape[0] * this_fold_demand.shape[1]
+    # Cycles for partial sum generation and accumulation
+    def get_ifmap_demand_fold_rows(self):
+        return self.arr_row + self.arr_row + self.arr_col + self.T - 2
 
-                # Take into account under utilization
-                if col_delta > 0:
-                    null_req_mat = np.ones((this_fold_demand.shape[0], col_delta)) * -1
-                    this_fold_demand = np.concatenate((this_fold_demand, null_req_mat), axis=1)
+    #
+    def create_ifmap_demand_fold(self, fc, fr):
+        this_fold_demand = np.full((self.get_ifmap_demand_fold_rows(), self.arr_col), -1, dtype=self.matrix_dtype)
+        self.write_ifmap_demand_fold(this_fold_demand, fc, fr)
 
-                if row_delta > 0:
-                    null_req_mat = np.ones((row_delta, self.arr_col)) * -1
-                    this_fold_demand = np.concatenate((this_fold_demand, null_req_mat), axis=0)
+        return this_fold_demand
 
-                # The IFMAP elems are needed to be filled in reverse order to ensure that
-                # top element is pushed in last to maintain alignment with the input elements
-                this_fold_demand = np.flip(this_fold_demand, 0)
+    # Writes the demands of a fold to a block of null requests
+    def write_ifmap_demand_fold(self, fold_demand_block, fc, fr):
+        row_start_id = fr * self.arr_row
+        row_end_idx = min(row_start_id + self.arr_row, self.Sr)
+        row_delta = self.arr_row - (row_end_idx - row_start_id)
 
-                # Account for the cycles for partial sum generation and accumulation
-                this_fold_demand = np.concatenate((this_fold_demand, inter_fold_gap_suffix_mat), axis=0)
+        col_start_id = fc * self.arr_col
+        col_end_idx = min(col_start_id + self.arr_col, self.Sc)
 
-                # Calculate the mapping efficiency
-                row_used = min(self.arr_row, row_end_idx - row_start_id)
-                col_used = min(self.arr_col, col_end_idx - col_start_id)
-                mac_used = row_used * col_used
-                mapping_eff_this_fold = mac_used / (self.arr_row * self.arr_col)
+        # Indexing the cols with row start and row end idx are correct
+        # See the comment on ifmap_prefetch generation
+        this_fold_demand = self.ifmap_op_mat_trans[row_start_id:row_end_idx, col_start_id: col_end_idx]
+        self.ifmap_reads += this_fold_demand.shape[0] * this_fold_demand.shape[1]
 
-                cycles_this_fold = this_fold_demand.shape[0] + this_fold_demand.shape[1] - 1
-                compute_cycles_this_fold = mac_used * self.T
-                compute_util_this_fold = compute_cycles_this_fold / (self.arr_row * self.arr_col * cycles_this_fold)
+        # The IFMAP elems are needed to be filled in reverse order to ensure that
+        # top element is pushed in last to maintain alignment with the input elements
+        # The unused rows are null requests, which end up on top after the reflection
+        this_fold_demand = np.flip(this_fold_demand, 0)
+        fold_demand_block[row_delta: self.arr_row, :this_fold_demand.shape[1]] = this_fold_demand
 
-                self.mapping_efficiency_per_fold.append(mapping_eff_this_fold)
-                self.compute_utility_per_fold.append(compute_util_this_fold)
+        # Calculate the mapping efficiency
+        row_used = min(self.arr_row, row_end_idx - row_start_id)
+        col_used = min(self.arr_col, col_end_idx - col_start_id)
+        mac_used = row_used * col_used
+        mapping_eff_this_fold = mac_used / (self.arr_row * self.arr_col)
 
-                if fr == 0 and fc == 0:
-                    self.ifmap_demand_matrix = this_fold_demand
-                else:
-                    self.ifmap_demand_matrix = np.concatenate((self.ifmap_demand_matrix, this_fold_demand), axis=0)
+        cycles_this_fold = fold_demand_block.shape[0] + fold_demand_block.shape[1] - 1
+        compute_cycles_this_fold = mac_used * self.T
+        compute_util_this_fold = compute_cycles_this_fold / (self.arr_row * self.arr_col * cycles_this_fold)
 
-        # Skew is not needed in IFMAP for IS
+        self.mapping_efficiency_per_fold.append(mapping_eff_this_fold)
+        self.compute_utility_per_fold.append(compute_util_this_fold)
 
     #
     def create_filter_demand_mat(self):
         assert self.params_set_flag, 'Parameters are not set'
 
-        inter_fold_gap_prefix = self.arr_row
-        inter_fold_gap_prefix_mat = np.ones((inter_fold_gap_prefix, self.arr_row)) * -1
-
-        inter_fold_gap_suffix = self.arr_col - 1
-        inter_fold_gap_suffix_mat = np.ones((inter_fold_gap_suffix, self.arr_row)) * -1
+        fold_rows = self.get_filter_demand_fold_rows()
+        self.filter_demand_matrix = np.full((self.row_fold * self.col_fold * fold_rows, self.arr_row), -1,
+                                            dtype=self.matrix_dtype)
 
         for fc in range(self.col_fold):
             for fr in range(self.row_fold):
-                row_start_id = fr * self.arr_row
-                row_end_idx = min(row_start_id + self.arr_row, self.Sr)
-                delta = self.arr_row - (row_end_idx - row_start_id)
-
-                # Indexing the cols with row start and row end idx are correct
-                # See the comment on ifmap_prefetch generation
-                this_fold_demand = self.filter_op_mat[row_start_id: row_end_idx, :]
-                this_fold_demand = np.transpose(this_fold_demand)
-                self.filter_reads += this_fold_demand.shape[0] * this_fold_demand.shape[1]
-
-                # Take into account under utilization
-                if delta > 0:
-                    null_req_mat = np.ones((self.T, delta)) * -1
-                    this_fold_demand = np.concatenate((this_fold_demand, null_req_mat), axis=1)
-
-                # Account for the cycles for weights to load
-                this_fold_demand = np.concatenate((inter_fold_gap_prefix_mat, this_fold_demand), axis=0)
-
-                # Account for the cycles for final output to drain out
-                this_fold_demand = np.concatenate((this_fold_demand, inter_fold_gap_suffix_mat), axis=0)
-
-                # Add skew to the IFMAP demand matrix to reflect systolic pipeline fill
-                this_fold_demand = skew_matrix(this_fold_demand)
-
-                if fr == 0 and fc == 0:
-                    self.filter_demand_matrix = this_fold_demand
-                else:
-                    self.filter_demand_matrix = np.concatenate((self.filter_demand_matrix, this_fold_demand), axis=0)
+                start_row = (fc * self.row_fold + fr) * fold_rows
+                self.write_filter_demand_fold(self.filter_demand_matrix[start_row: start_row + fold_rows, :], fc, fr)
     # END of filter demand generation
 
+    # Cycles for the weights to load and the final output to drain out,
+    # the skew adds the cycles for the systolic pipeline fill
+    def get_filter_demand_fold_rows(self):
+        return self.arr_row + self.T + self.arr_col - 1 + self.arr_row - 1
+
+    #
+    def create_filter_demand_fold(self, fc, fr):
+        this_fold_demand = np.full((self.get_filter_demand_fold_rows(), self.arr_row), -1, dtype=self.matrix_dtype)
+        self.write_filter_demand_fold(this_fold_demand, fc, fr)
+
+        return this_fold_demand
+
+    #
+    def write_filter_demand_fold(self, fold_demand_block, fc, fr):
+        inter_fold_gap_prefix = self.arr_row
+
+        row_start_id = fr * self.arr_row
+        row_end_idx = min(row_start_id + self.arr_row, self.Sr)
+
+        # Indexing the cols with row start and row end idx are correct
+        # See the comment on ifmap_prefetch generation
+        this_fold_demand = self.filter_op_mat[row_start_id: row_end_idx, :]
+        this_fold_demand = np.transpose(this_fold_demand)
+        self.filter_reads += this_fold_demand.shape[0] * this_fold_demand.shape[1]
+
+        # Add skew to the Filter demand matrix to reflect systolic pipeline fill
+        skew_into(fold_demand_block, this_fold_demand, row_offset=inter_fold_gap_prefix)
+
     #
     def create_ofmap_demand_mat(self):
         assert self.params_set_flag, 'Parameters are not set'
 
-        inter_fold_gap_prefix = 2 * self.arr_row - 1
-        inter_fold_gap_prefix_mat = np.ones((inter_fold_gap_prefix, self.arr_col)) * -1
+        fold_rows = self.get_ofmap_demand_fold_rows()
+        self.ofmap_demand_matrix = np.full((self.row_fold * self.col_fold * fold_rows, self.arr_col), -1,
+                                           dtype=self.matrix_dtype)
 
         for fc in range(self.col_fold):
             for fr in range(self.row_fold):
-                col_start_id = fc * self.arr_col
-                col_end_idx = min(col_start_id + self.arr_col, self.Sc)
-                col_delta = self.arr_col - (col_end_idx - col_start_id)
-
-                this_fold_demand = self.ofmap_op_mat[col_start_id: col_end_idx, :]
-                this_fold_demand = np.transpose(this_fold_demand)
-                self.ofmap_writes += this_fold_demand.shape[0] * this_fold_demand.shape[1]
-
-                # Adding null requests when there is under utilization ie. no mapping along a few rows or cols
-                if col_delta > 0:
-                    null_req_mat = np.ones((self.T, col_delta)) * -1
-                    this_fold_demand = np.concatenate((this_fold_demand, null_req_mat), axis=1)
-
-                # Now add the prefix matrix
-                # These are the null demands to account for when the operands are streamed in
-                # and the OFMAPS are not ready
-                this_fold_demand = np.concatenate((inter_fold_gap_prefix_mat, this_fold_demand), axis=0)
-
-                # Add skew to the OFMAP demand matrix to reflect systolic pipeline fill
-                this_fold_demand = skew_matrix(this_fold_demand)
-
-                if fr == 0 and fc == 0:
-                    self.ofmap_demand_matrix = this_fold_demand
-                else:
-                    self.ofmap_demand_matrix = np.concatenate((self.ofmap_demand_matrix, this_fold_demand), axis=0)
+                start_row = (fc * self.row_fold + fr) * fold_rows
+                self.write_ofmap_demand_fold(self.ofmap_demand_matrix[start_row: start_row + fold_rows, :], fc, fr)
     # END of OFMAP demand generation
 
+    # The null demands of the prefix account for when the operands are streamed in and the OFMAPS are not ready
+    def get_ofmap_demand_fold_rows(self):
+        return 2 * self.arr_row - 1 + self.T + self.arr_col - 1
+
+    #
+    def create_ofmap_demand_fold(self, fc, fr):
+        this_fold_demand = np.full((self.get_ofmap_demand_fold_rows(), self.arr_col), -1, dtype=self.matrix_dtype)
+        self.write_ofmap_demand_fold(this_fold_demand, fc, fr)
+
+        return this_fold_demand
+
+    #
+    def write_ofmap_demand_fold(self, fold_demand_block, fc, fr):
+        inter_fold_gap_prefix = 2 * self.arr_row - 1
+
+        col_start_id = fc * self.arr_col
+        col_end_idx = min(col_start_id + self.arr_col, self.Sc)
+
+        this_fold_demand = self.ofmap_op_mat[col_start_id: col_end_idx, :]
+        this_fold_demand = np.transpose(this_fold_demand)
+        self.ofmap_writes += this_fold_demand.shape[0] * this_fold_demand.shape[1]
+
+        # Add skew to the OFMAP demand matrix to reflect systolic pipeline fill
+        skew_into(fold_demand_block, this_fold_demand, row_offset=inter_fold_gap_prefix)
+
     #
     def get_ifmap_prefetch_mat(self):
         if not self.prefetch_mat_ready_flag:
@@ -364,7 +371,7 @@ class systolic_compute_is:
 
     #
     def get_avg_mapping_efficiency(self):
-        assert self.demand_mat_ready_flag, 'Computes not ready yet'
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
 
         agg = sum(self.mapping_efficiency_per_fold)
         num = len(self.mapping_efficiency_per_fold)
@@ -375,7 +382,7 @@ class systolic_compute_is:
 
     #
     def get_avg_compute_utilization(self):
-        assert self.demand_mat_ready_flag, 'Computes not ready yet'
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
 
         agg = sum(self.compute_utility_per_fold)
         num = len(self.compute_utility_per_fold)
@@ -386,28 +393,15 @@ class systolic_compute_is:
 
     #
     def get_ifmap_requests(self):
-        assert self.demand_mat_ready_flag, 'Computes not ready yet'
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
         return self.ifmap_reads
 
     #
     def get_filter_requests(self):
-        assert self.demand_mat_ready_flag, 'Computes not ready yet'
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
         return self.filter_reads
 
     #
     def get_ofmap_requests(self):
-        assert self.demand_mat_ready_flag, 'Computes not ready yet'
+        assert self.demand_mat_ready_flag or self.demand_folds_ready_flag, 'Computes not ready yet'
         return self.ofmap_writes
-
-
-#
-def skew_matrix(input_matrix_np):
-    rows, cols = input_matrix_np.shape
-
-    out_matrix_np = np.full((rows + cols - 1, cols), -1, dtype=input_matrix_np.dtype)
-
-    for c in range(cols):
-        out_matrix_np[c:c + rows, c] = input_matrix_np[:, c]
-
-    return out_matrix_np
-
@@ -7,6 +7,7 @@ from scalesim.compute.systolic_compute_is import systolic_compute_is
 from scalesim.memory.double_buffered_scratchpad_mem import double_buffered_scratchpad as mem_dbsp
 from scalesim.dephtfirst.report.report import report
 from scalesim.dephtfirst.utils import Tile, df_mode
+from scalesim.utilities.profiler import stage_profiler
 from math import ceil
 from tqdm import tqdm
 import os
@@ -23,6 +24,8 @@ class depth_first_sim:
         self.memory_system = mem_dbsp()
         
         self.reports = []
+        self.profilers = []
+        self.profiler = stage_profiler()
         self.op_mat_obj = opmat()
 
         self.memory_system_ready_flag = False
@@ -68,7 +71,7 @@ class depth_first_sim:
         # Load the configuration and topology files
         self.config.read_conf_file(conf_file)
         self.config.set_topology_file(topology_file)
-        self.topo.load_arrays(topofile=topology_file, mnk_inputs=read_gemm_inputs)
+        self.topo.load_arrays(topofile=topology_file, mnk_inputs=read_gemm_inputs, expand_groups=True)
 
         # Setup the compute system
         self.dataflow = self.config.get_dataflow()
@@ -113,11 +116,17 @@ class depth_first_sim:
 
             stack_report = report()
 
+            # The stages of all the tiles of the stack are summed
+            self.profiler = stage_profiler()
+            if self.config.get_profile_mode() == 'cprofile':
+                self.profiler.enable_cprofile()
+
             for t in tqdm(truncated_list,disable=not self.verbose):
                 tile_report = self.process_a_tile(t)
                 stack_report += tile_report
             
             self.reports.append(stack_report)
+            self.profilers.append(self.profiler)
 
 
     def process_a_tile(self,tile):
@@ -132,6 +141,7 @@ class depth_first_sim:
         # This part is a copy-paste from the run function inside single_layer_sim.py file
 
         #3.1 Setup compute system
+        self.profiler.start('operand_matrices')
         self.op_mat_obj.set_params_tile(config_obj=self.config,
                                         topoutil_obj=self.topo,
                                         tile=tile)
@@ -149,12 +159,15 @@ class depth_first_sim:
                                        ofmap_op_mat=output_mat)
 
         # 3.2 Get the demand for the first tile
+        self.profiler.start('prefetch_matrices')
         ifmap_prefetch_mat, filter_prefetch_mat = self.compute_system.get_prefetch_matrices()
 
+        self.profiler.start('demand_matrices')
         ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat = self.compute_system.get_demand_matrices()
 
 
         # 3.3 Setup memory system
+        self.profiler.start('memory_setup')
         self.setup_memory_if_not_ready()
 
         if self.config.use_user_dram_bandwidth() :
@@ -162,12 +175,15 @@ class depth_first_sim:
                                                               filter_prefetch_mat=filter_prefetch_mat)
 
         # 4. Compute
+        self.profiler.start('memory_service')
         self.memory_system.service_memory_requests(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat)
         self.runs_ready = True
 
         # 5. Generate report
+        self.profiler.start('report_calc')
         tile_report = report()
         tile_report.generate_report(self.compute_system,self.memory_system,self.num_mac_unit)
+        self.profiler.stop()
         return tile_report
 
     def setup_memory_if_not_ready(self):
@@ -214,7 +230,8 @@ class depth_first_sim:
                     filter_backing_buf_bw=filter_backing_bw,
                     ofmap_backing_buf_bw=ofmap_backing_bw,
                     verbose=False,
-                    estimate_bandwidth_mode=estimate_bandwidth_mode
+                    estimate_bandwidth_mode=estimate_bandwidth_mode,
+                    service_mode=self.config.get_memory_service_mode()
             )
 
     def create_stack_list(self):
@@ -410,6 +427,29 @@ class depth_first_sim:
         bandwidth_report.close()
         detail_report.close()
 
+        if not self.config.get_profile_mode() == 'off':
+            self.save_profile_report(top_path)
+
+    def save_profile_report(self, top_path):
+        """
+        Save the time and peak memory of the stages of each stack, summed over its tiles.
+        A cProfile dump of each stack is also saved in the cprofile mode.
+        """
+        profile_report_name = top_path + '/PROFILE_REPORT.csv'
+        with open(profile_report_name, 'w') as profile_report:
+            header = 'StackID, Stage, Time (s), Peak Memory (MB),\n'
+            profile_report.write(header)
+
+            for i,profiler in enumerate(self.profilers):
+                for stage, stage_time, peak_memory in profiler.get_profile_items():
+                    log = str(i) + ', ' + stage + ', '
+                    log += "{:.6f}".format(stage_time) + ', ' + "{:.1f}".format(peak_memory)
+                    log += ',\n'
+                    profile_report.write(log)
+
+                if self.config.get_profile_mode() == 'cprofile':
+                    profiler.dump_cprofile(top_path + '/PROFILE_stack' + str(i) + '.prof')
+
 #demo with alexnet topology truncated to use the last 10 tiles
 def run_simulation(df_mode):
 
@@ -7,6 +7,16 @@ from scalesim.memory.read_buffer_estimate_bw import ReadBufferEstimateBw as rdbu
 from scalesim.memory.read_port import read_port as rdport
 from scalesim.memory.write_buffer import write_buffer as wrbuf
 from scalesim.memory.write_port import write_port as wrport
+from scalesim.utilities.trace_io import make_trace_matrix
+
+
+# Cycles of the first and the last rows of a trace with a valid request, None when there are no requests
+def get_valid_start_stop_cycles(trace_matrix):
+    valid_rows = np.flatnonzero((trace_matrix[:, 1:] != -1).any(axis=1))
+    if valid_rows.shape[0] == 0:
+        return None
+
+    return trace_matrix[valid_rows[0]][0], trace_matrix[valid_rows[-1]][0]
 
 
 class double_buffered_scratchpad:
@@ -52,7 +62,11 @@ class double_buffered_scratchpad:
         self.ofmap_dram_writes = 0
 
         self.estimate_bandwidth_mode = False,
+        self.service_mode = 'row'
+        self.valid_service_mode_list = ['row', 'batched', 'event']
+        self.max_batch_lines = 2 ** 10      # Upper limit on the lines handed to the buffers at once
         self.traces_valid = False
+        self.sram_traces_streamed = False
         self.params_valid_flag = True
 
     #
@@ -62,10 +76,14 @@ class double_buffered_scratchpad:
                    word_size=1,
                    ifmap_buf_size_bytes=2, filter_buf_size_bytes=2, ofmap_buf_size_bytes=2,
                    rd_buf_active_frac=0.5, wr_buf_active_frac=0.5,
-                   ifmap_backing_buf_bw=1, filter_backing_buf_bw=1, ofmap_backing_buf_bw=1):
+                   ifmap_backing_buf_bw=1, filter_backing_buf_bw=1, ofmap_backing_buf_bw=1,
+                   service_mode='row'):
 
         self.estimate_bandwidth_mode = estimate_bandwidth_mode
 
+        assert service_mode in self.valid_service_mode_list, 'Invalid service mode'
+        self.service_mode = service_mode
+
         if self.estimate_bandwidth_mode:
             self.ifmap_buf = rdbuf_est()
             self.filter_buf = rdbuf_est()
@@ -152,10 +170,110 @@ class double_buffered_scratchpad:
     def service_memory_requests(self, ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat):
         assert self.params_valid_flag, 'Memories not initialized yet'
 
-        ofmap_lines = ofmap_demand_mat.shape[0]
+        self.total_cycles = 0
+        self.stall_cycles = 0
+        self.sram_traces_streamed = False
+
+        if self.service_mode == 'batched':
+            ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np \
+                = self.service_demand_lines_batched(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat)
+        elif self.service_mode == 'event':
+            ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np \
+                = self.service_demand_lines_event(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat)
+        else:
+            ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np \
+                = self.service_demand_lines(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat)
+
+        if self.estimate_bandwidth_mode:
+            # IDE shows warning as complete_all_prefetches is not implemented in read_buffer class
+            # It is harmless since, in estimate bandwidth mode, read_buffer_estimate_bw is instantiated
+            self.ifmap_buf.complete_all_prefetches()
+            self.filter_buf.complete_all_prefetches()
+
+        self.ofmap_buf.empty_all_buffers(ofmap_services_cycles_np[-1])
+
+        # Prepare the traces
+        self.ifmap_trace_matrix = make_trace_matrix(ifmap_services_cycles_np, ifmap_demand_mat)
+        self.filter_trace_matrix = make_trace_matrix(filter_services_cycles_np, filter_demand_mat)
+        self.ofmap_trace_matrix = make_trace_matrix(ofmap_services_cycles_np, ofmap_demand_mat)
+        self.total_cycles = int(ofmap_services_cycles_np[-1][0])
+
+        # END of serving demands from memory
+        self.traces_valid = True
+
+    # Streaming version of service_memory_requests()
+    # demand_folds is an iterable of (ifmap, filter, ofmap) demand blocks, which are serviced in order.
+    # Only the current block and its traces are resident, the SRAM traces are handed to the
+    # (ifmap, filter, ofmap) trace writers when provided, and are not kept otherwise.
+    def service_memory_requests_by_fold(self, demand_folds, sram_trace_writers=None):
+        assert self.params_valid_flag, 'Memories not initialized yet'
 
         self.total_cycles = 0
         self.stall_cycles = 0
+        self.sram_traces_streamed = True
+
+        self.ifmap_sram_start_cycle, self.ifmap_sram_stop_cycle = 0, 0
+        self.filter_sram_start_cycle, self.filter_sram_stop_cycle = 0, 0
+        self.ofmap_sram_start_cycle, self.ofmap_sram_stop_cycle = 0, 0
+        sram_start_seen = [False, False, False]
+
+        line_offset = 0
+        last_ofmap_serviced_cycle = np.zeros(1)
+        for ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat in tqdm(demand_folds, disable=not self.verbose):
+            if self.service_mode == 'batched':
+                ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np \
+                    = self.service_demand_lines_batched(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat,
+                                                        line_offset=line_offset, show_progress=False)
+            elif self.service_mode == 'event':
+                ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np \
+                    = self.service_demand_lines_event(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat,
+                                                      line_offset=line_offset, show_progress=False)
+            else:
+                ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np \
+                    = self.service_demand_lines(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat,
+                                                line_offset=line_offset, show_progress=False)
+            line_offset += ofmap_demand_mat.shape[0]
+            last_ofmap_serviced_cycle = ofmap_services_cycles_np[-1]
+
+            trace_blocks = [make_trace_matrix(ifmap_services_cycles_np, ifmap_demand_mat),
+                            make_trace_matrix(filter_services_cycles_np, filter_demand_mat),
+                            make_trace_matrix(ofmap_services_cycles_np, ofmap_demand_mat)]
+
+            # Track the first and the last cycle with a valid request, as the SRAM traces are not kept
+            sram_start_stop_cycles = [[self.ifmap_sram_start_cycle, self.ifmap_sram_stop_cycle],
+                                      [self.filter_sram_start_cycle, self.filter_sram_stop_cycle],
+                                      [self.ofmap_sram_start_cycle, self.ofmap_sram_stop_cycle]]
+            for idx, trace_block in enumerate(trace_blocks):
+                block_start_stop_cycles = get_valid_start_stop_cycles(trace_block)
+                if block_start_stop_cycles is None:
+                    continue
+                if not sram_start_seen[idx]:
+                    sram_start_stop_cycles[idx][0] = block_start_stop_cycles[0]
+                    sram_start_seen[idx] = True
+                sram_start_stop_cycles[idx][1] = block_start_stop_cycles[1]
+
+            self.ifmap_sram_start_cycle, self.ifmap_sram_stop_cycle = sram_start_stop_cycles[0]
+            self.filter_sram_start_cycle, self.filter_sram_stop_cycle = sram_start_stop_cycles[1]
+            self.ofmap_sram_start_cycle, self.ofmap_sram_stop_cycle = sram_start_stop_cycles[2]
+
+            if sram_trace_writers is not None:
+                for writer, trace_block in zip(sram_trace_writers, trace_blocks):
+                    writer.write(trace_block)
+
+        if self.estimate_bandwidth_mode:
+            self.ifmap_buf.complete_all_prefetches()
+            self.filter_buf.complete_all_prefetches()
+
+        self.ofmap_buf.empty_all_buffers(last_ofmap_serviced_cycle)
+        self.total_cycles = int(last_ofmap_serviced_cycle[0])
+
+        # END of serving demands from memory
+        self.traces_valid = True
+
+    # Service the demands one line at a time
+    def service_demand_lines(self, ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat,
+                             line_offset=0, show_progress=True):
+        ofmap_lines = ofmap_demand_mat.shape[0]
 
         ifmap_hit_latency = self.ifmap_buf.get_hit_latency()
         filter_hit_latency = self.filter_buf.get_hit_latency()
@@ -164,10 +282,10 @@ class double_buffered_scratchpad:
         filter_serviced_cycles = []
         ofmap_serviced_cycles = []
 
-        pbar_disable = not self.verbose
+        pbar_disable = not (self.verbose and show_progress)
         for i in tqdm(range(ofmap_lines), disable=pbar_disable):
 
-            cycle_arr = np.zeros((1,1)) + i + self.stall_cycles
+            cycle_arr = np.zeros((1,1)) + i + line_offset + self.stall_cycles
 
             ifmap_demand_line = ifmap_demand_mat[i, :].reshape((1,ifmap_demand_mat.shape[1]))
             ifmap_cycle_out = self.ifmap_buf.service_reads(incoming_requests_arr_np=ifmap_demand_line,
@@ -189,27 +307,140 @@ class double_buffered_scratchpad:
 
             self.stall_cycles += int(max(ifmap_stalls[0], filter_stalls[0], ofmap_stalls[0]))
 
-        if self.estimate_bandwidth_mode:
-            # IDE shows warning as complete_all_prefetches is not implemented in read_buffer class
-            # It is harmless since, in estimate bandwidth mode, read_buffer_estimate_bw is instantiated
-            self.ifmap_buf.complete_all_prefetches()
-            self.filter_buf.complete_all_prefetches()
+        ifmap_services_cycles_np = np.asarray(ifmap_serviced_cycles).reshape((len(ifmap_serviced_cycles), 1))
+        filter_services_cycles_np = np.asarray(filter_serviced_cycles).reshape((len(filter_serviced_cycles), 1))
+        ofmap_services_cycles_np = np.asarray(ofmap_serviced_cycles).reshape((len(ofmap_serviced_cycles), 1))
 
-        self.ofmap_buf.empty_all_buffers(ofmap_serviced_cycles[-1])
+        return ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np
 
-        # Prepare the traces
-        ifmap_services_cycles_np = np.asarray(ifmap_serviced_cycles).reshape((len(ifmap_serviced_cycles), 1))
-        self.ifmap_trace_matrix = np.concatenate((ifmap_services_cycles_np, ifmap_demand_mat), axis=1)
+    # Service the demands in batches of lines
+    # A stall in any of the buffers delays the following lines in all the buffers.
+    # Therefore a batch ends at the first line which can stall, ie. a line which triggers a prefetch in
+    # the read buffers or a line which waits for a drain in the write buffer.
+    # All the other lines in a batch are serviced without stalls, hence handing them to the buffers at once
+    # gives the same cycles as servicing them one at a time.
+    def service_demand_lines_batched(self, ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat,
+                                     line_offset=0, show_progress=True):
+        ofmap_lines = ofmap_demand_mat.shape[0]
 
-        filter_services_cycles_np = np.asarray(filter_serviced_cycles).reshape((len(filter_serviced_cycles), 1))
-        self.filter_trace_matrix = np.concatenate((filter_services_cycles_np, filter_demand_mat), axis=1)
+        ifmap_hit_latency = self.ifmap_buf.get_hit_latency()
+        filter_hit_latency = self.filter_buf.get_hit_latency()
 
-        ofmap_services_cycles_np = np.asarray(ofmap_serviced_cycles).reshape((len(ofmap_serviced_cycles), 1))
-        self.ofmap_trace_matrix = np.concatenate((ofmap_services_cycles_np, ofmap_demand_mat), axis=1)
-        self.total_cycles = int(ofmap_serviced_cycles[-1][0])
+        ifmap_serviced_cycles = []
+        filter_serviced_cycles = []
+        ofmap_serviced_cycles = []
 
-        # END of serving demands from memory
-        self.traces_valid = True
+        pbar = tqdm(total=ofmap_lines, disable=not (self.verbose and show_progress))
+
+        start_line = 0
+        while start_line < ofmap_lines:
+            end_line = min(start_line + self.max_batch_lines, ofmap_lines)
+
+            # 1. Lines till the first read which needs a prefetch, that line is included in the batch
+            ifmap_free_lines = self.ifmap_buf.get_stall_free_lines(ifmap_demand_mat[start_line:end_line, :])
+            filter_free_lines = self.filter_buf.get_stall_free_lines(filter_demand_mat[start_line:end_line, :])
+            end_line = min(start_line + min(ifmap_free_lines, filter_free_lines) + 1, end_line)
+
+            cycle_arr = np.zeros((end_line - start_line, 1)) \
+                        + np.arange(start_line, end_line).reshape((end_line - start_line, 1)) \
+                        + line_offset + self.stall_cycles
+
+            # 2. The write buffer is serviced first as it cannot predict the stalls without servicing
+            #    It stops after the first line which stalls, the batch is trimmed to that line
+            ofmap_cycle_out = self.ofmap_buf.service_writes(incoming_requests_arr_np=ofmap_demand_mat[start_line:end_line, :],
+                                                             incoming_cycles_arr_np=cycle_arr,
+                                                             stop_at_stall=True)
+            end_line = start_line + ofmap_cycle_out.shape[0]
+            cycle_arr = cycle_arr[:end_line - start_line]
+
+            # 3. The reads in the batch
+            ifmap_cycle_out = self.ifmap_buf.service_reads(incoming_requests_arr_np=ifmap_demand_mat[start_line:end_line, :],
+                                                            incoming_cycles_arr=cycle_arr)
+            filter_cycle_out = self.filter_buf.service_reads(incoming_requests_arr_np=filter_demand_mat[start_line:end_line, :],
+                                                              incoming_cycles_arr=cycle_arr)
+
+            ifmap_serviced_cycles.append(ifmap_cycle_out)
+            filter_serviced_cycles.append(filter_cycle_out)
+            ofmap_serviced_cycles.append(ofmap_cycle_out)
+
+            # 4. Only the last line of the batch can stall
+            ifmap_stalls = ifmap_cycle_out[-1] - cycle_arr[-1] - ifmap_hit_latency
+            filter_stalls = filter_cycle_out[-1] - cycle_arr[-1] - filter_hit_latency
+            ofmap_stalls = ofmap_cycle_out[-1] - cycle_arr[-1] - 1
+
+            self.stall_cycles += int(max(ifmap_stalls[0], filter_stalls[0], ofmap_stalls[0]))
+
+            pbar.update(end_line - start_line)
+            start_line = end_line
+
+        pbar.close()
+
+        ifmap_services_cycles_np = np.concatenate(ifmap_serviced_cycles, axis=0)
+        filter_services_cycles_np = np.concatenate(filter_serviced_cycles, axis=0)
+        ofmap_services_cycles_np = np.concatenate(ofmap_serviced_cycles, axis=0)
+
+        return ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np
+
+    # Service the demands, jumping over the runs of lines without any valid request
+    # Such a line does not change the state of the buffers and does not stall, the reads are serviced
+    # with the hit latency and the writes in the same cycle. The cycles of a run are therefore
+    # computed directly, the other lines are serviced one at a time as in service_demand_lines().
+    def service_demand_lines_event(self, ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat,
+                                   line_offset=0, show_progress=True):
+        ofmap_lines = ofmap_demand_mat.shape[0]
+
+        ifmap_hit_latency = self.ifmap_buf.get_hit_latency()
+        filter_hit_latency = self.filter_buf.get_hit_latency()
+
+        null_lines = (ifmap_demand_mat == -1).all(axis=1) \
+                     & (filter_demand_mat == -1).all(axis=1) \
+                     & (ofmap_demand_mat == -1).all(axis=1)
+        # The first line of the layer is always serviced, as it starts the prefetches of the read buffers
+        if line_offset == 0 and ofmap_lines > 0:
+            null_lines[0] = False
+
+        # Runs of lines which are all null or all with requests
+        run_starts = np.flatnonzero(np.diff(null_lines.astype(np.int8))) + 1
+        run_bounds = [0] + run_starts.tolist() + [ofmap_lines]
+
+        ifmap_serviced_cycles = []
+        filter_serviced_cycles = []
+        ofmap_serviced_cycles = []
+
+        pbar = tqdm(total=ofmap_lines, disable=not (self.verbose and show_progress))
+
+        for start_line, end_line in zip(run_bounds[:-1], run_bounds[1:]):
+            if start_line == end_line:
+                continue
+
+            if null_lines[start_line]:
+                cycle_arr = np.zeros((end_line - start_line, 1)) \
+                            + np.arange(start_line, end_line).reshape((end_line - start_line, 1)) \
+                            + line_offset + self.stall_cycles
+
+                ifmap_serviced_cycles.append(cycle_arr + ifmap_hit_latency)
+                filter_serviced_cycles.append(cycle_arr + filter_hit_latency)
+                ofmap_serviced_cycles.append(cycle_arr)
+            else:
+                ifmap_cycle_out, filter_cycle_out, ofmap_cycle_out \
+                    = self.service_demand_lines(ifmap_demand_mat[start_line:end_line, :],
+                                                filter_demand_mat[start_line:end_line, :],
+                                                ofmap_demand_mat[start_line:end_line, :],
+                                                line_offset=line_offset + start_line, show_progress=False)
+
+                ifmap_serviced_cycles.append(ifmap_cycle_out)
+                filter_serviced_cycles.append(filter_cycle_out)
+                ofmap_serviced_cycles.append(ofmap_cycle_out)
+
+            pbar.update(end_line - start_line)
+
+        pbar.close()
+
+        ifmap_services_cycles_np = np.concatenate(ifmap_serviced_cycles, axis=0)
+        filter_services_cycles_np = np.concatenate(filter_serviced_cycles, axis=0)
+        ofmap_services_cycles_np = np.concatenate(ofmap_serviced_cycles, axis=0)
+
+        return ifmap_services_cycles_np, filter_services_cycles_np, ofmap_services_cycles_np
 
     # This is the trace computation logic of this memory system
     # Anand: This is too complex, perform the serve cycle by cycle for the requests
@@ -364,28 +595,13 @@ class double_buffered_scratchpad:
     def get_ifmap_sram_start_stop_cycles(self):
         assert self.traces_valid, 'Traces not generated yet'
 
-        done = False
-        for ridx in range(self.ifmap_trace_matrix.shape[0]):
-            if done:
-                break
-            row = self.ifmap_trace_matrix[ridx,1:]
-            for addr in row:
-                if not addr == -1:
-                    self.ifmap_sram_start_cycle = self.ifmap_trace_matrix[ridx][0]
-                    done = True
-                    break
-
-        done = False
-        for ridx in range(self.ifmap_trace_matrix.shape[0]):
-            if done:
-                break
-            ridx = -1 * (ridx + 1)
-            row = self.ifmap_trace_matrix[ridx,1:]
-            for addr in row:
-                if not addr == -1:
-                    self.ifmap_sram_stop_cycle  = self.ifmap_trace_matrix[ridx][0]
-                    done = True
-                    break
+        # Tracked while servicing, when the traces are not kept
+        if self.sram_traces_streamed:
+            return self.ifmap_sram_start_cycle, self.ifmap_sram_stop_cycle
+
+        start_stop_cycles = get_valid_start_stop_cycles(self.ifmap_trace_matrix)
+        if start_stop_cycles is not None:
+            self.ifmap_sram_start_cycle, self.ifmap_sram_stop_cycle = start_stop_cycles
 
         return self.ifmap_sram_start_cycle, self.ifmap_sram_stop_cycle
 
@@ -393,28 +609,13 @@ class double_buffered_scratchpad:
     def get_filter_sram_start_stop_cycles(self):
         assert self.traces_valid, 'Traces not generated yet'
 
-        done = False
-        for ridx in range(self.filter_trace_matrix.shape[0]):
-            if done:
-                break
-            row = self.filter_trace_matrix[ridx, 1:]
-            for addr in row:
-                if not addr == -1:
-                    self.filter_sram_start_cycle = self.filter_trace_matrix[ridx][0]
-                    done = True
-                    break
-
-        done = False
-        for ridx in range(self.filter_trace_matrix.shape[0]):
-            if done:
-                break
-            ridx = -1 * (ridx + 1)
-            row = self.filter_trace_matrix[ridx, 1:]
-            for addr in row:
-                if not addr == -1:
-                    self.filter_sram_stop_cycle = self.filter_trace_matrix[ridx][0]
-                    done = True
-                    break
+        # Tracked while servicing, when the traces are not kept
+        if self.sram_traces_streamed:
+            return self.filter_sram_start_cycle, self.filter_sram_stop_cycle
+
+        start_stop_cycles = get_valid_start_stop_cycles(self.filter_trace_matrix)
+        if start_stop_cycles is not None:
+            self.filter_sram_start_cycle, self.filter_sram_stop_cycle = start_stop_cycles
 
         return self.filter_sram_start_cycle, self.filter_sram_stop_cycle
 
@@ -422,28 +623,13 @@ class double_buffered_scratchpad:
     def get_ofmap_sram_start_stop_cycles(self):
         assert self.traces_valid, 'Traces not generated yet'
 
-        done = False
-        for ridx in range(self.ofmap_trace_matrix.shape[0]):
-            if done:
-                break
-            row = self.ofmap_trace_matrix[ridx, 1:]
-            for addr in row:
-                if not addr == -1:
-                    self.ofmap_sram_start_cycle = self.ofmap_trace_matrix[ridx][0]
-                    done = True
-                    break
-
-        done = False
-        for ridx in range(self.ofmap_trace_matrix.shape[0]):
-            if done:
-                break
-            ridx = -1 * (ridx + 1)
-            row = self.ofmap_trace_matrix[ridx, 1:]
-            for addr in row:
-                if not addr == -1:
-                    self.ofmap_sram_stop_cycle = self.ofmap_trace_matrix[ridx][0]
-                    done = True
-                    break
+        # Tracked while servicing, when the traces are not kept
+        if self.sram_traces_streamed:
+            return self.ofmap_sram_start_cycle, self.ofmap_sram_stop_cycle
+
+        start_stop_cycles = get_valid_start_stop_cycles(self.ofmap_trace_matrix)
+        if start_stop_cycles is not None:
+            self.ofmap_sram_start_cycle, self.ofmap_sram_stop_cycle = start_stop_cycles
 
         return self.ofmap_sram_start_cycle, self.ofmap_sram_stop_cycle
 
@@ -480,21 +666,25 @@ class double_buffered_scratchpad:
     #
     def get_ifmap_sram_trace_matrix(self):
         assert self.traces_valid, 'Traces not generated yet'
+        assert not self.sram_traces_streamed, 'SRAM traces were streamed and not kept'
         return self.ifmap_trace_matrix
 
     #
     def get_filter_sram_trace_matrix(self):
         assert self.traces_valid, 'Traces not generated yet'
+        assert not self.sram_traces_streamed, 'SRAM traces were streamed and not kept'
         return self.filter_trace_matrix
 
     #
     def get_ofmap_sram_trace_matrix(self):
         assert self.traces_valid, 'Traces not generated yet'
+        assert not self.sram_traces_streamed, 'SRAM traces were streamed and not kept'
         return self.ofmap_trace_matrix
 
     #
     def get_sram_trace_matrices(self):
         assert self.traces_valid, 'Traces not generated yet'
+        assert not self.sram_traces_streamed, 'SRAM traces were streamed and not kept'
         return self.ifmap_trace_matrix, self.filter_trace_matrix, self.ofmap_trace_matrix
 
     #
@@ -520,16 +710,19 @@ class double_buffered_scratchpad:
         #
     def print_ifmap_sram_trace(self, filename):
         assert self.traces_valid, 'Traces not generated yet'
+        assert not self.sram_traces_streamed, 'SRAM traces were streamed and not kept'
         np.savetxt(filename, self.ifmap_trace_matrix, fmt='%i', delimiter=",")
 
     #
     def print_filter_sram_trace(self, filename):
         assert self.traces_valid, 'Traces not generated yet'
+        assert not self.sram_traces_streamed, 'SRAM traces were streamed and not kept'
         np.savetxt(filename, self.filter_trace_matrix, fmt='%i', delimiter=",")
 
     #
     def print_ofmap_sram_trace(self, filename):
         assert self.traces_valid, 'Traces not generated yet'
+        assert not self.sram_traces_streamed, 'SRAM traces were streamed and not kept'
         np.savetxt(filename, self.ofmap_trace_matrix, fmt='%i', delimiter=",")
 
     #
@@ -1,10 +1,12 @@
 # Double buffer read memory implementation
 # TODO: Verification Pending
+import bisect
 import math
 import numpy as np
 from tqdm import tqdm
 
 from scalesim.memory.read_port import read_port
+from scalesim.utilities.trace_io import make_trace_matrix, dram_csv_fmt
 
 
 class read_buffer:
@@ -26,6 +28,7 @@ class read_buffer:
 
         # Status of the buffer
         self.hashed_buffer = dict()
+        self.addr_line_index = dict()
         self.num_lines = 0
         self.num_active_buf_lines = 1
         self.num_prefetch_buf_lines = 1
@@ -38,6 +41,11 @@ class read_buffer:
         self.next_line_prefetch_idx = 0
         self.next_col_prefetch_idx = 0
 
+        # Fetch phases, see set_fetch_phases()
+        self.fetch_phase_list = []
+        self.fetch_phase_id = 0
+        self.last_request_cycle = -1
+
         # Access counts
         self.num_access = 0
 
@@ -89,6 +97,7 @@ class read_buffer:
 
         # Status of the buffer
         self.hashed_buffer = dict()
+        self.addr_line_index = dict()
         self.active_buffer_set_limits = []
         self.prefetch_buffer_set_limits = []
 
@@ -98,6 +107,11 @@ class read_buffer:
         self.next_line_prefetch_idx = 0
         self.next_col_prefetch_idx = 0
 
+        # Fetch phases, see set_fetch_phases()
+        self.fetch_phase_list = []
+        self.fetch_phase_id = 0
+        self.last_request_cycle = -1
+
         # Access counts
         self.num_access = 0
 
@@ -113,52 +127,79 @@ class read_buffer:
     def set_fetch_matrix(self, fetch_matrix_np):
         # The operand matrix determines what to pre-fetch into both active and prefetch buffers
         # In 'user' mode, this will be set in the set_params
+        # A list of matrices is fetched in phases, see set_fetch_phases()
+        if isinstance(fetch_matrix_np, list):
+            self.set_fetch_phases(fetch_matrix_np)
+            return
 
         num_elems = fetch_matrix_np.shape[0] * fetch_matrix_np.shape[1]
         num_lines = int(math.ceil(num_elems / self.req_gen_bandwidth))
-        self.fetch_matrix = np.ones((num_lines, self.req_gen_bandwidth)) * -1
+        self.fetch_matrix = np.full((num_lines, self.req_gen_bandwidth), -1, dtype=fetch_matrix_np.dtype)
 
         # Put stuff into the fetch matrix
-        # This is done to ensure that there is no shape mismatch
-        # Not sure if this is the optimal way to do it or not
-        for i in range(num_elems):
-            src_row = math.floor(i / fetch_matrix_np.shape[1])
-            src_col = math.floor(i % fetch_matrix_np.shape[1])
-
-            dest_row = math.floor(i / self.req_gen_bandwidth)
-            dest_col = math.floor(i % self.req_gen_bandwidth)
-
-            self.fetch_matrix[dest_row][dest_col] = fetch_matrix_np[src_row][src_col]
+        # The operand is laid out in row major order, the tail of the last line is left as null requests
+        self.fetch_matrix.reshape(-1)[:num_elems] = fetch_matrix_np.reshape(-1)
 
         # Once the fetch matrices are set, populate the data structure for fast lookups and servicing
         self.prepare_hashed_buffer()
 
+    # Each phase is fetched as the operand of a layer of its own, eg. the packs of a grouped convolution
+    # The phases should not share any address. A phase starts with the first request to one of its addresses,
+    # it is fetched as at the start of a layer from the cycle after the last request to the previous phase.
+    def set_fetch_phases(self, fetch_matrix_list):
+        assert len(fetch_matrix_list) > 0, 'No fetch phases'
+
+        self.fetch_phase_list = fetch_matrix_list
+        self.fetch_phase_id = 0
+        self.set_fetch_matrix(self.get_phase_fetch_matrix(0))
+
+    # A phase which fits in the active buffer holds each of its addresses once, and is never evicted
+    # Otherwise it is streamed in the order of its matrix, as a dense operand
+    def get_phase_fetch_matrix(self, phase_id):
+        fetch_matrix_np = self.fetch_phase_list[phase_id]
+        valid_elems = fetch_matrix_np[fetch_matrix_np != -1]
+        _, first_idx = np.unique(valid_elems, return_index=True)
+
+        if first_idx.shape[0] > self.active_buf_size:
+            return fetch_matrix_np
+
+        return valid_elems[np.sort(first_idx)].reshape((1, -1))
+
     #
-    def prepare_hashed_buffer(self):
-        elems_per_set = math.ceil(self.total_size_elems / 100)
+    def start_fetch_phase(self, phase_id, start_cycle):
+        self.fetch_phase_id = phase_id
+        self.set_fetch_matrix(self.get_phase_fetch_matrix(phase_id))
 
-        prefetch_rows = self.fetch_matrix.shape[0]
-        prefetch_cols = self.fetch_matrix.shape[1]
+        trace_matrix = self.trace_matrix
+        self.prefetch_active_buffer(start_cycle=start_cycle)
+        self.trace_matrix = np.concatenate((trace_matrix, self.trace_matrix), axis=0)
 
-        line_id = 0
-        elem_ctr = 0
-        current_line = set()
+    # The next phase holding the address, the phases are fetched in order
+    def find_fetch_phase(self, addr):
+        for phase_id in range(self.fetch_phase_id + 1, len(self.fetch_phase_list)):
+            if np.any(self.fetch_phase_list[phase_id] == addr):
+                return phase_id
 
-        for r in range(prefetch_rows):
-            for c in range(prefetch_cols):
-                elem = self.fetch_matrix[r][c]
+        assert False, 'The address is not in any fetch phase: ' + str(addr)
 
-                if not elem == -1:
-                    current_line.add(elem)
-                    elem_ctr += 1
+    #
+    def prepare_hashed_buffer(self):
+        elems_per_set = math.ceil(self.total_size_elems / 100)
 
-                if not elem_ctr < elems_per_set:    # ie > or =
-                    self.hashed_buffer[line_id] = current_line
-                    line_id += 1
-                    elem_ctr = 0
-                    current_line = set()        # new set
+        # A line is closed after every elems_per_set valid requests, duplicates included
+        # The last line holds the remaining requests, and is empty if there are none
+        valid_elems = self.fetch_matrix[self.fetch_matrix != -1]
+        num_full_lines = valid_elems.shape[0] // elems_per_set
+        line_elems_list = np.split(valid_elems, np.arange(1, num_full_lines + 1) * elems_per_set)
 
-        self.hashed_buffer[line_id] = current_line
+        self.hashed_buffer = dict()
+        for line_id, line_elems in enumerate(line_elems_list):
+            self.hashed_buffer[line_id] = set(line_elems.tolist())
+        line_id = num_full_lines
+
+        # Maps each address to the sorted list of the lines holding it
+        # This makes a hit check a single lookup instead of a scan over the lines in the active buffer
+        self.build_addr_line_index(valid_elems, elems_per_set)
 
         max_num_active_buf_lines = int(math.ceil(self.active_buf_size / elems_per_set))
         max_num_prefetch_buf_lines = int(math.ceil(self.prefetch_buf_size / elems_per_set))
@@ -179,30 +220,65 @@ class read_buffer:
         self.num_lines = num_lines
         self.hashed_buffer_valid = True
 
+    #
+    def build_addr_line_index(self, valid_elems, elems_per_set):
+        self.addr_line_index = dict()
+        if valid_elems.shape[0] == 0:
+            return
+
+        elem_line_ids = np.arange(valid_elems.shape[0]) // elems_per_set
+
+        # Sort by address then line id, and keep each (address, line) pair once
+        order = np.lexsort((elem_line_ids, valid_elems))
+        sorted_addrs = valid_elems[order]
+        sorted_line_ids = elem_line_ids[order]
+        keep = np.ones(sorted_addrs.shape[0], dtype=bool)
+        keep[1:] = (sorted_addrs[1:] != sorted_addrs[:-1]) | (sorted_line_ids[1:] != sorted_line_ids[:-1])
+        sorted_addrs = sorted_addrs[keep]
+        sorted_line_ids = sorted_line_ids[keep]
+
+        # Group the line ids by address, they stay in increasing order within each group
+        addr_starts = np.flatnonzero(np.r_[True, sorted_addrs[1:] != sorted_addrs[:-1]])
+        line_ids_per_addr = np.split(sorted_line_ids, addr_starts[1:])
+        self.addr_line_index = dict(zip(sorted_addrs[addr_starts].tolist(),
+                                        [line_ids.tolist() for line_ids in line_ids_per_addr]))
+
     #
     def active_buffer_hit(self, addr):
         assert self.active_buf_full_flag, 'Active buffer is not ready yet'
 
+        line_ids = self.addr_line_index.get(addr)     # O(1) --> accessing hash
+        # Fixing for ISSUE #14
+        # return True
+        if line_ids is None:
+            return False
+
         start_id, end_id = self.active_buffer_set_limits
         if start_id < end_id:
-            for line_id in range(start_id, end_id):
-                this_set = self.hashed_buffer[line_id]      # O(1) --> accessing hash
-                if addr in this_set:                        # Checking in a set(), O(1) lookup
-                    return True
+            # The first line at or after the start of the active buffer should be before its end
+            idx = bisect.bisect_left(line_ids, start_id)
+            return idx < len(line_ids) and line_ids[idx] < end_id
 
-        else:
-            for line_id in range(start_id, self.num_lines):
-                this_set = self.hashed_buffer[line_id]  # O(1) --> accessing hash
-                if addr in this_set:  # Checking in a set(), O(1) lookup
-                    return True
-
-            for line_id in range(end_id):
-                this_set = self.hashed_buffer[line_id]  # O(1) --> accessing hash
-                if addr in this_set:  # Checking in a set(), O(1) lookup
-                    return True
-        # Fixing for ISSUE #14
-        # return True
-        return False
+        # The active buffer wraps around, ie. lines [start_id, num_lines) and [0, end_id)
+        return line_ids[-1] >= start_id or line_ids[0] < end_id
+
+    #
+    def get_stall_free_lines(self, incoming_requests_arr_np):
+        # Returns the number of leading request lines which are serviced entirely from the active buffer
+        # These lines are serviced with the hit latency and do not change the state of the buffer
+        # This check does not modify the buffer
+        if not self.active_buf_full_flag:
+            return 0
+
+        num_lines = incoming_requests_arr_np.shape[0]
+        valid_requests = incoming_requests_arr_np[incoming_requests_arr_np != -1]
+        missed_addrs = [addr for addr in np.unique(valid_requests) if not self.active_buffer_hit(addr)]
+
+        if len(missed_addrs) == 0:
+            return num_lines
+
+        miss_lines = np.isin(incoming_requests_arr_np, missed_addrs).any(axis=1)
+        return int(np.argmax(miss_lines))
 
     #
     def service_reads(self, incoming_requests_arr_np,   # 2D array with the requests
@@ -236,6 +312,12 @@ class read_buffer:
                 # Fixing for ISSUE #14
                 # if not self.active_buffer_hit(addr):  # --> While loop ensures multiple prefetches if needed
                 while not self.active_buffer_hit(addr):
+                    # The address is in a later phase
+                    if len(self.fetch_phase_list) > 0 and addr not in self.addr_line_index:
+                        phase_id = self.find_fetch_phase(addr)
+                        self.start_fetch_phase(phase_id, start_cycle=self.last_request_cycle + 1)
+                        continue
+
                     self.new_prefetch()
                     potential_stall_cycles = self.last_prefect_cycle - (cycle + offset)
                     offset += potential_stall_cycles        # Offset increments if there were potential stalls
@@ -243,6 +325,9 @@ class read_buffer:
             out_cycles = cycle + offset
             out_cycles_arr.append(out_cycles)
 
+            if len(self.fetch_phase_list) > 0 and np.any(request_line != -1):
+                self.last_request_cycle = int(out_cycles[0]) - self.hit_latency
+
         out_cycles_arr_np = np.asarray(out_cycles_arr).reshape((len(out_cycles_arr), 1))
 
         return out_cycles_arr_np
@@ -290,7 +375,7 @@ class read_buffer:
         self.last_prefect_cycle = int(response_cycles_arr[-1][0])
 
         # Update the trace matrix
-        self.trace_matrix = np.concatenate((response_cycles_arr, prefetch_requests), axis=1)
+        self.trace_matrix = make_trace_matrix(response_cycles_arr, prefetch_requests)
         self.trace_valid = True
 
         # Set active buffer contents
@@ -375,7 +460,7 @@ class read_buffer:
 
         assert response_cycles_arr.shape == cycles_arr.shape, 'The request and response cycles dims do not match'
 
-        this_prefetch_trace = np.concatenate((response_cycles_arr, prefetch_requests), axis=1)
+        this_prefetch_trace = make_trace_matrix(response_cycles_arr, prefetch_requests)
         self.trace_matrix = np.concatenate((self.trace_matrix, this_prefetch_trace), axis=0)
 
         # Set the line to be prefetched next
@@ -421,4 +506,4 @@ class read_buffer:
             print('No trace has been generated yet')
             return
 
-        np.savetxt(filename, self.trace_matrix, fmt='%s', delimiter=",")
+        np.savetxt(filename, self.trace_matrix, fmt=dram_csv_fmt, delimiter=",")
@@ -2,6 +2,7 @@ import math
 import numpy as np
 
 from scalesim.memory.read_port import read_port
+from scalesim.utilities.trace_io import make_trace_matrix, dram_csv_fmt
 
 
 class ReadBufferEstimateBw:
@@ -26,6 +27,7 @@ class ReadBufferEstimateBw:
 
         # Trace matrix
         self.trace_matrix = np.ones((1, 1))
+        self.request_dtype = np.dtype(np.int32)
 
         # Tracking variables
         self.num_items_per_set = -1
@@ -93,6 +95,8 @@ class ReadBufferEstimateBw:
         assert self.params_set_flag, 'Parameters are not set yet'
         assert incoming_cycles_arr.shape[0] == incoming_requests_arr_np.shape[0], 'Incoming cycles and requests dont match'
 
+        self.request_dtype = incoming_requests_arr_np.dtype
+
         outcycles = incoming_cycles_arr + self.hit_latency  # In estimate mode, operation is stall free.
         # Therefore its always a hit
 
@@ -112,6 +116,11 @@ class ReadBufferEstimateBw:
 
         return outcycles
 
+    #
+    def get_stall_free_lines(self, incoming_requests_arr_np):
+        # In estimate mode, operation is stall free.
+        return incoming_requests_arr_np.shape[0]
+
     #
     def manage_prefetches(self, cycle, addr):
 
@@ -241,7 +250,7 @@ class ReadBufferEstimateBw:
             for _ in range(delta):
                 all_addresses += [-1]
 
-        prefetch_requests = np.asarray(all_addresses).reshape((cycles_needed, self.prefetch_bandwidth))
+        prefetch_requests = np.asarray(all_addresses, dtype=self.request_dtype).reshape((cycles_needed, self.prefetch_bandwidth))
 
         cycles_arr = np.zeros((cycles_needed,1))
         for i in range(cycles_arr.shape[0]):
@@ -251,7 +260,7 @@ class ReadBufferEstimateBw:
                                                                 incoming_requests_arr_np=prefetch_requests)
 
         # Create / add elements to the trace matrix
-        this_prefetch_traces = np.concatenate((response_cycles_arr, prefetch_requests), axis=1)
+        this_prefetch_traces = make_trace_matrix(response_cycles_arr, prefetch_requests)
 
         if not self.trace_valid:
             self.trace_matrix = this_prefetch_traces
@@ -260,12 +269,12 @@ class ReadBufferEstimateBw:
         else:
             del_cols = self.trace_matrix.shape[1] - this_prefetch_traces.shape[1]
             if del_cols > 0:
-                empty_cols = np.ones((this_prefetch_traces.shape[0], del_cols))
+                empty_cols = np.ones((this_prefetch_traces.shape[0], del_cols), dtype=this_prefetch_traces.dtype)
                 this_prefetch_traces = np.concatenate((this_prefetch_traces, empty_cols), axis=1)
 
             elif del_cols < 0:
                 del_cols = int(-1 * del_cols)
-                empty_cols = np.ones((self.trace_matrix.shape[0], del_cols))
+                empty_cols = np.ones((self.trace_matrix.shape[0], del_cols), dtype=self.trace_matrix.dtype)
                 self.trace_matrix = np.concatenate((self.trace_matrix, empty_cols), axis=1)
 
             self.trace_matrix = np.concatenate((self.trace_matrix, this_prefetch_traces), axis=0)
@@ -306,6 +315,6 @@ class ReadBufferEstimateBw:
             print('No trace has been generated yet')
             return
 
-        np.savetxt(filename, self.trace_matrix, fmt='%s', delimiter=",")
+        np.savetxt(filename, self.trace_matrix, fmt=dram_csv_fmt, delimiter=",")
 
 
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+# LRU stack distance of each access of an address stream (Mattson et al.), -1 for the first access to an address
+# The stack distance is the number of distinct other addresses accessed since the last access to the same address,
+# the access hits in a fully associative LRU buffer of C words iff its distance is less than C.
+# The distinct addresses of the window (prev, t) are the ones whose next access is after t:
+#   dist(t) = #{j < t : next(j) > t} - #{j <= prev(t) : next(j) > t}
+# The first term is a prefix count, the second one is counted on the dyadic blocks of the prefix [0, prev(t)],
+# with the next accesses of each block sorted as in a merge sort tree. All the accesses are done at once in numpy.
+def calc_stack_distances(addresses):
+    addresses = np.asarray(addresses, dtype=np.int64).reshape(-1)
+    num_accesses = addresses.shape[0]
+    distances = np.full(num_accesses, -1, dtype=np.int64)
+    if num_accesses == 0:
+        return distances
+
+    # Previous and next access to the same address, num_accesses when there is no next one
+    order = np.argsort(addresses, kind='stable')
+    same_as_prev = addresses[order[1:]] == addresses[order[:-1]]
+    prev_access = np.full(num_accesses, -1, dtype=np.int64)
+    next_access = np.full(num_accesses, num_accesses, dtype=np.int64)
+    prev_access[order[1:][same_as_prev]] = order[:-1][same_as_prev]
+    next_access[order[:-1][same_as_prev]] = order[1:][same_as_prev]
+
+    reuse = np.nonzero(prev_access >= 0)[0]
+    if reuse.shape[0] == 0:
+        return distances
+
+    # #{j < t : next(j) > t} = t - #{k <= t : k is a reuse}
+    num_reuse_upto = np.cumsum(prev_access >= 0)
+    live = reuse - num_reuse_upto[reuse]
+
+    # #{j <= prev(t) : next(j) > t}, over the blocks of the prefix of length prev(t) + 1
+    prefix_len = prev_access[reuse] + 1
+    query_t = reuse
+    stride = num_accesses + 1
+    before_prev = np.zeros(reuse.shape[0], dtype=np.int64)
+
+    # Block id and next access of each access, sorted; the blocks of a level are merged from the ones below
+    block_keys = np.arange(num_accesses, dtype=np.int64) * stride + next_access
+    level = 0
+    while (1 << level) <= num_accesses:
+        if level > 0:
+            # The pairs of sorted runs are merged by the stable sort in linear time
+            block_keys = ((block_keys // stride) >> 1) * stride + block_keys % stride
+            block_keys.sort(kind='stable')
+
+        in_level = np.nonzero((prefix_len >> level) & 1)[0]
+        if in_level.shape[0] > 0:
+            # The blocks of a level are full, the searches are much faster with sorted queries
+            block_ids = (prefix_len[in_level] >> level) - 1
+            block_end = (block_ids + 1) << level
+            query_keys = block_ids * stride + query_t[in_level]
+            query_order = np.argsort(query_keys)
+            after_t = np.empty(in_level.shape[0], dtype=np.int64)
+            after_t[query_order] = np.searchsorted(block_keys, query_keys[query_order], side='right')
+            before_prev[in_level] += block_end - after_t
+        level += 1
+
+    distances[reuse] = live - before_prev
+
+    return distances
+
+
+# DRAM reads of an ideal LRU buffer as a function of its capacity, for all the capacities at once
+# The demand addresses are streamed in the order of the demand matrices, the null requests (-1) are skipped
+class stack_distance_analyzer:
+    def __init__(self):
+        self.address_blocks = []
+
+        self.num_accesses = 0
+        self.num_cold_misses = 0
+        self.capacities = np.zeros(1, dtype=np.int64)
+        self.dram_reads = np.zeros(1, dtype=np.int64)
+
+        self.curve_ready_flag = False
+
+    # The demand matrices are added in the order they are serviced, eg. one per fold
+    def add_demand_matrix(self, demand_mat):
+        demand_mat = np.asarray(demand_mat)
+        self.address_blocks.append(demand_mat[demand_mat >= 0].astype(np.int64))
+        self.curve_ready_flag = False
+
+    #
+    def calc_dram_read_curve(self):
+        if len(self.address_blocks) > 0:
+            addresses = np.concatenate(self.address_blocks)
+        else:
+            addresses = np.zeros(0, dtype=np.int64)
+
+        distances = calc_stack_distances(addresses)
+        reuse_distances = distances[distances >= 0]
+
+        self.num_accesses = addresses.shape[0]
+        self.num_cold_misses = self.num_accesses - reuse_distances.shape[0]
+
+        # The reads only change at the capacities one over a distance, everything misses without a buffer
+        unique_distances, counts = np.unique(reuse_distances, return_counts=True)
+        self.capacities = np.concatenate([np.zeros(1, dtype=np.int64), unique_distances + 1])
+        misses_over = reuse_distances.shape[0] - np.cumsum(counts)
+        self.dram_reads = np.concatenate([np.array([self.num_accesses], dtype=np.int64),
+                                          self.num_cold_misses + misses_over])
+
+        self.curve_ready_flag = True
+
+    # Steps of the curve: a buffer of at least capacities[i] words makes dram_reads[i] reads
+    def get_dram_read_curve(self):
+        if not self.curve_ready_flag:
+            self.calc_dram_read_curve()
+
+        return self.capacities, self.dram_reads
+
+    # DRAM reads for a buffer of the given capacity in words
+    def get_dram_reads(self, capacity):
+        capacities, dram_reads = self.get_dram_read_curve()
+        step = np.searchsorted(capacities, capacity, side='right') - 1
+
+        return int(dram_reads[step])
+
+    #
+    def get_num_accesses(self):
+        if not self.curve_ready_flag:
+            self.calc_dram_read_curve()
+
+        return self.num_accesses
+
+    #
+    def get_num_cold_misses(self):
+        if not self.curve_ready_flag:
+            self.calc_dram_read_curve()
+
+        return self.num_cold_misses
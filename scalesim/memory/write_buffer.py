@@ -6,6 +6,27 @@ import numpy as np
 #import matplotlib.pyplot as plt
 from tqdm import tqdm
 from scalesim.memory.write_port import write_port
+from scalesim.utilities.trace_io import make_trace_matrix, dram_csv_fmt
+
+
+# Returns a matrix with room for at least num_rows rows, the capacity is doubled to amortize the copies
+# The rows past the ones in use are filled with -1
+def reserve_rows(matrix, num_rows, num_cols, dtype, min_rows=1):
+    if matrix.shape[0] == 0:
+        new_dtype = np.dtype(dtype)
+    else:
+        new_dtype = np.result_type(matrix.dtype, dtype)
+
+    if num_rows <= matrix.shape[0] and new_dtype == matrix.dtype:
+        return matrix
+
+    capacity = matrix.shape[0]
+    if num_rows > capacity:
+        capacity = max(num_rows, 2 * capacity, min_rows)
+    new_matrix = np.full((capacity, num_cols), -1, dtype=new_dtype)
+    new_matrix[:matrix.shape[0], :] = matrix
+
+    return new_matrix
 
 
 class write_buffer:
@@ -30,17 +51,18 @@ class write_buffer:
         self.drain_buf_end_line_id = 0
 
         # Helper data structures for faster execution
+        # The trace lines and their drain cycles are kept in preallocated matrices, grown by doubling
         self.line_idx = 0
-        self.current_line = np.ones((1, 1)) * -1
-        self.max_cache_lines = 2 ** 10              # TODO: This is arbitrary, check if this can be tuned
-        self.trace_matrix_cache = np.zeros((1, 1))
+        self.num_trace_lines = 0
+        self.request_dtype = np.dtype(np.int32)
+        self.min_trace_lines = 2 ** 10
 
         # Access counts
         self.num_access = 0
 
         # Trace matrix
-        self.trace_matrix = np.zeros((1, 1))
-        self.cycles_vec = np.zeros((1, 1))
+        self.trace_matrix = np.zeros((0, 1))
+        self.cycles_vec = np.zeros((0, 1))
 
         # Flags
         # This variable determines where the new requests should be buffered
@@ -50,9 +72,6 @@ class write_buffer:
         self.drain_end_cycle = 0
 
         self.trace_valid = False
-        # Fixing ISSUE #10
-        self.trace_matrix_cache_empty = True
-        self.trace_matrix_empty = True
 
     #
     def set_params(self, backing_buf_obj,
@@ -87,94 +106,70 @@ class write_buffer:
         self.drain_buf_contents = []
         self.drain_end_cycle = 0
 
-        self.trace_matrix = np.zeros((1, 1))
+        self.line_idx = 0
+        self.num_trace_lines = 0
+        self.drain_buf_start_line_id = 0
+        self.drain_buf_end_line_id = 0
+        self.trace_matrix = np.zeros((0, 1))
+        self.cycles_vec = np.zeros((0, 1))
 
         self.num_access = 0
         self.state = 0
 
         self.trace_valid = False
-        # Fixing ISSUE #10
-        self.trace_matrix_cache_empty = True
-        self.trace_matrix_empty = True
 
-    #
-    def store_to_trace_mat_cache(self, elem):
-        if elem == -1:
+    # Append the requests to the trace, filling the open line first
+    def store_to_trace(self, requests_arr_np):
+        num_requests = requests_arr_np.shape[0]
+        if num_requests == 0:
             return
 
-        if self.current_line.shape == (1,1):    # This line is empty
-            self.current_line = np.ones((1, self.req_gen_bandwidth)) * -1
-
-        self.current_line[0, self.line_idx] = elem
-        self.line_idx += 1
-        self.free_space -= 1
-
-        if not self.line_idx < self.req_gen_bandwidth:
-            # Store to the cache matrix
-            # Fixing ISSUE #10
-            # if self.trace_matrix_cache.shape == (1,1):
-            if self.trace_matrix_cache_empty:
-                self.trace_matrix_cache = self.current_line
-                self.trace_matrix_cache_empty = False
-            else:
-                self.trace_matrix_cache = np.concatenate((self.trace_matrix_cache, self.current_line), axis=0)
-
-            self.current_line = np.ones((1,1)) * -1
+        start_idx = self.num_trace_lines * self.req_gen_bandwidth + self.line_idx
+        end_idx = start_idx + num_requests
+        num_lines = int(math.ceil(end_idx / self.req_gen_bandwidth))
+        self.trace_matrix = reserve_rows(self.trace_matrix, num_lines, self.req_gen_bandwidth,
+                                         dtype=requests_arr_np.dtype, min_rows=self.min_trace_lines)
+
+        # The unused entries of the lines are already -1
+        self.trace_matrix.reshape(-1)[start_idx:end_idx] = requests_arr_np
+        self.num_trace_lines, self.line_idx = divmod(end_idx, self.req_gen_bandwidth)
+        self.free_space -= num_requests
+
+    # Close the partially filled line so that it can be drained
+    def close_trace_line(self):
+        if not self.line_idx == 0:
+            self.num_trace_lines += 1
             self.line_idx = 0
 
-            if not self.trace_matrix_cache.shape[0] < self.max_cache_lines:
-                self.append_to_trace_mat()
-
     #
-    def append_to_trace_mat(self, force=False):
-        if force:   # This forces the contents for self.current_line and self.trace_matrix cache to be dumped
-            if not self.line_idx == 0:
-                #if self.trace_matrix_cache.shape == (1,1):
-                if self.trace_matrix_cache_empty:
-                    self.trace_matrix_cache = self.current_line
-                    self.trace_matrix_cache_empty = False
-                else:
-                    self.trace_matrix_cache = np.concatenate((self.trace_matrix_cache, self.current_line), axis=0)
-
-                self.current_line = np.ones((1,1)) * -1
-                self.line_idx = 0
-        # Fixing ISSUE #10
-        # if self.trace_matrix_cache.shape == (1,1):
-        if self.trace_matrix_cache_empty:
-            return
-
-        #if self.trace_matrix.shape == (1,1):
-        if self.trace_matrix_empty:
-            self.trace_matrix = self.trace_matrix_cache
-            self.drain_buf_start_line_id = 0
-            self.trace_matrix_empty = False
-        else:
-            self.trace_matrix = np.concatenate((self.trace_matrix, self.trace_matrix_cache), axis=0)
-
-        self.trace_matrix_cache = np.zeros((1,1))
-        # Fixing ISSUE #10
-        self.trace_matrix_cache_empty = True
-
-    #
-    def service_writes(self, incoming_requests_arr_np, incoming_cycles_arr_np):
+    # When stop_at_stall is set, the servicing stops after the first line which stalls
+    # The cycles are returned only for the lines which were serviced
+    def service_writes(self, incoming_requests_arr_np, incoming_cycles_arr_np, stop_at_stall=False):
         assert incoming_cycles_arr_np.shape[0] == incoming_requests_arr_np.shape[0], 'Cycles and requests do not match'
+        self.request_dtype = incoming_requests_arr_np.dtype
         out_cycles_arr = []
         offset = 0
 
-        DEBUG_num_drains = 0
-        DEBUG_append_to_trace_times = []
-
         for i in tqdm(range(incoming_requests_arr_np.shape[0]), disable=True):
             row = incoming_requests_arr_np[i]
             cycle = incoming_cycles_arr_np[i]
             current_cycle = cycle[0] + offset
 
-            for elem in row:
-                # Pay no attention to empty requests
-                if elem == -1:
-                    continue
+            # Pay no attention to empty requests
+            requests = row[row != -1]
+            num_requests = requests.shape[0]
+            start_idx = 0
 
-                self.store_to_trace_mat_cache(elem)
+            # The requests are stored in bulk up to the one which stalls or triggers a drain
+            while start_idx < num_requests:
+                if current_cycle < self.drain_end_cycle:
+                    num_no_event = max(self.free_space - 1, 0)
+                else:
+                    num_no_event = max(self.free_space - self.active_buf_size, 0)
+                end_idx = min(start_idx + num_no_event + 1, num_requests)
+
+                self.store_to_trace(requests[start_idx:end_idx])
+                start_idx = end_idx
 
                 if current_cycle < self.drain_end_cycle:
                     if not self.free_space > 0:
@@ -182,18 +177,16 @@ class write_buffer:
                         current_cycle = self.drain_end_cycle
 
                 elif self.free_space < (self.total_size_elems - self.drain_buf_size):
-                    self.append_to_trace_mat(force=True)
+                    self.close_trace_line()
                     self.drain_end_cycle = self.empty_drain_buf(empty_start_cycle=current_cycle)
 
             out_cycles_arr.append(current_cycle)
 
-        num_lines = incoming_requests_arr_np.shape[0]
-        out_cycles_arr_np = np.asarray(out_cycles_arr).reshape((num_lines, 1))
+            if stop_at_stall and offset > 0:
+                break
 
-        #print('DEBUG: Num Drains = ' + str(DEBUG_num_drains))
-        #print('DEBUG: Num appeneds = ' + str(len(DEBUG_append_to_trace_times)))
-        #plt.plot(DEBUG_append_to_trace_times)
-        #plt.show()
+        num_lines = len(out_cycles_arr)
+        out_cycles_arr_np = np.asarray(out_cycles_arr).reshape((num_lines, 1))
 
         return out_cycles_arr_np
 
@@ -202,28 +195,24 @@ class write_buffer:
 
         lines_to_fill_dbuf = int(math.ceil(self.drain_buf_size / self.req_gen_bandwidth))
         self.drain_buf_end_line_id = self.drain_buf_start_line_id + lines_to_fill_dbuf
-        self.drain_buf_end_line_id = min(self.drain_buf_end_line_id, self.trace_matrix.shape[0])
+        self.drain_buf_end_line_id = min(self.drain_buf_end_line_id, self.num_trace_lines)
 
         requests_arr_np = self.trace_matrix[self.drain_buf_start_line_id: self.drain_buf_end_line_id, :]
         num_lines = requests_arr_np.shape[0]
 
         data_sz_to_drain = num_lines * requests_arr_np.shape[1]
         # Adjust for -1
-        for elem in requests_arr_np[-1,:]:
-            if elem == -1:
-                data_sz_to_drain -= 1
+        data_sz_to_drain -= int(np.count_nonzero(requests_arr_np[-1, :] == -1))
         self.num_access += data_sz_to_drain
 
-        cycles_arr = [x+empty_start_cycle for x in range(num_lines)]
-        cycles_arr_np = np.asarray(cycles_arr).reshape((num_lines, 1))
+        cycles_arr_np = (np.arange(num_lines) + empty_start_cycle).reshape((num_lines, 1))
         serviced_cycles_arr = self.backing_buffer.service_writes(requests_arr_np, cycles_arr_np)
 
-        # Assign the cycles vector which will be used to generate the complete trace
-        if not self.trace_valid:
-            self.cycles_vec = serviced_cycles_arr
-            self.trace_valid = True
-        else:
-            self.cycles_vec = np.concatenate((self.cycles_vec, serviced_cycles_arr), axis=0)
+        # Store the cycles of the drained lines, used to generate the complete trace
+        self.cycles_vec = reserve_rows(self.cycles_vec, self.drain_buf_end_line_id, 1,
+                                       dtype=serviced_cycles_arr.dtype, min_rows=self.min_trace_lines)
+        self.cycles_vec[self.drain_buf_start_line_id: self.drain_buf_end_line_id, :] = serviced_cycles_arr
+        self.trace_valid = True
 
         service_end_cycle = serviced_cycles_arr[-1][0]
         self.free_space += data_sz_to_drain
@@ -233,12 +222,12 @@ class write_buffer:
 
     #
     def empty_all_buffers(self, cycle):
-        self.append_to_trace_mat(force=True)
+        self.close_trace_line()
 
-        if self.trace_matrix_empty:
+        if self.num_trace_lines == 0:
            return
 
-        while self.drain_buf_start_line_id < self.trace_matrix.shape[0]:
+        while self.drain_buf_start_line_id < self.num_trace_lines:
             self.drain_end_cycle = self.empty_drain_buf(empty_start_cycle=cycle)
             cycle = self.drain_end_cycle + 1
 
@@ -248,7 +237,8 @@ class write_buffer:
             print('No trace has been generated yet')
             return
 
-        trace_matrix = np.concatenate((self.cycles_vec, self.trace_matrix), axis=1)
+        trace_matrix = make_trace_matrix(self.cycles_vec[:self.drain_buf_start_line_id],
+                                         self.trace_matrix[:self.num_trace_lines])
 
         return trace_matrix
 
@@ -265,7 +255,7 @@ class write_buffer:
     def get_external_access_start_stop_cycles(self):
         assert self.trace_valid, 'Traces not ready yet'
         start_cycle = self.cycles_vec[0][0]
-        end_cycle = self.cycles_vec[-1][0]
+        end_cycle = self.cycles_vec[self.drain_buf_start_line_id - 1][0]
 
         return start_cycle, end_cycle
 
@@ -275,4 +265,4 @@ class write_buffer:
             print('No trace has been generated yet')
             return
         trace_matrix = self.get_trace_matrix()
-        np.savetxt(filename, trace_matrix, fmt='%s', delimiter=",")
+        np.savetxt(filename, trace_matrix, fmt=dram_csv_fmt, delimiter=",")
@@ -37,13 +37,23 @@ if __name__ == '__main__':
                         help="Tile size for the input layer"
                         )
     parser.add_argument('-df_mode', metavar='depth first', type=df_mode_parse,
-                        default=df_mode.FULL_RECOMPUTE,
+                        default=None,
                         help="Depth first scheduling mode"
                         )
     parser.add_argument('-stack_cut', metavar='layer_name', type=str, nargs='*',
                         default=[],
                         help="List of layers to cut the stack at"
                         )
+    parser.add_argument('-j', metavar='num workers', type=int,
+                        default=1,
+                        help="Number of worker processes to run the layers in parallel"
+                        )
+    parser.add_argument('--checkpoint', action='store_true',
+                        help="Save the completed layers, so that an interrupted run can be resumed"
+                        )
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip the layers completed by a previous run in the same log dir"
+                        )
 
     args = parser.parse_args()
     topology = args.t
@@ -56,6 +66,10 @@ if __name__ == '__main__':
     df_mode_arg = args.df_mode
     stack_cut = args.stack_cut
 
+    num_workers = args.j
+    resume = args.resume
+    checkpoint = args.checkpoint
+
     gemm_input = False
     if inp_type == 'gemm':
         gemm_input = True
@@ -78,6 +92,9 @@ if __name__ == '__main__':
         s = scalesim(save_disk_space=True, verbose=True,
                     config=config,
                     topology=topology,
-                    input_type_gemm=gemm_input
+                    input_type_gemm=gemm_input,
+                    num_workers=num_workers,
+                    resume=resume,
+                    checkpoint=checkpoint
                     )
         s.run_scale(top_path=logpath)
@@ -20,9 +20,26 @@ class scale_config:
         self.ofmap_offset = 20000000
         self.topofile = ""
         self.bandwidths = []
+        self.memory_service_mode = 'row'
+        self.trace_format = 'csv'
+        self.demand_mode = 'layer'
+        self.layer_cache_dir = ''
+        self.layer_cache_size_mb = 256
+        self.matrix_dtype = 'int32'
+        self.simulation_mode = 'cycle'
+        self.dedupe_layers = True
+        self.profile_mode = 'off'
+        self.reuse_profile = False
+        self.virtual_operand_matrices = False
         self.valid_conf_flag = False
 
         self.valid_df_list = ['os', 'ws', 'is']
+        self.valid_memory_service_mode_list = ['row', 'batched', 'event']
+        self.valid_trace_format_list = ['csv', 'npz', 'npy']
+        self.valid_demand_mode_list = ['layer', 'fold']
+        self.valid_matrix_dtype_list = ['int32', 'int64']
+        self.valid_simulation_mode_list = ['cycle', 'analytical']
+        self.valid_profile_mode_list = ['off', 'stages', 'cprofile']
 
     #
     def read_conf_file(self, conf_file_in):
@@ -47,6 +64,78 @@ class scale_config:
             message += 'Use either USER or CALC in InterfaceBandwidth feild. Aborting!'
             return
 
+        # Optional: How the demand matrices are serviced by the memory system
+        if config.has_option(section, 'MemoryServiceMode'):
+            self.memory_service_mode = config.get(section, 'MemoryServiceMode').strip()
+            if self.memory_service_mode not in self.valid_memory_service_mode_list:
+                print("WARNING: Invalid memory service mode, using row")
+                self.memory_service_mode = 'row'
+
+        # Optional: File format of the SRAM and DRAM traces
+        if config.has_option(section, 'TraceFormat'):
+            self.trace_format = config.get(section, 'TraceFormat').strip().lower()
+            if self.trace_format not in self.valid_trace_format_list:
+                print("WARNING: Invalid trace format, using csv")
+                self.trace_format = 'csv'
+
+        # Optional: Generate the demand matrices for the whole layer or one fold at a time
+        if config.has_option(section, 'DemandMode'):
+            self.demand_mode = config.get(section, 'DemandMode').strip().lower()
+            if self.demand_mode not in self.valid_demand_mode_list:
+                print("WARNING: Invalid demand mode, using layer")
+                self.demand_mode = 'layer'
+
+        # Optional: On-disk cache of the layer results, disabled when no directory is given
+        if config.has_option(section, 'LayerCacheDir'):
+            self.layer_cache_dir = config.get(section, 'LayerCacheDir').strip().strip('"')
+        if config.has_option(section, 'LayerCacheSizeMB'):
+            self.layer_cache_size_mb = int(config.get(section, 'LayerCacheSizeMB'))
+
+        # Optional: Integer type of the operand, demand and trace matrices
+        if config.has_option(section, 'MatrixDtype'):
+            self.matrix_dtype = config.get(section, 'MatrixDtype').strip().lower()
+            if self.matrix_dtype not in self.valid_matrix_dtype_list:
+                print("WARNING: Invalid matrix dtype, using int32")
+                self.matrix_dtype = 'int32'
+
+        # Optional: Replay the demands cycle by cycle or use the closed form model of the layers
+        if config.has_option(section, 'SimulationMode'):
+            self.simulation_mode = config.get(section, 'SimulationMode').strip().lower()
+            if self.simulation_mode not in self.valid_simulation_mode_list:
+                print("WARNING: Invalid simulation mode, using cycle")
+                self.simulation_mode = 'cycle'
+
+        # Optional: Simulate the layers with identical parameters only once
+        if config.has_option(section, 'DedupeLayers'):
+            dedupe_string = config.get(section, 'DedupeLayers').strip().lower()
+            if dedupe_string in ['true', 'false']:
+                self.dedupe_layers = dedupe_string == 'true'
+            else:
+                print("WARNING: Invalid DedupeLayers entry, use True or False")
+
+        # Optional: Write the time and memory of the stages of each layer, and a cProfile dump per layer
+        if config.has_option(section, 'Profile'):
+            self.profile_mode = config.get(section, 'Profile').strip().lower()
+            if self.profile_mode not in self.valid_profile_mode_list:
+                print("WARNING: Invalid profile mode, using off")
+                self.profile_mode = 'off'
+
+        # Optional: Write the DRAM reads of each operand as a function of the buffer size
+        if config.has_option(section, 'ReuseProfile'):
+            reuse_profile_string = config.get(section, 'ReuseProfile').strip().lower()
+            if reuse_profile_string in ['true', 'false']:
+                self.reuse_profile = reuse_profile_string == 'true'
+            else:
+                print("WARNING: Invalid ReuseProfile entry, use True or False")
+
+        # Optional: Compute the addresses of the operand matrices fold by fold instead of for the whole layer
+        if config.has_option(section, 'VirtualOperandMatrices'):
+            virtual_string = config.get(section, 'VirtualOperandMatrices').strip().lower()
+            if virtual_string in ['true', 'false']:
+                self.virtual_operand_matrices = virtual_string == 'true'
+            else:
+                print("WARNING: Invalid VirtualOperandMatrices entry, use True or False")
+
         section = 'architecture_presets'
         self.array_rows = int(config.get(section, 'ArrayHeight'))
         self.array_cols = int(config.get(section, 'ArrayWidth'))
@@ -102,6 +191,75 @@ class scale_config:
 
         self.valid_conf_flag = True
 
+    # Override the parameters with the entries of a dict, keyed by the names used in the config file
+    # Used by the sweeps, an invalid entry is an error instead of a warning
+    def update_from_dict(self, conf_dict):
+        for name, value in conf_dict.items():
+            key = str(name).strip().lower()
+            if isinstance(value, str):
+                value = value.strip()
+
+            if key == 'run_name':
+                self.run_name = str(value)
+            elif key == 'arrayheight':
+                self.array_rows = int(value)
+            elif key == 'arraywidth':
+                self.array_cols = int(value)
+            elif key == 'ifmapsramszkb':
+                self.ifmap_sz_kb = int(value)
+            elif key == 'filtersramszkb':
+                self.filter_sz_kb = int(value)
+            elif key == 'ofmapsramszkb':
+                self.ofmap_sz_kb = int(value)
+            elif key == 'ifmapoffset':
+                self.ifmap_offset = int(value)
+            elif key == 'filteroffset':
+                self.filter_offset = int(value)
+            elif key == 'ofmapoffset':
+                self.ofmap_offset = int(value)
+            elif key == 'dataflow':
+                assert value in self.valid_df_list, 'Invalid dataflow: ' + str(value)
+                self.df = value
+            elif key == 'bandwidth':
+                if isinstance(value, (list, tuple)):
+                    self.bandwidths = [int(x) for x in value]
+                else:
+                    self.bandwidths = [int(x.strip()) for x in str(value).split(',')]
+            elif key == 'interfacebandwidth':
+                assert value in ['USER', 'CALC'], 'Use either USER or CALC in InterfaceBandwidth'
+                self.use_user_bandwidth = value == 'USER'
+            elif key == 'memoryservicemode':
+                assert value in self.valid_memory_service_mode_list, 'Invalid memory service mode: ' + str(value)
+                self.memory_service_mode = value
+            elif key == 'traceformat':
+                self.set_trace_format(str(value).lower())
+            elif key == 'demandmode':
+                self.set_demand_mode(str(value).lower())
+            elif key == 'layercachedir':
+                self.layer_cache_dir = str(value)
+            elif key == 'layercachesizemb':
+                self.layer_cache_size_mb = int(value)
+            elif key == 'matrixdtype':
+                self.set_matrix_dtype(str(value).lower())
+            elif key == 'simulationmode':
+                self.set_simulation_mode(str(value).lower())
+            elif key == 'dedupelayers':
+                assert str(value).lower() in ['true', 'false'], 'Use either True or False in DedupeLayers'
+                self.dedupe_layers = str(value).lower() == 'true'
+            elif key == 'profile':
+                self.set_profile_mode(str(value).lower())
+            elif key == 'reuseprofile':
+                assert str(value).lower() in ['true', 'false'], 'Use either True or False in ReuseProfile'
+                self.reuse_profile = str(value).lower() == 'true'
+            elif key == 'virtualoperandmatrices':
+                assert str(value).lower() in ['true', 'false'], 'Use either True or False in VirtualOperandMatrices'
+                self.virtual_operand_matrices = str(value).lower() == 'true'
+            else:
+                assert False, 'Unknown config parameter: ' + str(name)
+
+        if self.use_user_bandwidth:
+            assert len(self.bandwidths) > 0, 'The user bandwidth needs to be provided'
+
     #
     def write_conf_file(self, conf_file_out):
         if not self.valid_conf_flag:
@@ -167,6 +325,52 @@ class scale_config:
         self.ifmap_offset = ofmap_offset
         self.valid_conf_flag = True
 
+    #
+    def set_memory_service_mode(self, mode='row'):
+        self.memory_service_mode = mode
+
+    #
+    def set_trace_format(self, trace_format='csv'):
+        assert trace_format in self.valid_trace_format_list, 'Invalid trace format'
+        self.trace_format = trace_format
+
+    #
+    def set_demand_mode(self, mode='layer'):
+        assert mode in self.valid_demand_mode_list, 'Invalid demand mode'
+        self.demand_mode = mode
+
+    #
+    def set_layer_cache(self, cache_dir='', size_mb=256):
+        self.layer_cache_dir = cache_dir
+        self.layer_cache_size_mb = size_mb
+
+    #
+    def set_matrix_dtype(self, matrix_dtype='int32'):
+        assert matrix_dtype in self.valid_matrix_dtype_list, 'Invalid matrix dtype'
+        self.matrix_dtype = matrix_dtype
+
+    #
+    def set_simulation_mode(self, mode='cycle'):
+        assert mode in self.valid_simulation_mode_list, 'Invalid simulation mode'
+        self.simulation_mode = mode
+
+    #
+    def set_dedupe_layers(self, dedupe=True):
+        self.dedupe_layers = dedupe
+
+    #
+    def set_profile_mode(self, mode='off'):
+        assert mode in self.valid_profile_mode_list, 'Invalid profile mode'
+        self.profile_mode = mode
+
+    #
+    def set_reuse_profile(self, reuse_profile=False):
+        self.reuse_profile = reuse_profile
+
+    #
+    def set_virtual_operand_matrices(self, virtual=False):
+        self.virtual_operand_matrices = virtual
+
     #
     def force_valid(self):
         self.valid_conf_flag = True
@@ -256,6 +460,46 @@ class scale_config:
         if self.valid_conf_flag:
             return self.ifmap_offset, self.filter_offset, self.ofmap_offset
 
+    def get_memory_service_mode(self):
+        if self.valid_conf_flag:
+            return self.memory_service_mode
+
+    def get_trace_format(self):
+        if self.valid_conf_flag:
+            return self.trace_format
+
+    def get_demand_mode(self):
+        if self.valid_conf_flag:
+            return self.demand_mode
+
+    def get_layer_cache_params(self):
+        if self.valid_conf_flag:
+            return self.layer_cache_dir, self.layer_cache_size_mb
+
+    def get_matrix_dtype(self):
+        if self.valid_conf_flag:
+            return self.matrix_dtype
+
+    def get_simulation_mode(self):
+        if self.valid_conf_flag:
+            return self.simulation_mode
+
+    def get_dedupe_layers(self):
+        if self.valid_conf_flag:
+            return self.dedupe_layers
+
+    def get_profile_mode(self):
+        if self.valid_conf_flag:
+            return self.profile_mode
+
+    def get_reuse_profile(self):
+        if self.valid_conf_flag:
+            return self.reuse_profile
+
+    def get_virtual_operand_matrices(self):
+        if self.valid_conf_flag:
+            return self.virtual_operand_matrices
+
     def get_bandwidths_as_string(self):
         if self.valid_conf_flag:
             return ','.join([str(x) for x in self.bandwidths])
@@ -10,7 +10,10 @@ class scalesim:
                  verbose=True,
                  config='',
                  topology='',
-                 input_type_gemm=False):
+                 input_type_gemm=False,
+                 num_workers=1,
+                 resume=False,
+                 checkpoint=False):
 
         # Data structures
         self.config = scale_config()
@@ -28,6 +31,9 @@ class scalesim:
         self.read_gemm_inputs = input_type_gemm
         self.save_space = save_disk_space
         self.verbose_flag = verbose
+        self.num_workers = num_workers
+        self.resume = resume
+        self.checkpoint = checkpoint
         self.run_done_flag = False
         self.logs_generated_flag = False
 
@@ -81,7 +87,10 @@ class scalesim:
             topo_obj=self.topo,
             top_path=self.top_path,
             verbosity=self.verbose_flag,
-            save_trace=save_trace
+            save_trace=save_trace,
+            num_workers=self.num_workers,
+            resume=self.resume,
+            checkpoint=self.checkpoint
         )
         self.run_once()
 
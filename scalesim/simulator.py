@@ -1,8 +1,13 @@
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 
 from scalesim.scale_config import scale_config as cfg
 from scalesim.topology_utils import topologies as topo
 from scalesim.single_layer_sim import single_layer_sim as layer_sim
+from scalesim.analytical_layer_sim import analytical_layer_sim
+from scalesim.utilities.layer_cache import layer_cache
+from scalesim.utilities.checkpoint import run_checkpoint
 
 
 class simulator:
@@ -13,10 +18,19 @@ class simulator:
         self.top_path = "./"
         self.verbose = True
         self.save_trace = True
+        self.num_workers = 1
+        self.resume = False
+        self.use_checkpoint = False
 
         self.num_layers = 0
 
-        self.single_layer_sim_object_list = []
+        self.layer_report_items = []
+        self.layer_source_ids = []
+        self.layer_profile_items = {}
+        self.layer_reuse_items = {}
+        self.layer_cache = None
+        self.checkpoint = None
+        self.report_files = []
 
         self.params_set_flag = False
         self.all_layer_run_done = False
@@ -27,7 +41,10 @@ class simulator:
                    topo_obj=topo(),
                    top_path="./",
                    verbosity=True,
-                   save_trace=True
+                   save_trace=True,
+                   num_workers=1,
+                   resume=False,
+                   checkpoint=False
                    ):
 
         self.conf = config_obj
@@ -36,6 +53,16 @@ class simulator:
         self.top_path = top_path
         self.verbose = verbosity
         self.save_trace = save_trace
+        self.num_workers = max(1, int(num_workers))
+        self.resume = resume
+        # A resumed run keeps checkpointing, in case it is interrupted again
+        self.use_checkpoint = checkpoint or resume
+
+        if self.save_trace and self.conf.get_simulation_mode() == 'analytical':
+            print('WARNING: No traces are generated in the analytical simulation mode')
+            self.save_trace = False
+        if self.conf.get_reuse_profile() and self.conf.get_simulation_mode() == 'analytical':
+            print('WARNING: No reuse profile is generated in the analytical simulation mode')
 
         # Calculate inferrable parameters here
         self.num_layers = self.topo.get_num_layers()
@@ -46,16 +73,6 @@ class simulator:
     def run(self):
         assert self.params_set_flag, 'Simulator parameters are not set'
 
-        # 1. Create the layer runners for each layer
-        for i in range(self.num_layers):
-            this_layer_sim = layer_sim()
-            this_layer_sim.set_params(layer_id=i,
-                                 config_obj=self.conf,
-                                 topology_obj=self.topo,
-                                 verbose=self.verbose)
-
-            self.single_layer_sim_object_list.append(this_layer_sim)
-
         if not os.path.isdir(self.top_path):
             os.mkdir(self.top_path)
 
@@ -66,50 +83,296 @@ class simulator:
 
         self.top_path = report_path
 
-        # 2. Run each layer
-        # TODO: This is parallelizable
-        for single_layer_obj in self.single_layer_sim_object_list:
+        # The rows of the reports are written as the layers complete
+        self.setup_checkpoint()
+        self.open_reports()
+        try:
+            self.run_layers()
+        finally:
+            self.close_reports()
 
-            if self.verbose:
-                layer_id = single_layer_obj.get_layer_id()
-                print('\nRunning Layer ' + str(layer_id))
+        # A complete run has nothing left to resume
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+
+        self.write_run_profile_reports()
+
+    # Run each layer without writing the reports, the layers are independent of each other
+    def run_layers(self):
+        assert self.params_set_flag, 'Simulator parameters are not set'
+
+        self.setup_layer_cache()
+        self.find_duplicate_layers()
 
-            single_layer_obj.run()
+        self.layer_report_items = []
+        self.layer_profile_items = {}
+        self.layer_reuse_items = {}
+        if self.num_workers > 1:
+            self.run_layers_parallel()
+        else:
+            self.run_layers_serial()
 
+        if self.layer_cache is not None and self.verbose:
+            print('\n' + self.layer_cache.get_stats_as_string())
+        if self.checkpoint is not None and self.verbose:
+            print('\n' + self.checkpoint.get_stats_as_string())
+
+        self.all_layer_run_done = True
+
+    # Each layer runner only lives while its layer is run, so that the peak memory is the one of the largest layer
+    def run_layers_serial(self):
+        # The duplicate layers take the results of the first layer with their parameters
+        for layer_id in range(self.num_layers):
             if self.verbose:
-                comp_items = single_layer_obj.get_compute_report_items()
-                comp_cycles = comp_items[0]
-                stall_cycles = comp_items[1]
-                util = comp_items[2]
-                mapping_eff = comp_items[3]
-                print('Compute cycles: ' + str(comp_cycles))
-                print('Stall cycles: ' + str(stall_cycles))
-                print('Overall utilization: ' + "{:.2f}".format(util) +'%')
-                print('Mapping efficiency: ' + "{:.2f}".format(mapping_eff) +'%')
-
-                avg_bw_items = single_layer_obj.get_bandwidth_report_items()
-                avg_ifmap_bw = avg_bw_items[3]
-                avg_filter_bw = avg_bw_items[4]
-                avg_ofmap_bw = avg_bw_items[5]
-                print('Average IFMAP DRAM BW: ' + "{:.3f}".format(avg_ifmap_bw) + ' words/cycle')
-                print('Average Filter DRAM BW: ' + "{:.3f}".format(avg_filter_bw) + ' words/cycle')
-                print('Average OFMAP DRAM BW: ' + "{:.3f}".format(avg_ofmap_bw) + ' words/cycle')
-
-            if self.save_trace:
+                print('\nRunning Layer ' + str(layer_id))
+
+            source_id = self.layer_source_ids[layer_id]
+            if not source_id == layer_id:
+                report_items = self.layer_report_items[source_id]
+                self.layer_report_items.append(report_items)
+                self.append_report_rows(layer_id, report_items)
                 if self.verbose:
-                    print('Saving traces: ', end='')
-                single_layer_obj.save_traces(self.top_path)
+                    print('Same parameters as layer ' + str(source_id))
+                    self.print_layer_summary(report_items)
+                if self.save_trace:
+                    self.link_layer_traces(source_id, layer_id)
+                continue
+
+            report_items = self.lookup_checkpoint(layer_id)
+            if report_items is not None:
+                self.layer_report_items.append(report_items)
+                self.append_report_rows(layer_id, report_items)
                 if self.verbose:
-                    print('Done!')
+                    print('Completed in a previous run')
+                    self.print_layer_summary(report_items)
+                continue
+
+            report_items = self.lookup_layer_cache(layer_id)
+            if report_items is None:
+                report_items = self.run_layer(layer_id)
+            else:
+                if self.verbose:
+                    print('Found in the layer cache')
+                    self.print_layer_summary(report_items)
+            self.layer_report_items.append(report_items)
+
+            self.store_in_checkpoint(layer_id, report_items)
+            self.append_report_rows(layer_id, report_items)
+
+    # Runs a layer in this process and keeps only its report and profile items
+    def run_layer(self, layer_id):
+        this_layer_sim = get_layer_sim(self.conf)
+        this_layer_sim.set_params(layer_id=layer_id,
+                                  config_obj=self.conf,
+                                  topology_obj=self.topo,
+                                  verbose=self.verbose)
+        if self.save_trace:
+            this_layer_sim.set_trace_path(self.top_path)
+        this_layer_sim.run()
+
+        report_items = this_layer_sim.get_report_items()
+        self.store_in_layer_cache(layer_id, report_items)
+
+        if self.verbose:
+            self.print_layer_summary(report_items)
+
+        if self.save_trace:
+            if self.verbose:
+                print('Saving traces: ', end='')
+            this_layer_sim.save_traces(self.top_path)
+            if self.verbose:
+                print('Done!')
 
-        self.all_layer_run_done = True
+        self.layer_profile_items[layer_id] = this_layer_sim.get_profile_items()
+        self.layer_reuse_items[layer_id] = this_layer_sim.get_reuse_profile_items()
+        if self.conf.get_profile_mode() == 'cprofile':
+            this_layer_sim.dump_cprofile(get_cprofile_filename(self.top_path, layer_id))
 
-        self.generate_reports()
+        this_layer_sim.release_state()
+
+        return report_items
 
     #
+    def run_layers_parallel(self):
+        num_unique_layers = len(set(self.layer_source_ids))
+        if self.verbose:
+            print('\nRunning ' + str(num_unique_layers) + ' unique layers on '
+                  + str(self.num_workers) + ' workers')
+
+        # Only the unique layers missing in the checkpoint and the cache are sent to the workers
+        resumed_report_items = [self.lookup_checkpoint(i) if self.layer_source_ids[i] == i else None
+                                for i in range(self.num_layers)]
+        cached_report_items = [self.lookup_layer_cache(i)
+                               if self.layer_source_ids[i] == i and resumed_report_items[i] is None else None
+                               for i in range(self.num_layers)]
+
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(run_single_layer,
+                                       layer_id=i,
+                                       config_obj=self.conf,
+                                       topology_obj=self.topo,
+                                       top_path=self.top_path,
+                                       save_trace=self.save_trace)
+                       if self.layer_source_ids[i] == i and resumed_report_items[i] is None
+                       and cached_report_items[i] is None else None
+                       for i in range(self.num_layers)]
+
+            # The results are collected in the layer order irrespective of the completion order
+            for layer_id, future in enumerate(futures):
+                source_id = self.layer_source_ids[layer_id]
+                if not source_id == layer_id:
+                    report_items = self.layer_report_items[source_id]
+                    if self.save_trace:
+                        self.link_layer_traces(source_id, layer_id)
+                elif resumed_report_items[layer_id] is not None:
+                    report_items = resumed_report_items[layer_id]
+                elif future is None:
+                    report_items = cached_report_items[layer_id]
+                    self.store_in_checkpoint(layer_id, report_items)
+                else:
+                    # The traces are written by the worker before it returns
+                    report_items, self.layer_profile_items[layer_id], self.layer_reuse_items[layer_id] \
+                        = future.result()
+                    self.store_in_layer_cache(layer_id, report_items)
+                    self.store_in_checkpoint(layer_id, report_items)
+                self.layer_report_items.append(report_items)
+                self.append_report_rows(layer_id, report_items)
+
+                if self.verbose:
+                    print('\nLayer ' + str(layer_id) + ' done')
+                    self.print_layer_summary(report_items)
+
+    # For each layer, the id of the first layer with the same parameters
+    # The layer name is not a parameter, eg. the repeated blocks of a network are all the same
+    def find_duplicate_layers(self):
+        self.layer_source_ids = list(range(self.num_layers))
+        if not self.conf.get_dedupe_layers():
+            return
+
+        first_layer_ids = {}
+        for layer_id in range(self.num_layers):
+            layer_params = tuple(int(x) for x in self.topo.topo_arrays[layer_id][1:])
+            self.layer_source_ids[layer_id] = first_layer_ids.setdefault(layer_params, layer_id)
+
+        num_unique_layers = len(first_layer_ids)
+        if self.verbose and num_unique_layers < self.num_layers:
+            print('Simulating ' + str(num_unique_layers) + ' unique layers out of ' + str(self.num_layers))
+
+    # The traces of a duplicate layer are hard links to those of the layer it duplicates
+    def link_layer_traces(self, source_id, layer_id):
+        source_dir = self.top_path + '/layer' + str(source_id)
+        if not os.path.isdir(source_dir):
+            return
+
+        dir_name = self.top_path + '/layer' + str(layer_id)
+        if not os.path.isdir(dir_name):
+            os.mkdir(dir_name)
+
+        for filename in os.listdir(source_dir):
+            source_file = os.path.join(source_dir, filename)
+            dest_file = os.path.join(dir_name, filename)
+            if os.path.exists(dest_file):
+                os.remove(dest_file)
+            try:
+                os.link(source_file, dest_file)
+            except OSError:
+                # The file system does not support hard links
+                shutil.copyfile(source_file, dest_file)
+
+    #
+    def setup_layer_cache(self):
+        self.layer_cache = None
+
+        cache_dir, cache_size_mb = self.conf.get_layer_cache_params()
+        if cache_dir == '':
+            return
+
+        self.layer_cache = layer_cache()
+        self.layer_cache.set_params(cache_dir=cache_dir, max_size_mb=cache_size_mb)
+
+    # A cached layer is not simulated, hence it cannot be looked up when the traces are needed
+    def lookup_layer_cache(self, layer_id):
+        if self.layer_cache is None or self.save_trace:
+            return None
+
+        key = self.layer_cache.get_key(layer_id, self.conf, self.topo)
+        return self.layer_cache.lookup(key)
+
+    #
+    def store_in_layer_cache(self, layer_id, report_items):
+        if self.layer_cache is None:
+            return
+
+        key = self.layer_cache.get_key(layer_id, self.conf, self.topo)
+        self.layer_cache.store(key, report_items)
+
+    # The checkpoint of the layers lives next to the reports, only a run with reports has one
+    # It is only kept when it is asked for, the default runs do not write anything else than the reports
+    def setup_checkpoint(self):
+        self.checkpoint = None
+        if not self.use_checkpoint:
+            return
+
+        self.checkpoint = run_checkpoint()
+        self.checkpoint.set_params(checkpoint_dir=self.top_path + '/checkpoint', resume=self.resume)
+
+    # The layers of a previous run are only skipped if they have their traces when these are needed
+    def lookup_checkpoint(self, layer_id):
+        if self.checkpoint is None:
+            return None
+
+        return self.checkpoint.lookup(layer_id, self.conf, self.topo, need_traces=self.save_trace)
+
+    #
+    def store_in_checkpoint(self, layer_id, report_items):
+        if self.checkpoint is None:
+            return
+
+        self.checkpoint.store(layer_id, self.conf, self.topo, report_items, traces_done=self.save_trace)
+
+    #
+    @staticmethod
+    def print_layer_summary(report_items):
+        comp_items, avg_bw_items, _ = report_items
+
+        comp_cycles = comp_items[0]
+        stall_cycles = comp_items[1]
+        util = comp_items[2]
+        mapping_eff = comp_items[3]
+        print('Compute cycles: ' + str(comp_cycles))
+        print('Stall cycles: ' + str(stall_cycles))
+        print('Overall utilization: ' + "{:.2f}".format(util) +'%')
+        print('Mapping efficiency: ' + "{:.2f}".format(mapping_eff) +'%')
+
+        avg_ifmap_bw = avg_bw_items[3]
+        avg_filter_bw = avg_bw_items[4]
+        avg_ofmap_bw = avg_bw_items[5]
+        print('Average IFMAP DRAM BW: ' + "{:.3f}".format(avg_ifmap_bw) + ' words/cycle')
+        print('Average Filter DRAM BW: ' + "{:.3f}".format(avg_filter_bw) + ' words/cycle')
+        print('Average OFMAP DRAM BW: ' + "{:.3f}".format(avg_ofmap_bw) + ' words/cycle')
+
+    # Writes all the reports at once after run_layers(), run() writes the same rows as the layers complete
     def generate_reports(self):
         assert self.all_layer_run_done, 'Layer runs are not done yet'
 
+        self.open_reports()
+        try:
+            for lid in range(len(self.layer_report_items)):
+                self.append_report_rows(lid, self.layer_report_items[lid])
+        finally:
+            self.close_reports()
+
+        self.write_run_profile_reports()
+
+    # The optional reports which are only written once all the layers are run
+    def write_run_profile_reports(self):
+        if not self.conf.get_profile_mode() == 'off':
+            self.write_profile_report()
+        if self.conf.get_reuse_profile():
+            self.write_reuse_profile_report()
+
+    # Writes the headers, the rows are appended by append_report_rows()
+    def open_reports(self):
         compute_report_name = self.top_path + '/COMPUTE_REPORT.csv'
         compute_report = open(compute_report_name, 'w')
         header = 'LayerID, Total Cycles, Stall Cycles, Overall Util %, Mapping Efficiency %, Compute Util %,\n'
@@ -132,40 +395,104 @@ class simulator:
         header += 'DRAM OFMAP Start Cycle, DRAM OFMAP Stop Cycle, DRAM OFMAP Writes,\n'
         detail_report.write(header)
 
-        for lid in range(len(self.single_layer_sim_object_list)):
-            single_layer_obj = self.single_layer_sim_object_list[lid]
-            compute_report_items_this_layer = single_layer_obj.get_compute_report_items()
-            log = str(lid) +', '
-            log += ', '.join([str(x) for x in compute_report_items_this_layer])
-            log += ',\n'
-            compute_report.write(log)
+        self.report_files = [compute_report, bandwidth_report, detail_report]
 
-            bandwidth_report_items_this_layer = single_layer_obj.get_bandwidth_report_items()
-            log = str(lid) + ', '
-            log += ', '.join([str(x) for x in bandwidth_report_items_this_layer])
-            log += ',\n'
-            bandwidth_report.write(log)
+    # The rows are flushed so that the reports of a run in progress are usable
+    def append_report_rows(self, layer_id, report_items):
+        if len(self.report_files) == 0:
+            return
 
-            detail_report_items_this_layer = single_layer_obj.get_detail_report_items()
-            log = str(lid) + ', '
-            log += ', '.join([str(x) for x in detail_report_items_this_layer])
+        for report, items in zip(self.report_files, report_items):
+            log = str(layer_id) + ', '
+            log += ', '.join([str(x) for x in items])
             log += ',\n'
-            detail_report.write(log)
+            report.write(log)
+            report.flush()
 
-        compute_report.close()
-        bandwidth_report.close()
-        detail_report.close()
+    #
+    def close_reports(self):
+        for report in self.report_files:
+            report.close()
+        self.report_files = []
+
+    # Time and peak memory of the stages of each simulated layer
+    # The duplicate, cached and resumed layers are not simulated, hence they are not in the report
+    def write_profile_report(self):
+        profile_report_name = self.top_path + '/PROFILE_REPORT.csv'
+        with open(profile_report_name, 'w') as profile_report:
+            header = 'LayerID, Stage, Time (s), Peak Memory (MB),\n'
+            profile_report.write(header)
+
+            for layer_id in sorted(self.layer_profile_items.keys()):
+                for stage, stage_time, peak_memory in self.layer_profile_items[layer_id]:
+                    log = str(layer_id) + ', ' + stage + ', '
+                    log += "{:.6f}".format(stage_time) + ', ' + "{:.1f}".format(peak_memory)
+                    log += ',\n'
+                    profile_report.write(log)
+
+    # DRAM reads of each read operand for all the buffer sizes, one row per step of the curve
+    # A duplicate layer has the curves of the layer it duplicates, the cached and resumed layers have none
+    def write_reuse_profile_report(self):
+        reuse_report_name = self.top_path + '/REUSE_PROFILE.csv'
+        with open(reuse_report_name, 'w') as reuse_report:
+            header = 'LayerID, Operand, Buffer Size (words), DRAM Reads,\n'
+            reuse_report.write(header)
+
+            for layer_id in range(len(self.layer_report_items)):
+                source_id = self.layer_source_ids[layer_id]
+                for operand, capacities, dram_reads in self.layer_reuse_items.get(source_id, []):
+                    for capacity, reads in zip(capacities, dram_reads):
+                        log = str(layer_id) + ', ' + operand + ', ' + str(capacity) + ', ' + str(reads)
+                        log += ',\n'
+                        reuse_report.write(log)
+
+    # The (compute, bandwidth, detail) report items of each layer
+    def get_layer_report_items(self):
+        assert self.all_layer_run_done, 'Layer runs are not done yet'
+        return self.layer_report_items
 
     #
     def get_total_cycles(self):
         assert self.all_layer_run_done, 'Layer runs are not done yet'
 
         total_cycles = 0
-        for layer_obj in self.single_layer_sim_object_list:
-            cycles_this_layer = int(layer_obj.get_compute_report_items[0])
+        for compute_report_items_this_layer, _, _ in self.layer_report_items:
+            cycles_this_layer = int(compute_report_items_this_layer[0])
             total_cycles += cycles_this_layer
 
         return total_cycles
 
 
+# The layer runner for the simulation mode in the config
+def get_layer_sim(config_obj):
+    if config_obj.get_simulation_mode() == 'analytical':
+        return analytical_layer_sim()
+
+    return layer_sim()
+
+
+# The cProfile dump of a layer, next to the reports
+def get_cprofile_filename(top_path, layer_id):
+    return top_path + '/PROFILE_layer' + str(layer_id) + '.prof'
+
+
+# Entry point for the worker processes when the layers are run in parallel
+# Each worker builds its own layer runner and sends back only the report, profile and reuse profile items
+def run_single_layer(layer_id, config_obj, topology_obj, top_path, save_trace):
+    this_layer_sim = get_layer_sim(config_obj)
+    this_layer_sim.set_params(layer_id=layer_id,
+                              config_obj=config_obj,
+                              topology_obj=topology_obj,
+                              verbose=False)
+    if save_trace:
+        this_layer_sim.set_trace_path(top_path)
+    this_layer_sim.run()
+
+    report_items = this_layer_sim.get_report_items()
+    if save_trace:
+        this_layer_sim.save_traces(top_path)
+
+    if config_obj.get_profile_mode() == 'cprofile':
+        this_layer_sim.dump_cprofile(get_cprofile_filename(top_path, layer_id))
 
+    return report_items, this_layer_sim.get_profile_items(), this_layer_sim.get_reuse_profile_items()
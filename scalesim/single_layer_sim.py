@@ -6,7 +6,11 @@ from scalesim.compute.operand_matrix import operand_matrix as opmat
 from scalesim.compute.systolic_compute_os import systolic_compute_os
 from scalesim.compute.systolic_compute_ws import systolic_compute_ws
 from scalesim.compute.systolic_compute_is import systolic_compute_is
+from scalesim.compute.systolic_compute_grouped import systolic_compute_grouped
 from scalesim.memory.double_buffered_scratchpad_mem import double_buffered_scratchpad as mem_dbsp
+from scalesim.memory.stack_distance import stack_distance_analyzer
+from scalesim.utilities.trace_io import save_trace, trace_writer
+from scalesim.utilities.profiler import stage_profiler
 
 
 class single_layer_sim:
@@ -20,6 +24,14 @@ class single_layer_sim:
         self.memory_system = mem_dbsp()
 
         self.verbose = True
+        self.num_groups = 1
+
+        # Time and memory of the stages of the run
+        self.profiler = stage_profiler()
+
+        # Stack distance analyzers of the read operands, and their DRAM reads vs buffer size curves
+        self.reuse_analyzers = {}
+        self.reuse_curves = {}
 
         # Report items : Compute report
         self.total_cycles = 0
@@ -63,8 +75,13 @@ class single_layer_sim:
         self.ofmap_dram_stop_cycle = 0
         self.ofmap_dram_writes = 0
 
+        # Traces written while running, set when the demands are streamed fold by fold
+        self.trace_top_path = ''
+        self.sram_traces_saved = False
+
         self.params_set_flag = False
         self.memory_system_ready_flag = False
+        self.compute_ready_flag = False
         self.runs_ready = False
         self.report_items_ready = False
 
@@ -83,7 +100,10 @@ class single_layer_sim:
                                    )
 
         self.dataflow = self.config.get_dataflow()
-        if self.dataflow == 'os':
+        self.num_groups = self.topo.get_layer_num_groups(self.layer_id)
+        if self.num_groups > 1:
+            self.compute_system = systolic_compute_grouped()
+        elif self.dataflow == 'os':
             self.compute_system = systolic_compute_os()
         elif self.dataflow == 'ws':
             self.compute_system = systolic_compute_ws()
@@ -94,6 +114,15 @@ class single_layer_sim:
         self.num_mac_unit = arr_dims[0] * arr_dims[1]
         self.verbose=verbose
 
+        self.profiler = stage_profiler()
+        if self.config.get_profile_mode() == 'cprofile':
+            self.profiler.enable_cprofile()
+
+        self.reuse_analyzers = {}
+        self.reuse_curves = {}
+        if self.config.get_reuse_profile():
+            self.reuse_analyzers = {'IFMAP': stack_distance_analyzer(), 'FILTER': stack_distance_analyzer()}
+
         self.params_set_flag = True
 
     # This communicates that the memory is being managed externally
@@ -102,32 +131,82 @@ class single_layer_sim:
         self.memory_system = mem_sys_obj
         self.memory_system_ready_flag = True
 
+    # The SRAM traces are never resident when the demands are streamed fold by fold
+    # Setting the path before run() writes them to the disk as they are generated
+    def set_trace_path(self, top_path=''):
+        self.trace_top_path = top_path
+
     def run(self):
         assert self.params_set_flag, 'Parameters are not set. Run set_params()'
 
-        # 1. Setup and the get the demand from compute system
+        self.run_compute()
+        self.run_memory()
 
-        # 1.1 Get the operand matrices
-        _, ifmap_op_mat = self.op_mat_obj.get_ifmap_matrix()
-        _, filter_op_mat = self.op_mat_obj.get_filter_matrix()
-        _, ofmap_op_mat = self.op_mat_obj.get_ofmap_matrix()
+        # 3. The curves are all that is kept of the reuse analysis
+        if len(self.reuse_analyzers) > 0:
+            self.profiler.start('reuse_profile')
+            for operand, analyzer in self.reuse_analyzers.items():
+                self.reuse_curves[operand] = analyzer.get_dram_read_curve()
+            self.reuse_analyzers = {}
+        self.profiler.stop()
+
+        self.runs_ready = True
+
+    # 1. Setup and the get the demand from compute system
+    # The matrices are kept by the compute system, they do not depend on the memory parameters
+    def run_compute(self):
+        assert self.params_set_flag, 'Parameters are not set. Run set_params()'
 
         self.num_compute = self.topo.get_layer_num_ofmap_px(self.layer_id) \
                            * self.topo.get_layer_window_size(self.layer_id)
 
+        # 1.1 Get the operand matrices
         # 1.2 Get the prefetch matrices for both operands
-        self.compute_system.set_params(config_obj=self.config,
-                                       ifmap_op_mat=ifmap_op_mat,
-                                       filter_op_mat=filter_op_mat,
-                                       ofmap_op_mat=ofmap_op_mat)
+        # The grouped compute system gets the operand matrices of each pack of groups itself
+        # The virtual operand matrices only compute the addresses of the blocks sliced by the compute system
+        self.profiler.start('operand_matrices')
+        if self.num_groups > 1:
+            self.compute_system.set_params(config_obj=self.config, op_mat_obj=self.op_mat_obj)
+        elif self.config.get_virtual_operand_matrices():
+            ifmap_op_mat, filter_op_mat, ofmap_op_mat = self.op_mat_obj.get_virtual_matrices()
+
+            self.compute_system.set_params(config_obj=self.config,
+                                           ifmap_op_mat=ifmap_op_mat,
+                                           filter_op_mat=filter_op_mat,
+                                           ofmap_op_mat=ofmap_op_mat)
+        else:
+            _, ifmap_op_mat = self.op_mat_obj.get_ifmap_matrix()
+            _, filter_op_mat = self.op_mat_obj.get_filter_matrix()
+            _, ofmap_op_mat = self.op_mat_obj.get_ofmap_matrix()
+
+            self.compute_system.set_params(config_obj=self.config,
+                                           ifmap_op_mat=ifmap_op_mat,
+                                           filter_op_mat=filter_op_mat,
+                                           ofmap_op_mat=ofmap_op_mat)
 
         # 1.3 Get the no compute demand matrices from for 2 operands and the output
-        ifmap_prefetch_mat, filter_prefetch_mat = self.compute_system.get_prefetch_matrices()
-        ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat = self.compute_system.get_demand_matrices()
+        # The prefetch matrices hold the whole operands, they are only built when the read buffers use them
+        if self.config.use_user_dram_bandwidth():
+            self.profiler.start('prefetch_matrices')
+            self.compute_system.get_prefetch_matrices()
+        if self.config.get_demand_mode() == 'layer':
+            self.profiler.start('demand_matrices')
+            ifmap_demand_mat, filter_demand_mat, _ = self.compute_system.get_demand_matrices()
+
+            if len(self.reuse_analyzers) > 0:
+                self.profiler.start('reuse_profile')
+                self.reuse_analyzers['IFMAP'].add_demand_matrix(ifmap_demand_mat)
+                self.reuse_analyzers['FILTER'].add_demand_matrix(filter_demand_mat)
         #print('DEBUG: Compute operations done')
-        # 2. Setup the memory system and run the demands through it to find any memory bottleneck and generate traces
+
+        self.compute_ready_flag = True
+
+    # 2. Setup the memory system and run the demands through it to find any memory bottleneck and generate traces
+    def run_memory(self):
+        demand_mode = self.config.get_demand_mode()
 
         # 2.1 Setup the memory system if it was not setup externally
+        self.profiler.start('memory_setup')
         if not self.memory_system_ready_flag:
             word_size = 1           # bytes, this can be incorporated in the config file
             active_buf_frac = 0.5   # This can be incorporated in the config as well
@@ -167,28 +246,96 @@ class single_layer_sim:
                     filter_backing_buf_bw=filter_backing_bw,
                     ofmap_backing_buf_bw=ofmap_backing_bw,
                     verbose=self.verbose,
-                    estimate_bandwidth_mode=estimate_bandwidth_mode
+                    estimate_bandwidth_mode=estimate_bandwidth_mode,
+                    service_mode=self.config.get_memory_service_mode()
             )
 
         # 2.2 Install the prefetch matrices to the read buffers to finish setup
         if self.config.use_user_dram_bandwidth() :
+            ifmap_prefetch_mat, filter_prefetch_mat = self.compute_system.get_prefetch_matrices()
             self.memory_system.set_read_buf_prefetch_matrices(ifmap_prefetch_mat=ifmap_prefetch_mat,
                                                               filter_prefetch_mat=filter_prefetch_mat)
 
         # 2.3 Start sending the requests through the memory system until
         # all the OFMAP memory requests have been serviced
-        self.memory_system.service_memory_requests(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat)
+        # In the fold demand mode, this also generates the demand matrices
+        self.profiler.start('memory_service')
+        if demand_mode == 'fold':
+            self.service_demands_by_fold()
+        else:
+            ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat = self.compute_system.get_demand_matrices()
+            self.memory_system.service_memory_requests(ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat)
+        self.profiler.stop()
+
+    # Services the demand matrices of the layer again, with the memory parameters (buffer sizes, bandwidths)
+    # of another config. The compute side is run once by run() or run_compute(), only the memory system is new.
+    def replay_memory(self, config_obj):
+        assert self.compute_ready_flag, 'Compute is not done yet or the state is released'
+        assert self.config.get_demand_mode() == 'layer', 'The demand matrices are not kept in the fold demand mode'
+
+        self.config = config_obj
+        self.memory_system = mem_dbsp()
+        self.memory_system_ready_flag = False
+        self.report_items_ready = False
 
+        self.run_memory()
         self.runs_ready = True
 
-    # This will write the traces
-    def save_traces(self, top_path):
-        assert self.params_set_flag, 'Parameters are not set'
+        return self.get_report_items()
+
+    # The demands are generated and serviced one fold at a time
+    def service_demands_by_fold(self):
+        demand_folds = self.compute_system.get_demand_matrices_by_fold()
+        if len(self.reuse_analyzers) > 0:
+            demand_folds = self.tap_demand_folds(demand_folds)
 
+        self.sram_traces_saved = False
+        if self.trace_top_path == '':
+            self.memory_system.service_memory_requests_by_fold(demand_folds)
+            return
+
+        dir_name = self.get_trace_dir(self.trace_top_path)
+        trace_format = self.config.get_trace_format()
+        sram_trace_writers = []
+        for filename in ['/IFMAP_SRAM_TRACE.csv', '/FILTER_SRAM_TRACE.csv', '/OFMAP_SRAM_TRACE.csv']:
+            writer = trace_writer()
+            writer.open(dir_name + filename, trace_format=trace_format)
+            sram_trace_writers.append(writer)
+
+        self.memory_system.service_memory_requests_by_fold(demand_folds, sram_trace_writers=sram_trace_writers)
+
+        for writer in sram_trace_writers:
+            writer.close()
+        self.sram_traces_saved = True
+
+    # The folds go through the reuse analyzers on their way to the memory system
+    def tap_demand_folds(self, demand_folds):
+        for ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat in demand_folds:
+            self.reuse_analyzers['IFMAP'].add_demand_matrix(ifmap_demand_mat)
+            self.reuse_analyzers['FILTER'].add_demand_matrix(filter_demand_mat)
+            yield ifmap_demand_mat, filter_demand_mat, ofmap_demand_mat
+
+    #
+    def get_trace_dir(self, top_path):
         dir_name = top_path + '/layer' + str(self.layer_id)
         if not os.path.isdir(dir_name):
             os.mkdir(dir_name)
 
+        return dir_name
+
+    # This will write the traces
+    def save_traces(self, top_path):
+        assert self.params_set_flag, 'Parameters are not set'
+        assert self.runs_ready, 'Runs are not done yet or the state is released'
+
+        self.profiler.start('trace_writing')
+        self.write_traces(top_path)
+        self.profiler.stop()
+
+    #
+    def write_traces(self, top_path):
+        dir_name = self.get_trace_dir(top_path)
+
         ifmap_sram_filename = dir_name +  '/IFMAP_SRAM_TRACE.csv'
         filter_sram_filename = dir_name + '/FILTER_SRAM_TRACE.csv'
         ofmap_sram_filename = dir_name +  '/OFMAP_SRAM_TRACE.csv'
@@ -197,17 +344,46 @@ class single_layer_sim:
         filter_dram_filename = dir_name + '/FILTER_DRAM_TRACE.csv'
         ofmap_dram_filename = dir_name +  '/OFMAP_DRAM_TRACE.csv'
 
-        self.memory_system.print_ifmap_sram_trace(ifmap_sram_filename)
-        self.memory_system.print_ifmap_dram_trace(ifmap_dram_filename)
-        self.memory_system.print_filter_sram_trace(filter_sram_filename)
-        self.memory_system.print_filter_dram_trace(filter_dram_filename)
-        self.memory_system.print_ofmap_sram_trace(ofmap_sram_filename)
-        self.memory_system.print_ofmap_dram_trace(ofmap_dram_filename)
+        # The SRAM traces are already on the disk if they were written while running
+        if not self.sram_traces_saved and self.config.get_demand_mode() == 'fold':
+            print('WARNING: SRAM traces are not kept in the fold demand mode, set the trace path before run()')
+        save_sram_traces = self.config.get_demand_mode() == 'layer'
+
+        trace_format = self.config.get_trace_format()
+        if trace_format == 'csv':
+            if save_sram_traces:
+                self.memory_system.print_ifmap_sram_trace(ifmap_sram_filename)
+                self.memory_system.print_filter_sram_trace(filter_sram_filename)
+                self.memory_system.print_ofmap_sram_trace(ofmap_sram_filename)
+            self.memory_system.print_ifmap_dram_trace(ifmap_dram_filename)
+            self.memory_system.print_filter_dram_trace(filter_dram_filename)
+            self.memory_system.print_ofmap_dram_trace(ofmap_dram_filename)
+            return
+
+        # Binary traces, the file extension is set by the format
+        trace_list = []
+        if save_sram_traces:
+            trace_list += [
+                (ifmap_sram_filename, self.memory_system.get_ifmap_sram_trace_matrix()),
+                (filter_sram_filename, self.memory_system.get_filter_sram_trace_matrix()),
+                (ofmap_sram_filename, self.memory_system.get_ofmap_sram_trace_matrix()),
+            ]
+        trace_list += [
+            (ifmap_dram_filename, self.memory_system.get_ifmap_dram_trace_matrix()),
+            (filter_dram_filename, self.memory_system.get_filter_dram_trace_matrix()),
+            (ofmap_dram_filename, self.memory_system.get_ofmap_dram_trace_matrix()),
+        ]
+        for filename, trace_matrix in trace_list:
+            if trace_matrix is None:
+                continue
+            save_trace(filename, trace_matrix, trace_format=trace_format)
 
     #
     def calc_report_data(self):
         assert self.runs_ready, 'Runs are not done yet'
 
+        self.profiler.start('report_calc')
+
         # Compute report
         self.total_cycles = self.memory_system.get_total_compute_cycles()
         self.stall_cycles = self.memory_system.get_stall_cycles()
@@ -242,11 +418,26 @@ class single_layer_sim:
         self.ofmap_dram_start_cycle, self.ofmap_dram_stop_cycle, self.ofmap_dram_writes \
             = self.memory_system.get_ofmap_dram_details()
 
+        # The cycles are reported as floats, whatever the dtype of the traces they are read from
+        self.ifmap_sram_start_cycle, self.ifmap_sram_stop_cycle \
+            = float(self.ifmap_sram_start_cycle), float(self.ifmap_sram_stop_cycle)
+        self.filter_sram_start_cycle, self.filter_sram_stop_cycle \
+            = float(self.filter_sram_start_cycle), float(self.filter_sram_stop_cycle)
+        self.ofmap_sram_start_cycle, self.ofmap_sram_stop_cycle \
+            = float(self.ofmap_sram_start_cycle), float(self.ofmap_sram_stop_cycle)
+        self.ifmap_dram_start_cycle, self.ifmap_dram_stop_cycle \
+            = float(self.ifmap_dram_start_cycle), float(self.ifmap_dram_stop_cycle)
+        self.filter_dram_start_cycle, self.filter_dram_stop_cycle \
+            = float(self.filter_dram_start_cycle), float(self.filter_dram_stop_cycle)
+        self.ofmap_dram_start_cycle, self.ofmap_dram_stop_cycle \
+            = float(self.ofmap_dram_start_cycle), float(self.ofmap_dram_stop_cycle)
+
         # BW calc for DRAM access
         self.avg_ifmap_dram_bw = self.ifmap_dram_reads / (self.ifmap_dram_stop_cycle - self.ifmap_dram_start_cycle + 1)
         self.avg_filter_dram_bw = self.filter_dram_reads / (self.filter_dram_stop_cycle - self.filter_dram_start_cycle + 1)
         self.avg_ofmap_dram_bw = self.ofmap_dram_writes / (self.ofmap_dram_stop_cycle - self.ofmap_dram_start_cycle + 1)
 
+        self.profiler.stop()
         self.report_items_ready = True
 
     #
@@ -285,3 +476,43 @@ class single_layer_sim:
         items += [self.ofmap_dram_start_cycle, self.ofmap_dram_stop_cycle, self.ofmap_dram_writes]
 
         return items
+
+    #
+    def get_report_items(self):
+        compute_items = self.get_compute_report_items()
+        bandwidth_items = self.get_bandwidth_report_items()
+        detail_items = self.get_detail_report_items()
+
+        return compute_items, bandwidth_items, detail_items
+
+    # List of [stage, time in s, peak memory in MB]
+    def get_profile_items(self):
+        return self.profiler.get_profile_items()
+
+    # List of [operand, buffer sizes in words, DRAM reads], see stack_distance_analyzer.get_dram_read_curve()
+    def get_reuse_profile_items(self):
+        assert self.runs_ready, 'Runs are not done yet or the state is released'
+
+        items = []
+        for operand, (capacities, dram_reads) in self.reuse_curves.items():
+            items.append([operand, [int(x) for x in capacities], [int(x) for x in dram_reads]])
+
+        return items
+
+    #
+    def dump_cprofile(self, filename):
+        self.profiler.dump_cprofile(filename)
+
+    # Drops the operand, demand and trace matrices once the report items and the traces are taken
+    # Only the report items remain available afterwards
+    def release_state(self):
+        if self.runs_ready and not self.report_items_ready:
+            self.calc_report_data()
+
+        self.op_mat_obj = opmat()
+        self.compute_system = systolic_compute_os()
+        self.memory_system = mem_dbsp()
+        self.memory_system_ready_flag = False
+        self.reuse_curves = {}
+        self.compute_ready_flag = False
+        self.runs_ready = False
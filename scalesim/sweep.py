@@ -0,0 +1,464 @@
+import argparse
+import copy
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from scalesim.scale_config import scale_config
+from scalesim.topology_utils import topologies
+from scalesim.simulator import simulator
+from scalesim.single_layer_sim import single_layer_sim
+from scalesim.compute.operand_matrix import calc_layer_groups_per_pack
+
+
+compute_item_names = ['Total Cycles', 'Stall Cycles', 'Overall Util %', 'Mapping Efficiency %', 'Compute Util %']
+bandwidth_item_names = ['Avg IFMAP SRAM BW', 'Avg FILTER SRAM BW', 'Avg OFMAP SRAM BW',
+                        'Avg IFMAP DRAM BW', 'Avg FILTER DRAM BW', 'Avg OFMAP DRAM BW']
+detail_item_names = ['SRAM IFMAP Start Cycle', 'SRAM IFMAP Stop Cycle', 'SRAM IFMAP Reads',
+                     'SRAM Filter Start Cycle', 'SRAM Filter Stop Cycle', 'SRAM Filter Reads',
+                     'SRAM OFMAP Start Cycle', 'SRAM OFMAP Stop Cycle', 'SRAM OFMAP Writes',
+                     'DRAM IFMAP Start Cycle', 'DRAM IFMAP Stop Cycle', 'DRAM IFMAP Reads',
+                     'DRAM Filter Start Cycle', 'DRAM Filter Stop Cycle', 'DRAM Filter Reads',
+                     'DRAM OFMAP Start Cycle', 'DRAM OFMAP Stop Cycle', 'DRAM OFMAP Writes']
+
+# The config entries which only change the memory system, the demand matrices do not depend on them
+# but for the packs of the grouped layers, see replay_sweep_layer()
+memory_param_names = ['ifmapsramszkb', 'filtersramszkb', 'ofmapsramszkb',
+                      'bandwidth', 'interfacebandwidth', 'memoryservicemode']
+
+
+# Cartesian product of the values of each parameter, a single value is a list of one
+def expand_grid(grid):
+    names = list(grid.keys())
+    values = [x if isinstance(x, list) else [x] for x in grid.values()]
+
+    return [dict(zip(names, point_values)) for point_values in itertools.product(*values)]
+
+
+# One point per row, the header holds the names of the parameters as in the config file
+def load_sweep_csv(filename):
+    points = []
+    header = []
+    with open(filename, 'r') as f:
+        for row in f:
+            row = row.strip()
+            if row == '':
+                continue
+
+            elems = [x.strip() for x in row.split(',')]
+            if elems[-1] == '':
+                elems = elems[:-1]
+
+            if len(header) == 0:
+                header = elems
+                continue
+
+            assert len(elems) == len(header), 'Sweep point does not match the header: ' + row
+            points.append(dict(zip(header, elems)))
+
+    return points
+
+
+# A 'grid' section is expanded to all the combinations of its values, the 'points' are taken as they are
+def load_sweep_yaml(filename):
+    try:
+        import yaml
+    except ImportError:
+        print('ERROR: sweep.load_sweep_yaml: PyYAML is needed to read the YAML sweeps, use a CSV file instead')
+        raise
+
+    with open(filename, 'r') as f:
+        sweep_desc = yaml.safe_load(f)
+
+    if isinstance(sweep_desc, list):
+        return sweep_desc
+
+    assert isinstance(sweep_desc, dict), 'The YAML sweep should be a list of points or have grid/points sections'
+    points = []
+    if 'grid' in sweep_desc:
+        points += expand_grid(sweep_desc['grid'])
+    if 'points' in sweep_desc:
+        points += sweep_desc['points']
+
+    return points
+
+
+#
+def load_sweep_points(filename):
+    if filename.endswith('.yaml') or filename.endswith('.yml'):
+        return load_sweep_yaml(filename)
+
+    return load_sweep_csv(filename)
+
+
+# Sweep over the parameters of a base config, the points are run in parallel worker processes
+# The report items of each (point, layer) are written to SWEEP_REPORT.csv as soon as the point is done
+# A point which fails is recorded in SWEEP_ERRORS.csv and the other points carry on
+# When the points only change the memory parameters, the demand matrices of each layer are computed once
+# and replayed through the memory system of each point, the layers are then run in parallel instead of the points
+class sweep:
+    def __init__(self):
+        self.config = scale_config()
+        self.topo = topologies()
+
+        self.points = []
+        self.param_names = []
+
+        self.top_path = './'
+        self.num_workers = 1
+        self.verbose = True
+
+        # Point id -> list of the report items of each layer, or the error message
+        self.point_report_items = {}
+        self.point_errors = {}
+
+        self.params_set_flag = False
+        self.sweep_done_flag = False
+
+    #
+    def set_params(self,
+                   config_obj=scale_config(),
+                   topology_obj=topologies(),
+                   points=[],
+                   top_path='./',
+                   num_workers=1,
+                   verbose=True):
+
+        self.config = config_obj
+        self.topo = topology_obj
+        self.points = list(points)
+
+        # The report has a column per parameter, in the order they first appear
+        self.param_names = []
+        for point in self.points:
+            for name in point:
+                if name not in self.param_names:
+                    self.param_names.append(name)
+
+        self.top_path = top_path
+        self.num_workers = max(1, int(num_workers))
+        self.verbose = verbose
+
+        self.params_set_flag = True
+
+    #
+    def run(self):
+        assert self.params_set_flag, 'Sweep parameters are not set'
+
+        if not os.path.isdir(self.top_path):
+            os.makedirs(self.top_path)
+
+        self.point_report_items = {}
+        self.point_errors = {}
+
+        report_name = os.path.join(self.top_path, 'SWEEP_REPORT.csv')
+        with open(report_name, 'w') as report:
+            report.write(self.get_report_header())
+
+            if self.is_memory_sweep():
+                self.run_points_replay(report)
+            elif self.num_workers > 1:
+                self.run_points_parallel(report)
+            else:
+                self.run_points_serial(report)
+
+        self.write_error_report()
+        self.sweep_done_flag = True
+
+        if self.verbose:
+            print('Sweep done: ' + str(len(self.point_report_items)) + ' points, '
+                  + str(len(self.point_errors)) + ' failed')
+
+    # The points run in this process, still isolated from each other
+    def run_points_serial(self, report):
+        init_sweep_worker(self.config, self.topo)
+        for point_id, point in enumerate(self.points):
+            self.collect_point(report, *run_sweep_point(point_id, point))
+
+    # The base config and the topology are sent once to each worker, the tasks only carry the points
+    def run_points_parallel(self, report):
+        with ProcessPoolExecutor(max_workers=self.num_workers,
+                                 initializer=init_sweep_worker,
+                                 initargs=(self.config, self.topo)) as executor:
+            futures = {executor.submit(run_sweep_point, point_id, point): point_id
+                       for point_id, point in enumerate(self.points)}
+
+            for future in as_completed(futures):
+                point_id = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker itself died, eg. out of memory
+                    result = (point_id, None, type(e).__name__ + ': ' + str(e))
+                self.collect_point(report, *result)
+
+    # The demand matrices are only kept in the layer demand mode of the cycle level simulation
+    def is_memory_sweep(self):
+        if len(self.points) < 2:
+            return False
+        if not self.config.get_demand_mode() == 'layer' or not self.config.get_simulation_mode() == 'cycle':
+            return False
+
+        return all(str(name).strip().lower() in memory_param_names for name in self.param_names)
+
+    # Each unique layer is computed once, its report items for all the points are sent back together
+    def run_points_replay(self, report):
+        # The invalid points fail before any layer is run
+        replay_points = {}
+        for point_id, point in enumerate(self.points):
+            try:
+                copy.deepcopy(self.config).update_from_dict(point)
+                replay_points[point_id] = point
+            except Exception as e:
+                self.collect_point(report, point_id, None, type(e).__name__ + ': ' + str(e))
+
+        # All the points failed already
+        if len(replay_points) == 0:
+            return
+
+        layer_source_ids = get_layer_source_ids(self.config, self.topo)
+        unique_layer_ids = sorted(set(layer_source_ids))
+        if self.verbose:
+            print('Replaying ' + str(len(unique_layer_ids)) + ' layers through '
+                  + str(len(replay_points)) + ' memory configs')
+
+        layer_point_results = {layer_id: {} for layer_id in unique_layer_ids}
+        if self.num_workers > 1:
+            # With fewer layers than workers, the points of a layer are split between several tasks,
+            # each of them computes the demand matrices of the layer once
+            num_chunks = max(1, min(len(replay_points), -(-self.num_workers // len(unique_layer_ids))))
+            point_ids = list(replay_points.keys())
+            point_chunks = [{point_id: replay_points[point_id] for point_id in point_ids[i::num_chunks]}
+                            for i in range(num_chunks)]
+
+            with ProcessPoolExecutor(max_workers=self.num_workers,
+                                     initializer=init_sweep_worker,
+                                     initargs=(self.config, self.topo)) as executor:
+                futures = {executor.submit(replay_sweep_layer, layer_id, chunk): (layer_id, chunk)
+                           for layer_id in unique_layer_ids for chunk in point_chunks}
+
+                for future in as_completed(futures):
+                    layer_id, chunk = futures[future]
+                    try:
+                        layer_point_results[layer_id].update(future.result())
+                    except Exception as e:
+                        # The worker itself died, eg. out of memory
+                        error = type(e).__name__ + ': ' + str(e)
+                        layer_point_results[layer_id].update({point_id: (None, error) for point_id in chunk})
+        else:
+            init_sweep_worker(self.config, self.topo)
+            for layer_id in unique_layer_ids:
+                layer_point_results[layer_id] = replay_sweep_layer(layer_id, replay_points)
+
+        # A point fails if any of its layers failed
+        for point_id in replay_points:
+            layer_report_items = []
+            error = ''
+            for source_id in layer_source_ids:
+                report_items, layer_error = layer_point_results[source_id][point_id]
+                if report_items is None:
+                    error = layer_error
+                    break
+                layer_report_items.append(report_items)
+
+            if error == '':
+                self.collect_point(report, point_id, layer_report_items, '')
+            else:
+                self.collect_point(report, point_id, None, error)
+
+    #
+    def collect_point(self, report, point_id, layer_report_items, error):
+        if layer_report_items is None:
+            self.point_errors[point_id] = error
+            if self.verbose:
+                print('WARNING: Sweep point ' + str(point_id) + ' failed: ' + error)
+            return
+
+        self.point_report_items[point_id] = layer_report_items
+        for layer_id, report_items in enumerate(layer_report_items):
+            report.write(self.get_report_row(point_id, layer_id, report_items))
+        report.flush()
+
+        if self.verbose:
+            print('Sweep point ' + str(point_id) + ' done ('
+                  + str(len(self.point_report_items) + len(self.point_errors)) + '/' + str(len(self.points)) + ')')
+
+    #
+    def get_report_header(self):
+        header = ['PointID'] + self.param_names + ['LayerID', 'Layer Name']
+        header += compute_item_names + bandwidth_item_names + detail_item_names
+
+        return ', '.join(header) + ',\n'
+
+    #
+    def get_point_values(self, point_id):
+        point = self.points[point_id]
+        values = []
+        for name in self.param_names:
+            value = point.get(name, '')
+            if isinstance(value, list):
+                value = ' '.join([str(x) for x in value])
+            values.append(str(value))
+
+        return values
+
+    #
+    def get_report_row(self, point_id, layer_id, report_items):
+        compute_items, bandwidth_items, detail_items = report_items
+
+        row = [str(point_id)] + self.get_point_values(point_id)
+        row += [str(layer_id), self.topo.get_layer_name(layer_id)]
+        row += [str(x) for x in list(compute_items) + list(bandwidth_items) + list(detail_items)]
+
+        return ', '.join(row) + ',\n'
+
+    #
+    def write_error_report(self):
+        error_report_name = os.path.join(self.top_path, 'SWEEP_ERRORS.csv')
+        with open(error_report_name, 'w') as error_report:
+            header = ['PointID'] + self.param_names + ['Error']
+            error_report.write(', '.join(header) + ',\n')
+
+            for point_id in sorted(self.point_errors.keys()):
+                error = self.point_errors[point_id].replace(',', ';').replace('\n', ' ')
+                row = [str(point_id)] + self.get_point_values(point_id) + [error]
+                error_report.write(', '.join(row) + ',\n')
+
+    #
+    def get_point_report_items(self, point_id):
+        assert self.sweep_done_flag, 'Sweep is not done yet'
+        return self.point_report_items.get(point_id)
+
+    #
+    def get_failed_points(self):
+        assert self.sweep_done_flag, 'Sweep is not done yet'
+        return self.point_errors
+
+
+# State shared by all the points run in a worker
+sweep_base_config = scale_config()
+sweep_topology = topologies()
+
+
+#
+def init_sweep_worker(config_obj, topology_obj):
+    global sweep_base_config, sweep_topology
+    sweep_base_config = config_obj
+    sweep_topology = topology_obj
+
+
+# Entry point for the worker processes, returns (point id, layer report items, error)
+# Any error of the point is sent back instead of the report items
+def run_sweep_point(point_id, point):
+    try:
+        config_obj = copy.deepcopy(sweep_base_config)
+        config_obj.update_from_dict(point)
+
+        runner = simulator()
+        runner.set_params(config_obj=config_obj,
+                          topo_obj=sweep_topology,
+                          verbosity=False,
+                          save_trace=False)
+        runner.run_layers()
+
+        return point_id, runner.get_layer_report_items(), ''
+    except Exception as e:
+        return point_id, None, type(e).__name__ + ': ' + str(e)
+
+
+# For each layer, the id of the first layer with the same parameters, as in the simulator
+def get_layer_source_ids(config_obj, topology_obj):
+    runner = simulator()
+    runner.set_params(config_obj=config_obj,
+                      topo_obj=topology_obj,
+                      verbosity=False,
+                      save_trace=False)
+    runner.find_duplicate_layers()
+
+    return runner.layer_source_ids
+
+
+# Entry point for the worker processes of a memory sweep, returns {point id: (report items, error)}
+# The compute side of the layer is run once for each pack size of its groups, then each point only runs
+# the memory system. The groups per pack depend on the SRAM sizes and the bandwidth mode, see
+# operand_matrix.calc_groups_per_buffer(), a dense layer is computed once.
+def replay_sweep_layer(layer_id, points):
+    point_results = {}
+
+    # Pack size -> {point id: config}
+    pack_point_configs = {}
+    for point_id, point in points.items():
+        try:
+            config_obj = copy.deepcopy(sweep_base_config)
+            config_obj.update_from_dict(point)
+            groups_per_pack = calc_layer_groups_per_pack(config_obj, sweep_topology, layer_id=layer_id)
+            pack_point_configs.setdefault(groups_per_pack, {})[point_id] = config_obj
+        except Exception as e:
+            point_results[point_id] = (None, type(e).__name__ + ': ' + str(e))
+
+    for point_configs in pack_point_configs.values():
+        try:
+            layer_sim = single_layer_sim()
+            layer_sim.set_params(layer_id=layer_id,
+                                 config_obj=next(iter(point_configs.values())),
+                                 topology_obj=sweep_topology,
+                                 verbose=False)
+            layer_sim.run_compute()
+        except Exception as e:
+            error = type(e).__name__ + ': ' + str(e)
+            point_results.update({point_id: (None, error) for point_id in point_configs})
+            continue
+
+        for point_id, config_obj in point_configs.items():
+            try:
+                point_results[point_id] = (layer_sim.replay_memory(config_obj), '')
+            except Exception as e:
+                point_results[point_id] = (None, type(e).__name__ + ': ' + str(e))
+
+        layer_sim.release_state()
+
+    return point_results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the parameters of a config over a topology')
+    parser.add_argument('-t', metavar='Topology file', type=str,
+                        default="./topologies/conv_nets/test.csv",
+                        help="Path to the topology file"
+                        )
+    parser.add_argument('-c', metavar='Config file', type=str,
+                        default="./configs/scale.cfg",
+                        help="Path to the base config file"
+                        )
+    parser.add_argument('-s', metavar='Sweep file', type=str,
+                        required=True,
+                        help="Path to the YAML or CSV file with the points of the sweep"
+                        )
+    parser.add_argument('-p', metavar='log dir', type=str,
+                        default="./test_runs",
+                        help="Directory for the sweep reports"
+                        )
+    parser.add_argument('-i', metavar='input type', type=str,
+                        default="conv",
+                        help="Type of input topology, gemm: MNK, conv: conv"
+                        )
+    parser.add_argument('-j', metavar='num workers', type=int,
+                        default=1,
+                        help="Number of worker processes to run the points in parallel"
+                        )
+    args = parser.parse_args()
+
+    config = scale_config()
+    config.read_conf_file(args.c)
+
+    topology = topologies()
+    topology.load_arrays(topofile=args.t, mnk_inputs=args.i == 'gemm')
+
+    sweep_points = load_sweep_points(args.s)
+    print('Sweeping ' + str(len(sweep_points)) + ' points over ' + str(topology.get_num_layers()) + ' layers')
+
+    runner = sweep()
+    runner.set_params(config_obj=config, topology_obj=topology, points=sweep_points,
+                      top_path=args.p, num_workers=args.j)
+    runner.run()
+    print('Sweep report: ' + os.path.join(args.p, 'SWEEP_REPORT.csv'))
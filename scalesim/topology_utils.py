@@ -35,12 +35,12 @@ class topologies(object):
         self.num_layers += 1
         self.topo_load_flag = True
 
-    #
-    def load_arrays(self, topofile='', mnk_inputs=False):
+    # With expand_groups, the grouped layers are loaded as one dense layer per group, eg. for the depth first mode
+    def load_arrays(self, topofile='', mnk_inputs=False, expand_groups=False):
         if mnk_inputs:
             self.load_arrays_gemm(topofile)
         else:
-            self.load_arrays_conv(topofile)
+            self.load_arrays_conv(topofile, expand_groups=expand_groups)
 
     #
     def load_arrays_gemm(self, topofile=''):
@@ -79,8 +79,9 @@ class topologies(object):
         self.topo_load_flag = True
 
     # Load the topology data from the file
-    def load_arrays_conv(self, topofile=""):
+    def load_arrays_conv(self, topofile="", expand_groups=False):
         first = True
+        groups_col = -1
         self.topo_file_name = topofile.split('/')[-1]
         name_arr = self.topo_file_name.split('.')
         if len(name_arr) > 1:
@@ -90,19 +91,28 @@ class topologies(object):
         f = open(topofile, 'r')
         for row in f:
             row = row.strip()
-            if first or row == '':
+            if first:
                 first = False
+                # Optional column with the number of groups of the convolution
+                header = [x.strip().lower() for x in row.split(',')]
+                if 'groups' in header:
+                    groups_col = header.index('groups')
+            elif row == '':
+                continue
             else:
                 elems = row.split(',')[:-1]
-                # depth-wise convolution
+                groups = 1
+                if groups_col > 0:
+                    groups = int(elems.pop(groups_col).strip())
+                layer_name = elems[0].strip()
+                # depth-wise convolution, one group per channel with Num Filter filters each
                 if 'DP' in elems[0].strip():
-                    for dp_layer in range(int(elems[5].strip())):
-                        layer_name = elems[0].strip() + "Channel_" + str(dp_layer)
-                        elems[5] = str(1)
-                        self.append_topo_arrays(layer_name, elems)
+                    groups = int(elems[5].strip())
+                    elems[6] = str(groups * int(elems[6].strip()))
+                if expand_groups and groups > 1:
+                    self.append_group_topo_arrays(layer_name, elems, groups)
                 else:
-                    layer_name = elems[0].strip()
-                    self.append_topo_arrays(layer_name, elems)
+                    self.append_topo_arrays(layer_name, elems, groups=groups)
 
         self.num_layers = len(self.topo_arrays)
         self.topo_load_flag = True
@@ -138,12 +148,19 @@ class topologies(object):
                     "Stride width"
                 ]
 
+        write_groups = any(self.get_layer_num_groups(i) > 1 for i in range(len(self.topo_arrays)))
+        if write_groups:
+            header.append("Groups")
+
         f = open(filename, 'w')
         log = ",".join(header)
         log += ",\n"
         f.write(log)
 
-        for param_arr in self.topo_arrays:
+        for layer_id, param_arr in enumerate(self.topo_arrays):
+            param_arr = param_arr[:9]
+            if write_groups:
+                param_arr = param_arr + [self.get_layer_num_groups(layer_id)]
             log = ",".join([str(x) for x in param_arr])
             log += ",\n"
             f.write(log)
@@ -151,7 +168,8 @@ class topologies(object):
         f.close()
 
     # LEGACY
-    def append_topo_arrays(self, layer_name, elems):
+    # The number of groups is stored after the strides, only for the grouped convolutions
+    def append_topo_arrays(self, layer_name, elems, groups=1):
         entry = [layer_name]
 
         for i in range(1, len(elems)):
@@ -164,8 +182,29 @@ class topologies(object):
         assert entry[3] <= entry[1], 'Filter height cannot be larger than IFMAP height'
         assert entry[4] <= entry[2], 'Filter width cannot be larger than IFMAP width'
 
+        if groups > 1:
+            assert entry[5] % groups == 0, 'Channels should be divisible by the number of groups'
+            assert entry[6] % groups == 0, 'Num filter should be divisible by the number of groups'
+            entry.append(groups)
+
         self.topo_arrays.append(entry)
 
+    # One layer per group, with the channels and the filters of a group
+    # The layers of a DP layer are named after its channels, as the groups are its channels
+    def append_group_topo_arrays(self, layer_name, elems, groups):
+        group_elems = list(elems)
+        assert int(elems[5].strip()) % groups == 0, 'Channels should be divisible by the number of groups'
+        assert int(elems[6].strip()) % groups == 0, 'Num filter should be divisible by the number of groups'
+        group_elems[5] = str(int(elems[5].strip()) // groups)
+        group_elems[6] = str(int(elems[6].strip()) // groups)
+
+        suffix = 'Group_'
+        if 'DP' in layer_name:
+            suffix = 'Channel_'
+
+        for group_id in range(groups):
+            self.append_topo_arrays(layer_name + suffix + str(group_id), group_elems)
+
     # create network topology array
     def append_topo_entry_from_list(self, layer_entry_list=[]):
         assert 7 < len(layer_entry_list) < 10, 'Incorrect number of parameters'
@@ -206,10 +245,12 @@ class topologies(object):
             num_filt = array[6]
             stride_h = array[7]
             stride_w = array[8]
+            groups = array[9] if len(array) > 9 else 1
             ofmap_h = int(math.ceil((ifmap_h - filt_h + stride_h) / stride_h))
             ofmap_w = int(math.ceil((ifmap_w - filt_w + stride_w) / stride_w))
-            num_mac = ofmap_h * ofmap_w * filt_h * filt_w * num_ch * num_filt
-            window_size = filt_h * filt_w * num_ch
+            # Each filter of a grouped convolution only sees the channels of its group
+            num_mac = ofmap_h * ofmap_w * filt_h * filt_w * (num_ch // groups) * num_filt
+            window_size = filt_h * filt_w * (num_ch // groups)
             entry = [ofmap_h, ofmap_w, num_mac, window_size]
             self.layers_calculated_hyperparams.append(entry)
         self.topo_calc_hyper_param_flag = True
@@ -317,6 +358,16 @@ class topologies(object):
         return layer_params[7:9]
 
 
+    #
+    def get_layer_num_groups(self, layer_id=0):
+        if not (self.topo_load_flag or self.num_layers - 1 < layer_id):
+            print("ERROR: topologies.get_layer_num_groups: Invalid layer id")
+
+        layer_params = self.topo_arrays[layer_id]
+        if len(layer_params) > 9:
+            return layer_params[9]
+        return 1
+
     def get_layer_window_size(self, layer_id=0):
         if not (self.topo_load_flag or self.num_layers - 1 < layer_id):
             print("ERROR: topologies.get_layer_num_filter: Invalid layer id")
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+
+from scalesim.utilities.layer_cache import layer_cache
+
+
+# Report items of the layers completed in a run, one file per layer next to the reports.
+# A layer is checkpointed once its traces are written, so that a resumed run can skip it.
+# The entries are keyed as the layer cache entries: a change in the layer or the config invalidates them.
+class run_checkpoint:
+    def __init__(self):
+        self.checkpoint_dir = ''
+
+        # Statistics for the run log
+        self.resumed_layers = 0
+
+        self.params_set_flag = False
+
+    #
+    def set_params(self, checkpoint_dir='', resume=False):
+        self.checkpoint_dir = checkpoint_dir
+
+        # A fresh run does not take anything from the previous ones
+        if not resume and os.path.isdir(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir)
+
+        if not os.path.isdir(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+        self.params_set_flag = True
+
+    #
+    def get_entry_filename(self, layer_id):
+        return os.path.join(self.checkpoint_dir, 'layer' + str(layer_id) + '.json')
+
+    # Returns the (compute, bandwidth, detail) report items or None when the layer is to be run again
+    def lookup(self, layer_id, config_obj, topology_obj, need_traces=False):
+        assert self.params_set_flag, 'Checkpoint parameters are not set'
+
+        try:
+            with open(self.get_entry_filename(layer_id), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not entry['key'] == layer_cache.get_key(layer_id, config_obj, topology_obj):
+            return None
+        if need_traces and not entry['traces_done']:
+            return None
+
+        self.resumed_layers += 1
+        return tuple(entry['report_items'])
+
+    #
+    def store(self, layer_id, config_obj, topology_obj, report_items, traces_done=False):
+        assert self.params_set_flag, 'Checkpoint parameters are not set'
+
+        # numpy scalars are stored as the python numbers they print as
+        report_items_list = [[x.item() if hasattr(x, 'item') else x for x in items]
+                             for items in report_items]
+        entry = {'key': layer_cache.get_key(layer_id, config_obj, topology_obj),
+                 'traces_done': traces_done,
+                 'report_items': report_items_list}
+
+        # A run killed while writing leaves a temporary file, never a partial entry
+        fd, tmp_filename = tempfile.mkstemp(dir=self.checkpoint_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_filename, self.get_entry_filename(layer_id))
+
+    # The entries of a complete run are of no use
+    def remove(self):
+        assert self.params_set_flag, 'Checkpoint parameters are not set'
+
+        if os.path.isdir(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir)
+
+    #
+    def get_stats_as_string(self):
+        return 'Checkpoint: ' + str(self.resumed_layers) + ' layers resumed'
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+# Stamp of the simulator results stored in the cache.
+# Bump it whenever a change in the simulator changes the report items of a layer.
+LAYER_CACHE_VERSION = '2.0.2-1'
+
+
+class layer_cache:
+    def __init__(self):
+        self.cache_dir = ''
+        self.max_size_bytes = 256 * 1024 * 1024
+
+        # Statistics for the run log
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.params_set_flag = False
+
+    #
+    def set_params(self, cache_dir='', max_size_mb=256):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.params_set_flag = True
+
+    # The key covers everything which changes the report items of a layer
+    @staticmethod
+    def get_key(layer_id, config_obj, topology_obj):
+        layer_params = topology_obj.topo_arrays[layer_id][1:]  # The layer name does not matter
+
+        key_items = {
+            'version': LAYER_CACHE_VERSION,
+            'layer': [int(x) for x in layer_params],
+            'array_dims': [int(x) for x in config_obj.get_array_dims()],
+            'mem_sizes_kb': [int(x) for x in config_obj.get_mem_sizes()],
+            'dataflow': config_obj.get_dataflow(),
+            'simulation_mode': config_obj.get_simulation_mode(),
+            'user_bandwidth': config_obj.use_user_dram_bandwidth(),
+            'bandwidths': [int(x) for x in config_obj.get_bandwidths_as_list()],
+            'offsets': [int(x) for x in config_obj.get_offsets()],
+        }
+        key_string = json.dumps(key_items, sort_keys=True)
+
+        return hashlib.sha256(key_string.encode()).hexdigest()
+
+    #
+    def get_entry_filename(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    # Returns the (compute, bandwidth, detail) report items or None on a miss
+    def lookup(self, key):
+        assert self.params_set_flag, 'Cache parameters are not set'
+
+        filename = self.get_entry_filename(key)
+        try:
+            with open(filename, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Mark as recently used for the LRU eviction
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return tuple(entry['report_items'])
+
+    #
+    def store(self, key, report_items):
+        assert self.params_set_flag, 'Cache parameters are not set'
+
+        # numpy scalars are stored as the python numbers they print as
+        report_items_list = [[x.item() if hasattr(x, 'item') else x for x in items]
+                             for items in report_items]
+        entry = {'version': LAYER_CACHE_VERSION, 'report_items': report_items_list}
+
+        # Write to a temporary file first so that concurrent runs never see partial entries
+        fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_filename, self.get_entry_filename(key))
+
+        self.evict()
+
+    # Remove the least recently used entries till the cache fits in the size limit
+    def evict(self):
+        entries = []
+        total_size = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            self.evictions += 1
+
+    #
+    def get_stats(self):
+        return self.hits, self.misses, self.evictions
+
+    #
+    def get_stats_as_string(self):
+        return 'Layer cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses, ' \
+               + str(self.evictions) + ' evictions'
@@ -0,0 +1,124 @@
+import cProfile
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory is then reported as 0
+    resource = None
+
+
+# Largest of the peaks sampled before each reset, the kernel only keeps the one since the last reset
+peak_memory_before_resets_mb = 0.0
+
+
+# Peak resident memory of the process so far, in MB
+def get_peak_memory_mb():
+    if resource is None:
+        return 0.0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    if sys.platform == 'darwin':
+        peak_mb = peak / (1024 * 1024)
+    else:
+        peak_mb = peak / 1024
+    return max(peak_mb, peak_memory_before_resets_mb)
+
+
+# Peak resident memory since the last reset_peak_memory(), in MB, None where /proc is not available
+def read_reset_peak_memory_mb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for row in f:
+                if row.startswith('VmHWM:'):
+                    return int(row.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# Restarts the peak resident memory from the current one, only on Linux
+# Returns False when the peak cannot be reset
+def reset_peak_memory():
+    global peak_memory_before_resets_mb
+
+    peak_mb = read_reset_peak_memory_mb()
+    if peak_mb is None:
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+
+    peak_memory_before_resets_mb = max(peak_memory_before_resets_mb, peak_mb)
+    return True
+
+
+# Wall time and peak memory of the stages of a layer run
+# The peak memory of a stage is the peak resident memory of the process while the stage runs, the peak is reset
+# when the stage starts. This is only available on Linux, the memory is reported as 0 elsewhere.
+# The time of a stage run several times is accumulated, and its peak memory is the largest of the runs
+# When the cProfile dump is enabled, the profiler only runs within the stages
+class stage_profiler:
+    def __init__(self):
+        self.stage_names = []
+        self.stage_times = {}
+        self.stage_peak_memory = {}
+
+        self.current_stage = ''
+        self.stage_start_time = 0
+        self.stage_peak_reset = False
+
+        self.cprofile = None
+
+    #
+    def enable_cprofile(self):
+        if self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+
+    # Starting a stage stops the current one
+    def start(self, stage):
+        if not self.current_stage == '':
+            self.stop()
+
+        if stage not in self.stage_times:
+            self.stage_names.append(stage)
+            self.stage_times[stage] = 0.0
+            self.stage_peak_memory[stage] = 0.0
+
+        self.current_stage = stage
+        self.stage_peak_reset = reset_peak_memory()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        self.stage_start_time = time.perf_counter()
+
+    #
+    def stop(self):
+        if self.current_stage == '':
+            return
+
+        stage_time = time.perf_counter() - self.stage_start_time
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+        stage = self.current_stage
+        self.stage_times[stage] += stage_time
+        if self.stage_peak_reset:
+            stage_peak_memory = read_reset_peak_memory_mb()
+            self.stage_peak_memory[stage] = max(self.stage_peak_memory[stage], stage_peak_memory)
+        self.current_stage = ''
+
+    # List of [stage, time in s, peak memory in MB], in the order the stages were first run
+    def get_profile_items(self):
+        return [[stage, self.stage_times[stage], self.stage_peak_memory[stage]] for stage in self.stage_names]
+
+    #
+    def dump_cprofile(self, filename):
+        if self.cprofile is None:
+            print('WARNING: cProfile was not enabled for this run')
+            return
+
+        self.cprofile.dump_stats(filename)
@@ -0,0 +1,275 @@
+import argparse
+import os
+import zipfile
+
+import numpy as np
+
+
+# Version of the binary trace layout, bump when the stored fields change
+TRACE_FORMAT_VERSION = 1
+
+valid_trace_format_list = ['csv', 'npz', 'npy']
+
+# The SRAM traces are printed as integers, the DRAM traces with one decimal as in the older releases
+sram_csv_fmt = '%i'
+dram_csv_fmt = '%.1f'
+
+# Size of the npy header written by trace_writer, large enough for any 2D shape
+npy_header_len = 128
+
+# Size of the chunks in which a streamed trace is converted to int64
+widen_chunk_bytes = 1 << 24
+
+
+#
+def get_trace_filename(filename, trace_format='csv'):
+    base_name, _ = os.path.splitext(filename)
+    return base_name + '.' + trace_format
+
+
+#
+def get_csv_fmt(filename):
+    if 'DRAM' in os.path.basename(filename):
+        return dram_csv_fmt
+    return sram_csv_fmt
+
+
+#
+def get_trace_dtype(trace_matrix):
+    # The cycles and addresses are whole numbers, int32 is enough unless the offsets are very large
+    int32_info = np.iinfo(np.int32)
+    if trace_matrix.size == 0:
+        return np.int32
+
+    if trace_matrix.min() < int32_info.min or trace_matrix.max() > int32_info.max:
+        print('WARNING: Trace values do not fit in int32, storing as int64')
+        return np.int64
+
+    return np.int32
+
+
+# Prefix the requests with the cycles column, in the integer dtype of the requests when the cycles fit in it
+def make_trace_matrix(cycles_arr, requests_arr):
+    trace_dtype = requests_arr.dtype
+    if not np.issubdtype(trace_dtype, np.integer):
+        return np.concatenate((cycles_arr, requests_arr), axis=1)
+
+    if cycles_arr.size > 0 and cycles_arr.max() > np.iinfo(trace_dtype).max:
+        trace_dtype = np.dtype(np.int64)
+
+    trace_matrix = np.empty((requests_arr.shape[0], requests_arr.shape[1] + 1), dtype=trace_dtype)
+    trace_matrix[:, :1] = cycles_arr
+    trace_matrix[:, 1:] = requests_arr
+
+    return trace_matrix
+
+
+# Write the trace in the requested format
+# filename is the name of the CSV trace, the extension is replaced for the binary formats
+def save_trace(filename, trace_matrix, trace_format='csv', csv_fmt=''):
+    assert trace_format in valid_trace_format_list, 'Invalid trace format'
+
+    if csv_fmt == '':
+        csv_fmt = get_csv_fmt(filename)
+
+    out_filename = get_trace_filename(filename, trace_format)
+    if trace_format == 'csv':
+        np.savetxt(out_filename, trace_matrix, fmt=csv_fmt, delimiter=",")
+        return out_filename
+
+    trace_dtype = get_trace_dtype(trace_matrix)
+    trace_matrix_int = trace_matrix.astype(trace_dtype)
+
+    if trace_format == 'npz':
+        # The header is stored along with the trace so that the CSV can be reproduced exactly
+        np.savez_compressed(out_filename, trace=trace_matrix_int,
+                            version=np.asarray(TRACE_FORMAT_VERSION),
+                            csv_fmt=np.asarray(csv_fmt),
+                            src_dtype=np.asarray(str(trace_matrix.dtype)))
+    else:
+        # Raw dump, the header of the npy file holds the shape and dtype
+        np.save(out_filename, trace_matrix_int)
+
+    return out_filename
+
+
+# Writes a trace one block of rows at a time, for traces which are never resident as a whole
+# The npy header is rewritten with the final shape on close, the npz archive is assembled from the npy stream
+# The values are stored as int32, as in save_trace, until a block does not fit: the trace is then int64 as a whole
+class trace_writer:
+    def __init__(self):
+        self.filename = ''
+        self.trace_format = 'csv'
+        self.csv_fmt = sram_csv_fmt
+        self.file_handle = None
+        self.npy_filename = ''
+        self.num_rows = 0
+        self.num_cols = 0
+        self.src_dtype = ''
+        self.store_dtype = np.dtype(np.int32)
+        self.open_flag = False
+
+    #
+    def open(self, filename, trace_format='csv', csv_fmt=''):
+        assert trace_format in valid_trace_format_list, 'Invalid trace format'
+
+        self.trace_format = trace_format
+        self.csv_fmt = csv_fmt if not csv_fmt == '' else get_csv_fmt(filename)
+        self.filename = get_trace_filename(filename, trace_format)
+        self.num_rows = 0
+        self.num_cols = 0
+        self.src_dtype = ''
+        self.store_dtype = np.dtype(np.int32)
+
+        if self.trace_format == 'csv':
+            self.file_handle = open(self.filename, 'w')
+        else:
+            self.npy_filename = self.filename
+            if self.trace_format == 'npz':
+                self.npy_filename = self.filename + '.trace.tmp'
+            self.file_handle = open(self.npy_filename, 'wb')
+            self.write_npy_header()
+
+        self.open_flag = True
+
+    # The header is padded to a fixed size so that it can be rewritten in place
+    def write_npy_header(self):
+        header = {'descr': self.store_dtype.str, 'fortran_order': False,
+                  'shape': (self.num_rows, self.num_cols)}
+        header_str = repr(header).ljust(npy_header_len - 11) + '\n'
+
+        self.file_handle.write(b'\x93NUMPY\x01\x00')
+        self.file_handle.write(np.uint16(len(header_str)).tobytes())
+        self.file_handle.write(header_str.encode('latin1'))
+
+    #
+    def write(self, trace_block):
+        assert self.open_flag, 'Trace file is not open'
+
+        # The source dtype is the one of all the blocks together, as if they had been concatenated
+        if self.src_dtype == '':
+            self.src_dtype = str(trace_block.dtype)
+            self.num_cols = trace_block.shape[1]
+        else:
+            self.src_dtype = str(np.result_type(np.dtype(self.src_dtype), trace_block.dtype))
+        assert trace_block.shape[1] == self.num_cols, 'Trace blocks do not have the same width'
+
+        if self.trace_format == 'csv':
+            np.savetxt(self.file_handle, trace_block, fmt=self.csv_fmt, delimiter=",")
+        else:
+            if self.store_dtype == np.int32 and get_trace_dtype(trace_block) == np.int64:
+                self.widen_to_int64()
+            self.file_handle.write(np.ascontiguousarray(trace_block, dtype=self.store_dtype).tobytes())
+
+        self.num_rows += trace_block.shape[0]
+
+    # The rows written so far are converted in chunks, the header is rewritten on close
+    def widen_to_int64(self):
+        self.file_handle.close()
+
+        widened_filename = self.npy_filename + '.int64.tmp'
+        with open(self.npy_filename, 'rb') as src, open(widened_filename, 'wb') as dst:
+            dst.write(src.read(npy_header_len))
+            while True:
+                chunk = src.read(widen_chunk_bytes)
+                if len(chunk) == 0:
+                    break
+                dst.write(np.frombuffer(chunk, dtype=self.store_dtype).astype(np.int64).tobytes())
+        os.replace(widened_filename, self.npy_filename)
+
+        self.store_dtype = np.dtype(np.int64)
+        self.file_handle = open(self.npy_filename, 'r+b')
+        self.file_handle.seek(0, os.SEEK_END)
+
+    #
+    def close(self):
+        if not self.open_flag:
+            return
+
+        if not self.trace_format == 'csv':
+            self.file_handle.seek(0)
+            self.write_npy_header()
+        self.file_handle.close()
+        self.open_flag = False
+
+        if self.trace_format == 'npz':
+            # Same layout as save_trace, the trace itself is copied into the archive in chunks
+            with zipfile.ZipFile(self.filename, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                archive.write(self.npy_filename, arcname='trace.npy')
+                for name, value in [('version', TRACE_FORMAT_VERSION),
+                                    ('csv_fmt', self.csv_fmt),
+                                    ('src_dtype', self.src_dtype if not self.src_dtype == '' else 'float64')]:
+                    with archive.open(name + '.npy', 'w') as f:
+                        np.lib.format.write_array(f, np.asarray(value))
+            os.remove(self.npy_filename)
+
+
+# Read a trace written by save_trace
+# Returns the trace matrix in the dtype it had in the simulator and the format for printing it as CSV
+def load_trace(filename):
+    _, ext = os.path.splitext(filename)
+
+    if ext == '.npz':
+        with np.load(filename) as trace_file:
+            version = int(trace_file['version'])
+            if version > TRACE_FORMAT_VERSION:
+                print('WARNING: Trace ' + filename + ' was written by a newer version')
+            csv_fmt = str(trace_file['csv_fmt'])
+            trace_matrix = trace_file['trace'].astype(str(trace_file['src_dtype']))
+
+    elif ext == '.npy':
+        csv_fmt = get_csv_fmt(filename)
+        trace_matrix = np.load(filename)
+
+    elif ext == '.csv':
+        csv_fmt = get_csv_fmt(filename)
+        trace_matrix = np.loadtxt(filename, delimiter=",", ndmin=2)
+
+    else:
+        print('ERROR: trace_io.load_trace: Unknown trace format ' + ext)
+        return None, ''
+
+    return trace_matrix, csv_fmt
+
+
+# Convert a binary trace back to the CSV layout generated by the simulator
+def convert_trace_to_csv(filename, csv_filename=''):
+    trace_matrix, csv_fmt = load_trace(filename)
+    if trace_matrix is None:
+        return ''
+
+    if csv_filename == '':
+        csv_filename = get_trace_filename(filename, 'csv')
+
+    np.savetxt(csv_filename, trace_matrix, fmt=csv_fmt, delimiter=",")
+
+    return csv_filename
+
+
+# Convert all the binary traces found under a run or layer directory
+def convert_traces_to_csv(dir_name):
+    csv_filenames = []
+    for root, _, files in os.walk(dir_name):
+        for file in sorted(files):
+            if file.endswith('_TRACE.npz') or file.endswith('_TRACE.npy'):
+                csv_filenames += [convert_trace_to_csv(os.path.join(root, file))]
+
+    return csv_filenames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert binary SCALE-Sim traces to CSV')
+    parser.add_argument('paths', metavar='path', type=str, nargs='+',
+                        help="Trace files or directories with traces"
+                        )
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if os.path.isdir(path):
+            converted = convert_traces_to_csv(path)
+        else:
+            converted = [convert_trace_to_csv(path)]
+
+        for csv_filename in converted:
+            if not csv_filename == '':
+                print(csv_filename)
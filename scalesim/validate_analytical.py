@@ -0,0 +1,126 @@
+import argparse
+import os
+import time
+
+from scalesim.scale_config import scale_config
+from scalesim.topology_utils import topologies
+from scalesim.single_layer_sim import single_layer_sim
+from scalesim.analytical_layer_sim import analytical_layer_sim
+
+
+compute_item_names = ['Total Cycles', 'Stall Cycles', 'Overall Util %', 'Mapping Efficiency %', 'Compute Util %']
+bandwidth_item_names = ['Avg IFMAP SRAM BW', 'Avg FILTER SRAM BW', 'Avg OFMAP SRAM BW',
+                        'Avg IFMAP DRAM BW', 'Avg FILTER DRAM BW', 'Avg OFMAP DRAM BW']
+
+
+# Deviation of the analytical value in percent of the simulated one
+def calc_deviation(analytical_value, simulated_value):
+    if simulated_value == 0:
+        return 0.0 if analytical_value == 0 else float('inf')
+
+    return (analytical_value - simulated_value) * 100 / simulated_value
+
+
+# Run every layer with both the cycle level simulation and the analytical model
+# Returns a list of (layer id, simulated items, analytical items, simulation time, analytical time)
+def validate_layers(config_obj, topology_obj, verbose=True):
+    results = []
+    for layer_id in range(topology_obj.get_num_layers()):
+        start_time = time.time()
+        this_layer_sim = single_layer_sim()
+        this_layer_sim.set_params(layer_id=layer_id, config_obj=config_obj,
+                                  topology_obj=topology_obj, verbose=False)
+        this_layer_sim.run()
+        comp_items, bw_items, _ = this_layer_sim.get_report_items()
+        simulated_items = list(comp_items) + list(bw_items)
+        sim_time = time.time() - start_time
+
+        start_time = time.time()
+        this_layer_model = analytical_layer_sim()
+        this_layer_model.set_params(layer_id=layer_id, config_obj=config_obj,
+                                    topology_obj=topology_obj, verbose=False)
+        this_layer_model.run()
+        comp_items, bw_items, _ = this_layer_model.get_report_items()
+        analytical_items = list(comp_items) + list(bw_items)
+        model_time = time.time() - start_time
+
+        results.append((layer_id, simulated_items, analytical_items, sim_time, model_time))
+
+        if verbose:
+            max_dev = max(abs(calc_deviation(a, s)) for a, s in zip(analytical_items[:5], simulated_items[:5]))
+            print('Layer ' + str(layer_id) + ': max compute deviation ' + "{:.3f}".format(max_dev) + '%, '
+                  + "{:.3f}".format(sim_time) + 's simulated vs ' + "{:.6f}".format(model_time) + 's analytical')
+
+    return results
+
+
+#
+def write_validation_report(results, filename):
+    item_names = compute_item_names + bandwidth_item_names
+
+    with open(filename, 'w') as report:
+        header = 'LayerID, ' + ', '.join([name + ' Deviation %' for name in item_names])
+        header += ', Simulation Time (s), Analytical Time (s),\n'
+        report.write(header)
+
+        for layer_id, simulated_items, analytical_items, sim_time, model_time in results:
+            deviations = [calc_deviation(a, s) for a, s in zip(analytical_items, simulated_items)]
+            log = str(layer_id) + ', '
+            log += ', '.join([str(x) for x in deviations])
+            log += ', ' + str(sim_time) + ', ' + str(model_time) + ',\n'
+            report.write(log)
+
+
+#
+def print_summary(results):
+    item_names = compute_item_names + bandwidth_item_names
+
+    print('Max absolute deviation of the analytical model over ' + str(len(results)) + ' layers:')
+    for idx, name in enumerate(item_names):
+        max_dev = max(abs(calc_deviation(analytical_items[idx], simulated_items[idx]))
+                      for _, simulated_items, analytical_items, _, _ in results)
+        print('  ' + name + ': ' + "{:.3f}".format(max_dev) + '%')
+
+    sim_time = sum(x[3] for x in results)
+    model_time = sum(x[4] for x in results)
+    print('Total time: ' + "{:.3f}".format(sim_time) + 's simulated, '
+          + "{:.6f}".format(model_time) + 's analytical')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the analytical model against the cycle level simulation')
+    parser.add_argument('-t', metavar='Topology file', type=str,
+                        default="./topologies/conv_nets/test.csv",
+                        help="Path to the topology file"
+                        )
+    parser.add_argument('-c', metavar='Config file', type=str,
+                        default="./configs/scale.cfg",
+                        help="Path to the config file"
+                        )
+    parser.add_argument('-p', metavar='log dir', type=str,
+                        default="",
+                        help="Directory for the validation report, not written when empty"
+                        )
+    parser.add_argument('-i', metavar='input type', type=str,
+                        default="conv",
+                        help="Type of input topology, gemm: MNK, conv: conv"
+                        )
+    args = parser.parse_args()
+
+    config = scale_config()
+    config.read_conf_file(args.c)
+    if config.use_user_dram_bandwidth():
+        print('WARNING: The analytical model does not account for the stalls in the USER bandwidth mode')
+
+    topology = topologies()
+    topology.load_arrays(topofile=args.t, mnk_inputs=args.i == 'gemm')
+
+    validation_results = validate_layers(config, topology)
+    print_summary(validation_results)
+
+    if not args.p == '':
+        if not os.path.isdir(args.p):
+            os.makedirs(args.p)
+        report_name = os.path.join(args.p, 'ANALYTICAL_VALIDATION_REPORT.csv')
+        write_validation_report(validation_results, report_name)
+        print('Validation report: ' + report_name)
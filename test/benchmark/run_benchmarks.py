@@ -0,0 +1,422 @@
+import argparse
+import configparser
+import copy
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# The script runs from anywhere, the paths of the cases are relative to the repo
+repo_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if repo_path not in sys.path:
+    sys.path.insert(0, repo_path)
+
+from scalesim.scale_sim import scalesim
+from scalesim.scale_config import scale_config
+from scalesim.topology_utils import topologies
+from scalesim.single_layer_sim import single_layer_sim
+from scalesim.sweep import init_sweep_worker, replay_sweep_layer
+from scalesim.dephtfirst.depth_first import depth_first_sim
+from scalesim.dephtfirst.utils import df_mode
+from scalesim.utilities.profiler import get_peak_memory_mb
+
+
+base_config_file = 'configs/scale.cfg'
+report_names = ['COMPUTE_REPORT.csv', 'BANDWIDTH_REPORT.csv', 'DETAILED_ACCESS_REPORT.csv']
+result_marker = 'BENCHMARK_RESULT '
+
+
+# Fixed matrix of the benchmark cases, the names are the keys of the baseline
+def get_benchmark_cases():
+    cases = []
+
+    layer_topologies = [('conv', 'topologies/conv_nets/test.csv', False),
+                        ('gemm', 'topologies/GEMM_mnk/test_mnk_input.csv', True),
+                        ('depthwise', 'topologies/conv_nets/test_dw.csv', False)]
+    for prefix, topology, gemm in layer_topologies:
+        for dataflow in ['os', 'ws', 'is']:
+            for bw_mode in ['CALC', 'USER']:
+                cases.append({'name': prefix + '_' + dataflow + '_' + bw_mode.lower(),
+                              'topology': topology,
+                              'gemm': gemm,
+                              'dataflow': dataflow,
+                              'bw_mode': bw_mode,
+                              'df_mode': ''})
+
+    for mode in ['FULL_RECOMPUTE', 'FULL_CACHED']:
+        cases.append({'name': 'depth_first_' + mode.lower(),
+                      'topology': 'topologies/conv_nets/test.csv',
+                      'gemm': False,
+                      'dataflow': 'os',
+                      'bw_mode': 'CALC',
+                      'df_mode': mode,
+                      'tile_size': [4, 4]})
+
+    return cases
+
+
+# Config of the case, derived from the base config
+def write_case_config(case, conf_file_out):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(repo_path, base_config_file))
+
+    config.set('general', 'run_name', case['name'])
+    config.set('architecture_presets', 'Dataflow', case['dataflow'])
+    if not config.has_section('run_presets'):
+        config.add_section('run_presets')
+    config.set('run_presets', 'InterfaceBandwidth', case['bw_mode'])
+    config.set('run_presets', 'Profile', 'stages')
+
+    with open(conf_file_out, 'w') as f:
+        config.write(f)
+
+
+# sha256 of each report, the reports are deterministic for a given case
+def get_report_checksums(report_path):
+    checksums = {}
+    for name in report_names:
+        with open(os.path.join(report_path, name), 'rb') as f:
+            checksums[name] = hashlib.sha256(f.read()).hexdigest()
+
+    return checksums
+
+
+# Time of each stage of the profile report, summed over the layers (or stacks)
+def get_stage_times(report_path):
+    stage_times = {}
+    profile_report_name = os.path.join(report_path, 'PROFILE_REPORT.csv')
+    if not os.path.exists(profile_report_name):
+        return stage_times
+
+    with open(profile_report_name, 'r') as f:
+        f.readline()
+        for row in f:
+            elems = [x.strip() for x in row.split(',')]
+            if len(elems) < 3:
+                continue
+            stage_times[elems[1]] = stage_times.get(elems[1], 0.0) + float(elems[2])
+
+    return {stage: round(x, 6) for stage, x in stage_times.items()}
+
+
+# Runs a single case in this process, the wall time does not include the imports
+def run_case(case, top_path):
+    case_path = os.path.join(top_path, case['name'])
+    if not os.path.isdir(case_path):
+        os.makedirs(case_path)
+
+    conf_file = os.path.join(case_path, 'benchmark.cfg')
+    write_case_config(case, conf_file)
+    topology = os.path.join(repo_path, case['topology'])
+
+    start_time = time.perf_counter()
+    if case['df_mode'] == '':
+        runner = scalesim(save_disk_space=True, verbose=False,
+                          config=conf_file, topology=topology,
+                          input_type_gemm=case['gemm'])
+        runner.run_scale(top_path=top_path)
+    else:
+        runner = depth_first_sim()
+        runner.set_params(conf_file=conf_file, topology_file=topology,
+                          read_gemm_inputs=case['gemm'],
+                          df_mode=df_mode[case['df_mode']],
+                          tile_size=tuple(case['tile_size']),
+                          verbose=False)
+        runner.run()
+        runner.save_reports(case_path)
+    wall_time = time.perf_counter() - start_time
+
+    return {'time_s': round(wall_time, 4),
+            'peak_memory_mb': round(get_peak_memory_mb(), 1),
+            'checksums': get_report_checksums(case_path),
+            'stages': get_stage_times(case_path)}
+
+
+# Each run of a case is a fresh process, so that the peak memory is the one of the case alone
+def run_case_subprocess(case, top_path):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = repo_path + os.pathsep + env.get('PYTHONPATH', '')
+
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-case', case['name'], '-p', top_path]
+    proc = subprocess.run(cmd, cwd=repo_path, env=env, capture_output=True, text=True)
+
+    for row in proc.stdout.splitlines():
+        if row.startswith(result_marker):
+            return json.loads(row[len(result_marker):])
+
+    print('ERROR: run_benchmarks: Case ' + case['name'] + ' failed')
+    print(proc.stdout[-2000:] + proc.stderr[-2000:])
+    return None
+
+
+# Best wall time of the repeats, the checksums should not change between them
+def run_benchmarks(cases, top_path, repeat=1, verbose=True):
+    results = {}
+    for case in cases:
+        case_result = None
+        for _ in range(repeat):
+            run_result = run_case_subprocess(case, top_path)
+            if run_result is None:
+                case_result = None
+                break
+
+            if case_result is None:
+                case_result = run_result
+                continue
+
+            if not run_result['checksums'] == case_result['checksums']:
+                print('WARNING: run_benchmarks: The reports of ' + case['name'] + ' changed between the repeats')
+            if run_result['time_s'] < case_result['time_s']:
+                case_result['time_s'] = run_result['time_s']
+                case_result['stages'] = run_result['stages']
+            case_result['peak_memory_mb'] = max(case_result['peak_memory_mb'], run_result['peak_memory_mb'])
+
+        if case_result is None:
+            continue
+
+        results[case['name']] = case_result
+        if verbose:
+            print(case['name'].ljust(28) + "{:9.3f} s".format(case_result['time_s'])
+                  + "{:10.1f} MB".format(case_result['peak_memory_mb']))
+
+    return results
+
+
+# Total cycles and DRAM accesses (IFMAP reads, FILTER reads, OFMAP writes) summed over the layers
+def get_summed_report_items(config, topology):
+    summed_items = [0, 0, 0, 0]
+    for layer_id in range(topology.get_num_layers()):
+        layer_sim = single_layer_sim()
+        layer_sim.set_params(layer_id=layer_id, config_obj=config, topology_obj=topology, verbose=False)
+        layer_sim.run()
+        compute_items, _, detail_items = layer_sim.get_report_items()
+
+        layer_items = [compute_items[0], detail_items[11], detail_items[14], detail_items[17]]
+        summed_items = [x + int(y) for x, y in zip(summed_items, layer_items)]
+
+    return summed_items
+
+
+# The memory sweeps replay the demand matrices of a layer through the memory system of each point,
+# the packs of a grouped layer depend on the SRAM sizes and the bandwidth mode of the point
+# Returns the points whose replayed report items differ from a direct run
+def check_grouped_replay(config, topology):
+    points = {}
+    for sram_sz_kb in [1, 4, 64]:
+        for bw_mode in ['CALC', 'USER']:
+            points[len(points)] = {'IfmapSramSzkB': sram_sz_kb, 'FilterSramSzkB': sram_sz_kb,
+                                   'InterfaceBandwidth': bw_mode, 'Bandwidth': 10}
+
+    init_sweep_worker(config, topology)
+    mismatched_points = []
+    for layer_id in range(topology.get_num_layers()):
+        if topology.get_layer_num_groups(layer_id) == 1:
+            continue
+
+        point_results = replay_sweep_layer(layer_id, points)
+        for point_id, point in points.items():
+            point_config = copy.deepcopy(config)
+            point_config.update_from_dict(point)
+            layer_sim = single_layer_sim()
+            layer_sim.set_params(layer_id=layer_id, config_obj=point_config, topology_obj=topology, verbose=False)
+            layer_sim.run()
+
+            replay_items, _ = point_results[point_id]
+            direct_items = layer_sim.get_report_items()
+            if replay_items is None or \
+                    not all(list(x) == list(y) for x, y in zip(replay_items, direct_items)):
+                mismatched_points.append(point)
+
+    return mismatched_points
+
+
+# A grouped layer should never take more cycles or DRAM accesses than its expansion in one layer per group,
+# the way the depthwise layers used to be simulated
+# Each expanded layer counts its cycles from its own cycle 0, so the expansion gets back a cycle per extra layer
+# The replay of the grouped layers is checked as well, see check_grouped_replay()
+def check_grouped_cases(cases, top_path):
+    failed_cases = []
+    for case in cases:
+        case_path = os.path.join(top_path, case['name'])
+        if not os.path.isdir(case_path):
+            os.makedirs(case_path)
+
+        conf_file = os.path.join(case_path, 'grouped_check.cfg')
+        write_case_config(case, conf_file)
+        config = scale_config()
+        config.read_conf_file(conf_file)
+
+        topology_file = os.path.join(repo_path, case['topology'])
+        grouped_topology = topologies()
+        grouped_topology.load_arrays(topofile=topology_file)
+        expanded_topology = topologies()
+        expanded_topology.load_arrays(topofile=topology_file, expand_groups=True)
+
+        grouped_items = get_summed_report_items(config, grouped_topology)
+        expanded_items = get_summed_report_items(config, expanded_topology)
+        expanded_items[0] += expanded_topology.get_num_layers() - grouped_topology.get_num_layers()
+
+        status = 'ok'
+        if any(x > y for x, y in zip(grouped_items, expanded_items)):
+            status = 'SLOWER THAN EXPANDED'
+            failed_cases.append(case['name'])
+        elif len(check_grouped_replay(config, grouped_topology)) > 0:
+            status = 'REPLAY MISMATCH'
+            failed_cases.append(case['name'])
+
+        print(case['name'].ljust(28) + ' cycles ' + str(grouped_items[0]) + ' / ' + str(expanded_items[0])
+              + ', DRAM accesses ' + str(sum(grouped_items[1:])) + ' / ' + str(sum(expanded_items[1:]))
+              + '  ' + status)
+
+    return failed_cases
+
+
+#
+def get_git_commit():
+    try:
+        proc = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_path, capture_output=True, text=True)
+    except OSError:
+        return ''
+    return proc.stdout.strip()
+
+
+# Machine and version info, the timings are only comparable on the same machine
+def get_meta():
+    import numpy as np
+
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'git_commit': get_git_commit(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+# A case regresses when it is slower than the baseline by more than the threshold (and min_delta seconds),
+# or when its reports do not match the ones of the baseline
+def compare_to_baseline(results, baseline, threshold=0.2, min_delta=0.1):
+    regressions = []
+    baseline_cases = baseline['cases']
+
+    print('\n' + 'Case'.ljust(28) + 'Baseline (s)'.rjust(14) + 'Current (s)'.rjust(14)
+          + 'Ratio'.rjust(8) + '  Status')
+    for name in sorted(results.keys()):
+        current = results[name]
+        if name not in baseline_cases:
+            print(name.ljust(28) + '-'.rjust(14) + "{:14.3f}".format(current['time_s']) + '-'.rjust(8) + '  new')
+            continue
+
+        base = baseline_cases[name]
+        ratio = current['time_s'] / max(base['time_s'], 1e-9)
+
+        status = 'ok'
+        if not current['checksums'] == base['checksums']:
+            status = 'CHECKSUM MISMATCH'
+            regressions.append(name)
+        elif ratio > 1 + threshold and current['time_s'] - base['time_s'] > min_delta:
+            status = 'SLOWDOWN'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            status = 'faster'
+
+        print(name.ljust(28) + "{:14.3f}".format(base['time_s']) + "{:14.3f}".format(current['time_s'])
+              + "{:8.2f}".format(ratio) + '  ' + status)
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the benchmark cases and compare them to a baseline')
+    parser.add_argument('-p', metavar='log dir', type=str,
+                        default="./test_runs/benchmark",
+                        help="Directory for the reports of the cases"
+                        )
+    parser.add_argument('-o', metavar='results file', type=str,
+                        default="./test_runs/benchmark/BENCHMARK_RESULTS.json",
+                        help="Path to the JSON file with the results"
+                        )
+    parser.add_argument('--baseline', metavar='baseline file', type=str,
+                        default="",
+                        help="JSON results to compare to, eg. test/benchmark/baseline.json"
+                        )
+    parser.add_argument('--threshold', metavar='ratio', type=float,
+                        default=0.2,
+                        help="Relative slowdown over the baseline which is flagged"
+                        )
+    parser.add_argument('--min-delta', metavar='seconds', type=float,
+                        default=0.1,
+                        help="Slowdowns shorter than this are not flagged"
+                        )
+    parser.add_argument('--repeat', metavar='N', type=int,
+                        default=1,
+                        help="Number of runs of each case, the best time is kept"
+                        )
+    parser.add_argument('--cases', metavar='name', type=str, nargs='*',
+                        default=[],
+                        help="Only run the cases whose name contains one of these"
+                        )
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Write the results to the baseline file instead of comparing"
+                        )
+    parser.add_argument('--run-case', metavar='name', type=str,
+                        default="",
+                        help=argparse.SUPPRESS
+                        )
+    args = parser.parse_args()
+
+    all_cases = get_benchmark_cases()
+    top_path = os.path.abspath(args.p)
+
+    # Worker mode, the result is sent back on stdout
+    if not args.run_case == '':
+        case_by_name = {x['name']: x for x in all_cases}
+        assert args.run_case in case_by_name, 'Unknown benchmark case: ' + args.run_case
+        result = run_case(case_by_name[args.run_case], top_path)
+        print(result_marker + json.dumps(result))
+        sys.exit(0)
+
+    cases = all_cases
+    if len(args.cases) > 0:
+        cases = [x for x in all_cases if any(name in x['name'] for name in args.cases)]
+
+    print('Running ' + str(len(cases)) + ' benchmark cases')
+    results = {'meta': get_meta(),
+               'cases': run_benchmarks(cases, top_path, repeat=max(1, args.repeat))}
+
+    failed_cases = len(cases) - len(results['cases'])
+
+    if args.save_baseline:
+        assert not args.baseline == '', 'The baseline file is needed to save the baseline'
+        results_file = args.baseline
+    else:
+        results_file = args.o
+
+    results_dir = os.path.dirname(os.path.abspath(results_file))
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print('Results: ' + results_file)
+
+    # The cases with grouped layers are also checked against their expansion
+    grouped_cases = [x for x in cases if x['name'].startswith('depthwise')]
+    grouped_failures = []
+    if len(grouped_cases) > 0:
+        print('\nGrouped layers against their expansion (grouped / expanded):')
+        grouped_failures = check_grouped_cases(grouped_cases, top_path)
+
+    regressions = []
+    if not args.save_baseline and not args.baseline == '':
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results['cases'], baseline,
+                                          threshold=args.threshold, min_delta=args.min_delta)
+        print('\n' + str(len(regressions)) + ' regressions over ' + args.baseline)
+
+    if failed_cases > 0 or len(regressions) > 0 or len(grouped_failures) > 0:
+        sys.exit(1)